@@ -5,6 +5,7 @@ import os
 import json
 
 import qrcode
+import razorpay
 import io
 import base64
 from twilio.rest import Client
@@ -15,7 +16,7 @@ from sqlalchemy import func
 
 # 1. Setup App & Config
 from config import Config
-from database.models import db, User, ParkingLot, Slot, Booking, Review
+from database.models import db, User, ParkingLot, Slot, Booking, Review, OccupancyTimeline, LotDailyStat
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -46,11 +47,31 @@ def send_confirmation_sms(to_number, customer_name, slot_label, amount):
         print(f"⚠️ SMS Failed: {e}")
 
 # 2. Import Detector
+DETECTOR_AVAILABLE = True
 try:
-    from core.detector import generate_frames
+    import core.detector as detector
+    from core.detector import generate_frames, invalidate_lot_state
+    from core.status_table import set_status_table, elect_writer, clear_status
+    from core.slot_manager import invalidate_lot, LotGeometry, save_geometry, remove_geometry, set_geometry_folder
+    from core.capture import video_frame_shape
+    from core.metrics import set_metrics_enabled, render_metrics
+    from core.engine import start_occupancy_engine
+    from core.scheduler import start_detection_scheduler
+    from core.batch import start_batch_analysis, fail_interrupted_timelines, timeline_utilization
 except ImportError:
+    DETECTOR_AVAILABLE = False
     print("⚠️ Warning: core.detector not found.")
 
+# 3. Booking modules (no OpenCV needed)
+from core.availability import get_availability, note_booking, drop_booking, invalidate_availability
+from core.booking import configure_sqlite, place_hold, release_hold, reserve_booking, reserve_bookings, SlotTaken
+from core.rollups import lot_totals, forget_bookings, drop_lot_rollups, rebuild_rollups
+from core.paging import keyset_page
+
+# SQLite in WAL mode: page reads don't wait for booking writes (core/booking.py)
+with app.app_context():
+    configure_sqlite(db.engine, app.config.get('BOOKING_LOCK_TIMEOUT_SECONDS', 10.0))
+
 def allowed_file(filename, file_type):
     if file_type == 'image':
         return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'png', 'jpg', 'jpeg'}
@@ -223,15 +244,23 @@ def provider_dashboard():
         flash("⚠️ Your account is NOT verified yet. Your parking lots are hidden from customers.", "warning")
 
     my_lots = db.session.query(ParkingLot).filter_by(provider_id=provider_id).all()
-    total_income = db.session.query(func.sum(Booking.amount)).join(Slot).join(ParkingLot).filter(ParkingLot.provider_id == provider_id).scalar() or 0.0
-    today = date.today()
-    daily_income = db.session.query(func.sum(Booking.amount)).join(Slot).join(ParkingLot).filter(ParkingLot.provider_id == provider_id).filter(func.date(Booking.start_time) == today).scalar() or 0.0
-    bookings = db.session.query(Booking).join(Slot).join(ParkingLot).filter(ParkingLot.provider_id == provider_id).order_by(Booking.start_time.desc()).all()
-    
-    # Fetch Reviews for all lots owned by this provider
-    reviews = db.session.query(Review).join(ParkingLot).filter(ParkingLot.provider_id == provider_id).order_by(Review.created_at.desc()).all()
-
-    return render_template('provider/dashboard.html', lots=my_lots, bookings=bookings, total_income=round(total_income, 2), daily_income=round(daily_income, 2), reviews=reviews, is_verified=provider.is_verified)
+    lot_ids = [lot.id for lot in my_lots]
+    # Income from the lots' revenue rollups: two rows per lot, however long the history
+    totals = lot_totals(lot_ids, date.today())
+
+    # One page of bookings and of reviews (?before= / ?reviews_before= for older ones),
+    # sought per slot / lot through their time indexes instead of sorting the whole history
+    slot_ids = [slot_id for slot_id, in db.session.query(Slot.id).filter(Slot.parking_lot_id.in_(lot_ids))]
+    bookings, older_bookings = keyset_page(Booking, Booking.start_time, Booking.slot_id, slot_ids,
+                                           request.args.get('before'), app.config.get('PROVIDER_BOOKINGS_PAGE_SIZE', 25))
+    reviews, older_reviews = keyset_page(Review, Review.created_at, Review.parking_lot_id, lot_ids,
+                                         request.args.get('reviews_before'), app.config.get('PROVIDER_REVIEWS_PAGE_SIZE', 12))
+
+    return render_template('provider/dashboard.html', lots=my_lots, bookings=bookings, total_income=round(totals['total_income'], 2),
+                           daily_income=round(totals['daily_income'], 2), daily_bookings=totals['daily_bookings'],
+                           daily_hours=round(totals['daily_hours'], 1), reviews=reviews, is_verified=provider.is_verified,
+                           older_bookings=older_bookings, older_reviews=older_reviews,
+                           paged=bool(request.args.get('before')), reviews_paged=bool(request.args.get('reviews_before')))
 
 @app.route('/provider/create_lot', methods=['GET', 'POST'])
 def create_lot():
@@ -316,6 +345,25 @@ def save_slots():
         new_slot = Slot(parking_lot_id=lot_id, slot_label=f"Slot-{i+1}", points=points_json)
         db.session.add(new_slot)
     db.session.commit()
+
+    # Drop the detector's compiled geometry and slot snapshot so the new polygons are picked up
+    invalidate_lot(lot_id)
+    invalidate_lot_state(lot_id)
+    invalidate_availability(lot_id)
+
+    # Compile the new polygons once and store them for the detector workers
+    if app.config.get('SLOT_GEOMETRY_FOLDER'):
+        try:
+            lot = db.session.get(ParkingLot, lot_id)
+            slots = db.session.query(Slot).filter_by(parking_lot_id=lot_id).all()
+            frame_shape = video_frame_shape(lot.video_path) if lot and lot.video_path else None
+            save_geometry(LotGeometry(lot_id, 0, slots), frame_shape)
+        except Exception as e:
+            print(f"⚠️ Geometry Save Failed (lot {lot_id}): {e}")
+
+    # Pre-compute the occupancy timeline of the uploaded video in the background
+    if app.config.get('DETECTOR_BATCH_ON_SAVE'):
+        start_batch_analysis(app, lot_id)
     return jsonify({"status": "success"})
 
 @app.route('/provider/delete_lot/<int:lot_id>', methods=['POST'])
@@ -327,8 +375,13 @@ def delete_lot(lot_id):
         for slot in slots:
             db.session.query(Booking).filter_by(slot_id=slot.id).delete()
         db.session.query(Slot).filter_by(parking_lot_id=lot_id).delete()
+        drop_lot_rollups(lot_id)
         db.session.delete(lot)
         db.session.commit()
+        remove_geometry(lot_id)
+        invalidate_lot_state(lot_id)
+        invalidate_availability(lot_id)
+        clear_status(lot_id)
         flash('Lot Deleted.')
     return redirect(url_for('provider_dashboard'))
 
@@ -358,19 +411,8 @@ def view_lot(lot_id):
     if not lot: return "Lot not found", 404
     slots = db.session.query(Slot).filter_by(parking_lot_id=lot_id).all()
     
-    # Calculate Slot Status
-    now = datetime.now()
-    slot_status = {slot.id: 'available' for slot in slots}
-    
-    bookings = db.session.query(Booking).join(Slot).filter(Slot.parking_lot_id == lot_id, Booking.is_active == True).all()
-    
-    for b in bookings:
-        if b.start_time <= now <= b.end_time:
-            slot_status[b.slot_id] = 'full' # Red (Occupied/Active)
-        elif b.start_time > now and b.start_time.date() == now.date():
-            # Only mark as reserved if currently available (don't overwrite 'full')
-            if slot_status[b.slot_id] == 'available':
-                slot_status[b.slot_id] = 'reserved' # Yellow (Future today)
+    # Calculate Slot Status: full = booked right now (Red), reserved = booked later today (Yellow)
+    slot_status = lot_availability(lot_id).statuses(datetime.now())
 
     # Fetch Reviews
     reviews = db.session.query(Review).filter_by(parking_lot_id=lot_id).order_by(Review.created_at.desc()).all()
@@ -380,22 +422,123 @@ def view_lot(lot_id):
 
 @app.route('/video_feed/<int:lot_id>')
 def video_feed(lot_id):
-    return Response(generate_frames(lot_id), mimetype='multipart/x-mixed-replace; boundary=frame')
+    # ?profile=full|preview|thumb (see STREAM_PROFILES in config.py)
+    profile = request.args.get('profile', 'full')
+    if profile not in app.config['STREAM_PROFILES']:
+        profile = 'full'
+    return Response(generate_frames(lot_id, profile), mimetype='multipart/x-mixed-replace; boundary=frame')
 
 @app.route('/api/live_status/<int:lot_id>')
 def features_live_status(lot_id):
-    # Retrieve status from the shared GLOBAL CACHE in detector.py
-    # This ensures exact synchronization with the video feed being generated.
+    # Retrieve status from the shared status table (core/status_table.py)
+    # Filled by the video feed producer, or by the headless engine when nobody is watching.
     try:
-        from core.detector import LOT_STATUS_CACHE
-        if lot_id in LOT_STATUS_CACHE:
-             return jsonify(LOT_STATUS_CACHE[lot_id])
+        # ?since=<seq> returns only the transitions after that sequence number
+        since = request.args.get('since', type=int)
+        if since is not None:
+            from core.events import find_event_log
+            # The detector's log, or its sequence numbers in the shared status table
+            log = find_event_log(lot_id)
+            if log is None:
+                return jsonify({'seq': 0, 'reset': True, 'slots': {}})
+            # Unchanged since the client's last poll: 304 without building the body
+            etag = log.etag(since)
+            if etag in request.if_none_match:
+                response = Response(status=304)
+            else:
+                response = jsonify(log.since(since))
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+
+        from core.detector import get_lot_status
+        statuses = get_lot_status(lot_id)
+        if statuses is not None:
+             response = jsonify(statuses)
+             response.add_etag()
+             response.headers['Cache-Control'] = 'no-cache'
+             return response.make_conditional(request)
         else:
-             # Fallback if video hasn't started or cache empty
+             # Fallback until the first frame of this lot has been analyzed
              return jsonify({})
     except ImportError:
          return jsonify({})
 
+@app.route('/api/live_status/<int:lot_id>/stream')
+def live_status_stream(lot_id):
+    # Server-Sent Events: the same payloads as ?since=, pushed when a slot changes
+    if not db.session.get(ParkingLot, lot_id): return "Not found", 404
+    since = request.headers.get('Last-Event-ID', type=int) or request.args.get('since', 0, type=int)
+    
+    from core.events import stream_events
+    response = Response(stream_events(lot_id, since, app.config.get('LIVE_STATUS_KEEPALIVE_SECONDS', 15.0)),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the events
+    return response
+
+@app.route('/api/lot_utilization/<int:lot_id>')
+def lot_utilization(lot_id):
+    if 'user_id' not in session or session.get('role') != 'provider': return jsonify({'error': 'Unauthorized'}), 403
+    lot = db.session.get(ParkingLot, lot_id)
+    if not lot or lot.provider_id != session['user_id']: return jsonify({'error': 'Lot not found'}), 404
+    
+    # Answered from the latest stored timeline, never by replaying the video
+    timeline = db.session.query(OccupancyTimeline).filter_by(parking_lot_id=lot_id, status='done') \
+        .order_by(OccupancyTimeline.created_at.desc()).first()
+    if not timeline:
+        return jsonify({'status': 'pending', 'message': 'Video has not been analyzed yet.'})
+    
+    # ?start=&end= are seconds into the video
+    start = request.args.get('start', 0.0, type=float)
+    end = request.args.get('end', type=float)
+    result = timeline_utilization(timeline.slot_runs(), timeline.duration, start, end)
+    result.update({'status': 'done', 'analyzed_at': timeline.created_at.isoformat(), 'duration': timeline.duration})
+    return jsonify(result)
+
+# --- SLOT AVAILABILITY API ---
+def lot_availability(lot_id):
+    return get_availability(lot_id, app.config.get('AVAILABILITY_SYNC_SECONDS', 1.0),
+                            app.config.get('AVAILABILITY_REBUILD_SECONDS', 300.0))
+
+def parse_booking_window(start_str, duration):
+    """(start, end) of a booking from the form's start time and duration in hours."""
+    try: start_time = datetime.strptime(start_str, '%Y-%m-%dT%H:%M')
+    except ValueError: start_time = datetime.strptime(start_str, '%Y-%m-%dT%H:%M:%S')
+    return start_time, start_time + timedelta(hours=duration)
+
+@app.route('/api/availability/<int:lot_id>')
+def lot_availability_api(lot_id):
+    # ?start=2026-03-02T10:00&duration=2 -> which slots are free for the whole window
+    if not db.session.get(ParkingLot, lot_id): return jsonify({'error': 'Lot not found'}), 404
+    try:
+        start_time, end_time = parse_booking_window(request.args['start'], int(request.args.get('duration', 1)))
+    except (KeyError, ValueError):
+        return jsonify({'error': 'Expected ?start=YYYY-MM-DDTHH:MM&duration=<hours>'}), 400
+
+    window = lot_availability(lot_id).window(start_time, end_time)
+    return jsonify({
+        'lot_id': lot_id, 'start': start_time.isoformat(), 'end': end_time.isoformat(),
+        'free': sorted(slot_id for slot_id, free in window.items() if free),
+        'booked': sorted(slot_id for slot_id, free in window.items() if not free),
+    })
+
+@app.route('/api/availability/<int:lot_id>/slot/<int:slot_id>')
+def slot_availability_api(lot_id, slot_id):
+    # Same query string; also answers when the slot is next free for that long
+    slot = db.session.get(Slot, slot_id)
+    if not slot or slot.parking_lot_id != lot_id: return jsonify({'error': 'Slot not found'}), 404
+    try:
+        start_time, end_time = parse_booking_window(request.args['start'], int(request.args.get('duration', 1)))
+    except (KeyError, ValueError):
+        return jsonify({'error': 'Expected ?start=YYYY-MM-DDTHH:MM&duration=<hours>'}), 400
+
+    next_free = lot_availability(lot_id).next_free(slot_id, start_time, end_time - start_time)
+    return jsonify({
+        'slot_id': slot_id, 'start': start_time.isoformat(), 'end': end_time.isoformat(),
+        'free': next_free == start_time, 'next_free': next_free.isoformat(timespec='minutes'),
+    })
+
 # --- REVIEWS & RATING ---
 @app.route('/submit_review', methods=['POST'])
 def submit_review():
@@ -485,43 +628,42 @@ def book_slot_confirm():
     if 'user_id' not in session: return jsonify({"status": "error", "message": "Login required"})
     
     data = request.json
-    slot_id = data.get('slot_id')
+    slot_id = int(data.get('slot_id'))
     start_str = data.get('start_time')
     duration = int(data.get('duration'))
     
     # 1. Parse Time
-    try: start_time = datetime.strptime(start_str, '%Y-%m-%dT%H:%M')
-    except: start_time = datetime.strptime(start_str, '%Y-%m-%dT%H:%M:%S')
-    end_time = start_time + timedelta(hours=duration)
+    start_time, end_time = parse_booking_window(start_str, duration)
     
-    # 2. Conflict Check
-    conflict = db.session.query(Booking).filter(
-        Booking.slot_id == slot_id, Booking.is_active == True,
-        Booking.start_time < end_time, Booking.end_time > start_time
-    ).first()
-    if conflict: return jsonify({"status": "error", "message": "Slot already booked!"})
-
-    # 3. Create Booking
+    # 2. Price: no conflict check here, the availability index can lag behind
+    # deleted or expired bookings; reserve_booking below makes the only decision
     slot = db.session.get(Slot, slot_id)
+    lot_id = slot.parking_lot_id
     total_cost = slot.parking_lot.hourly_rate * duration
     
     # Generate Secure Unique Ticket ID
     import uuid
     secure_ticket_id = str(uuid.uuid4())[:5].upper()
     
-    new_booking = Booking(
-        slot_id=slot_id, user_id=session['user_id'],
-        ticket_uuid=secure_ticket_id,
-        customer_name=data.get('name'),
-        phone_number=data.get('phone'),
-        vehicle_number=data.get('vehicle'),
-        start_time=start_time, end_time=end_time,
-        amount=total_cost, 
-        payment_status='Paid',
-        payment_method='Razorpay Online'
-    )
-    db.session.add(new_booking)
-    db.session.commit()
+    # 3. Create Booking: conflict check and insert in one write section, so two
+    # concurrent requests for the same slot can't both pass the check.
+    # The customer's hold (taken before payment) becomes the booking
+    try:
+        new_booking = reserve_booking(
+            slot_id, start_time, end_time, hold_token=data.get('hold_token'),
+            user_id=session['user_id'],
+            ticket_uuid=secure_ticket_id,
+            customer_name=data.get('name'),
+            phone_number=data.get('phone'),
+            vehicle_number=data.get('vehicle'),
+            amount=total_cost, 
+            payment_status='Paid',
+            payment_method='Razorpay Online'
+        )
+    except SlotTaken:
+        return jsonify({"status": "error", "message": "Slot already booked!"})
+    invalidate_lot_state(lot_id)
+    note_booking(lot_id, new_booking.id, slot_id, start_time, end_time)
 
     # 4. SEND SMS & WHATSAPP
     # send_confirmation_sms(data.get('phone'), data.get('name'), slot.slot_label, total_cost)
@@ -534,12 +676,140 @@ def book_slot_confirm():
         "ticket_uuid": new_booking.ticket_uuid 
     })
 
+@app.route('/api/book_bulk', methods=['POST'])
+def book_bulk():
+    # Fleet / corporate bookings: many slots in one request and one transaction; tickets sent on WhatsApp
+    # { name, phone, vehicle?, all_or_nothing?, hold_tokens?: [...],
+    #   items: [ { slot_id, start_time, duration, vehicle? }, ... ] }
+    if 'user_id' not in session: return jsonify({"status": "error", "message": "Login required"})
+    
+    data = request.json or {}
+    items = data.get('items') or []
+    max_items = app.config.get('BULK_BOOKING_MAX_ITEMS', 100)
+    if not items or len(items) > max_items:
+        return jsonify({"status": "error", "message": f"Send between 1 and {max_items} items."}), 400
+    
+    # 1. Parse Items
+    results = [None] * len(items)
+    parsed = []  # (index, slot_id, start, end, duration, vehicle)
+    for i, item in enumerate(items):
+        try:
+            duration = int(item.get('duration'))
+            start_time, end_time = parse_booking_window(item.get('start_time'), duration)
+            parsed.append((i, int(item.get('slot_id')), start_time, end_time, duration, item.get('vehicle') or data.get('vehicle')))
+        except (TypeError, ValueError):
+            results[i] = {'index': i, 'status': 'error', 'message': 'Invalid slot_id, start_time or duration.'}
+    
+    # 2. Slots and Rates, one query for all items
+    slots = {slot.id: (slot.slot_label, slot.parking_lot_id, rate) for slot, rate in
+             db.session.query(Slot, ParkingLot.hourly_rate).join(ParkingLot)
+             .filter(Slot.id.in_({p[1] for p in parsed})).all()}
+    
+    import uuid
+    ticket_ids = set()
+    requests, request_items = [], []
+    for i, slot_id, start_time, end_time, duration, vehicle in parsed:
+        if slot_id not in slots:
+            results[i] = {'index': i, 'status': 'error', 'message': 'Slot not found.'}
+            continue
+        ticket = str(uuid.uuid4())[:5].upper()
+        while ticket in ticket_ids:
+            ticket = str(uuid.uuid4())[:5].upper()
+        ticket_ids.add(ticket)
+        requests.append(dict(
+            slot_id=slot_id, user_id=session['user_id'], ticket_uuid=ticket,
+            customer_name=data.get('name'), phone_number=data.get('phone'), vehicle_number=vehicle,
+            start_time=start_time, end_time=end_time, amount=slots[slot_id][2] * duration,
+            payment_status='Paid', payment_method='Razorpay Online'
+        ))
+        request_items.append(i)
+    
+    if data.get('all_or_nothing') and any(results):
+        return jsonify({"status": "error", "message": "Nothing booked: some items are invalid.", "booked": 0, "results": [
+            r or {'index': i, 'status': 'error', 'message': 'Not booked (all or nothing).'} for i, r in enumerate(results)]})
+    
+    # 3. Create Bookings: one conflict query and one transaction for the whole batch
+    outcomes = reserve_bookings(requests, data.get('hold_tokens') or (), bool(data.get('all_or_nothing'))) if requests else []
+    messages = {'taken': 'Slot already booked for that time!', 'overlap': 'Overlaps an earlier item of this request.',
+                'skipped': 'Not booked (all or nothing).'}
+    tickets, lots = [], set()
+    for i, req, (booking_id, reason) in zip(request_items, requests, outcomes):
+        if reason:
+            results[i] = {'index': i, 'status': 'error', 'message': messages[reason]}
+            continue
+        label, lot_id, _ = slots[req['slot_id']]
+        results[i] = {'index': i, 'status': 'booked', 'booking_id': booking_id, 'ticket_uuid': req['ticket_uuid'],
+                      'slot': label, 'amount': req['amount']}
+        tickets.append(dict(results[i], vehicle=req['vehicle_number'], start=req['start_time'], end=req['end_time']))
+        note_booking(lot_id, booking_id, req['slot_id'], req['start_time'], req['end_time'])
+        lots.add(lot_id)
+    for lot_id in lots:
+        invalidate_lot_state(lot_id)
+    
+    # 4. WhatsApp: the whole batch in as few messages as fit
+    total = round(sum(t['amount'] for t in tickets), 2)
+    if tickets:
+        send_whatsapp_tickets(data.get('phone'), data.get('name'), tickets, total)
+    
+    status = 'success' if len(tickets) == len(items) else ('partial' if tickets else 'error')
+    return jsonify({"status": status, "booked": len(tickets), "total_amount": total, "results": results})
+
+@app.route('/api/hold', methods=['POST'])
+def hold_slot():
+    # Keeps the slot for this customer while they pay (Config.BOOKING_HOLD_SECONDS)
+    if 'user_id' not in session: return jsonify({"status": "error", "message": "Login required"})
+    
+    data = request.json
+    slot_id = int(data.get('slot_id'))
+    if not db.session.get(Slot, slot_id): return jsonify({"status": "error", "message": "Slot not found"}), 404
+    start_time, end_time = parse_booking_window(data.get('start_time'), int(data.get('duration')))
+    
+    try:
+        hold = place_hold(slot_id, start_time, end_time, session['user_id'], app.config.get('BOOKING_HOLD_SECONDS', 300))
+    except SlotTaken:
+        return jsonify({"status": "error", "message": "Slot already booked or being booked by someone else!"})
+    return jsonify({"status": "success", "hold_token": hold.token, "expires_at": hold.expires_at.isoformat()})
+
+@app.route('/api/hold/<token>', methods=['DELETE'])
+def release_slot_hold(token):
+    # Payment dialog closed without booking: free the slot before the hold expires
+    if 'user_id' not in session: return jsonify({"status": "error", "message": "Login required"})
+    release_hold(token, session['user_id'])
+    return jsonify({"status": "success"})
+
 # --- HELPER: WHATSAPP ---
+WHATSAPP_MAX_CHARS = 1600  # Longest message body Twilio sends
+
 def send_whatsapp_ticket(to_number, customer_name, slot_label, amount, start, end, booking_id):
+    # Construct body
+    msg_body = f"🅿️ *SmartPark Ticket*\n\nHi *{customer_name}*,\nYour booking is confirmed! ✅\n\n🆔 *Booking ID:* #{booking_id}\n📍 *Slot:* {slot_label}\n💰 *Amount:* ₹{amount}\n📅 *Start:* {start}\n🔚 *End:* {end}\n\n📍 *Locate Slot:* https://maps.google.com/?q=parking\n\nShow this message at the gate."
+    send_whatsapp(to_number, msg_body)
+
+def send_whatsapp_tickets(to_number, customer_name, tickets, total):
+    # A bulk booking's tickets, as few messages as fit Twilio's body limit
+    # tickets = [ {booking_id, ticket_uuid, slot, vehicle, start, end, amount} ]
+    lines = [f"🆔 #{t['booking_id']} ({t['ticket_uuid']}) 📍 {t['slot']} 🚗 {t['vehicle'] or '-'}\n    📅 {t['start']} → {t['end']} 💰 ₹{t['amount']}"
+             for t in tickets]
+    header = f"🅿️ *SmartPark Tickets*\n\nHi *{customer_name}*,\n{len(tickets)} bookings are confirmed! ✅\n\n"
+    footer = f"\n\n💰 *Total:* ₹{total}\n\nShow the ticket ID of each vehicle at the gate."
+
+    # Room for the header, footer and a "(part i/n)" line in every message
+    room = WHATSAPP_MAX_CHARS - message_length(header + footer) - 20
+    parts = [[]]
+    for line in lines:
+        if parts[-1] and message_length("\n".join(parts[-1] + [line])) > room:
+            parts.append([])
+        parts[-1].append(line)
+    for i, part in enumerate(parts, 1):
+        numbered = f"(part {i}/{len(parts)})\n" if len(parts) > 1 else ""
+        send_whatsapp(to_number, header + numbered + "\n".join(part) + footer)
+
+def message_length(msg_body):
+    # Twilio counts UTF-16 code units: emoji outside the BMP count twice
+    return len(msg_body.encode('utf-16-le')) // 2
+
+def send_whatsapp(to_number, msg_body):
     try:
-        # Construct body
-        msg_body = f"🅿️ *SmartPark Ticket*\n\nHi *{customer_name}*,\nYour booking is confirmed! ✅\n\n🆔 *Booking ID:* #{booking_id}\n📍 *Slot:* {slot_label}\n💰 *Amount:* ₹{amount}\n📅 *Start:* {start}\n🔚 *End:* {end}\n\n📍 *Locate Slot:* https://maps.google.com/?q=parking\n\nShow this message at the gate."
-        
         # Ensure number has country code (Assuming +91 for India if missing)
         formatted_num = f"whatsapp:{to_number}" if to_number.startswith('+') else f"whatsapp:+91{to_number}"
         
@@ -604,7 +874,48 @@ def start_background_worker():
     thread.daemon = True
     thread.start()
 
-start_background_worker()
+# --- BACKGROUND TASK: HEADLESS OCCUPANCY DETECTION ---
+# Keeps /api/live_status fresh for every lot, even when nobody is watching the video
+# DETECTOR_WORKERS > 0 moves capture and analysis into worker processes
+def start_detector():
+    detector.ANALYSIS_OFFLOADED = False  # The scheduler sets it again
+    if app.config.get('DETECTOR_WORKERS'):
+        start_detection_scheduler(app)
+    else:
+        start_occupancy_engine(app)
+
+def start_services():
+    # Background jobs of a serving process (python app.py, gunicorn app:app, asgi.py)
+    start_background_worker()
+    if DETECTOR_AVAILABLE:
+        set_geometry_folder(app.config.get('SLOT_GEOMETRY_FOLDER'))
+        set_metrics_enabled(app.config.get('DETECTOR_METRICS_ENABLED'))
+        table = set_status_table(app.config.get('STATUS_TABLE_PATH'),
+                                 app.config.get('STATUS_TABLE_LOTS', 256), app.config.get('STATUS_TABLE_SLOTS', 512))
+        if app.config.get('DETECTOR_HEADLESS_ENABLED'):
+            # With a shared status table one process (gunicorn worker) runs the
+            # detector and writes; the others draw its statuses on their video feeds
+            detector.ANALYSIS_OFFLOADED = table is not None
+            elect_writer(start_detector)
+
+# Not in the detection worker processes: under python app.py, spawn re-runs
+# this file in each of them as __mp_main__
+if __name__ != '__mp_main__':
+    start_services()
+
+@app.route('/admin/detector_stats')
+def detector_stats():
+    if session.get('role') != 'admin': return jsonify({'error': 'Unauthorized'}), 403
+    
+    # Skip ratio of the motion-gated detector per lot, for tuning DETECTOR_MOTION_*
+    from core.detector import LOT_INCREMENTAL_COUNTERS
+    return jsonify({lot_id: counter.stats() for lot_id, counter in LOT_INCREMENTAL_COUNTERS.items()})
+
+@app.route('/metrics')
+def detector_metrics():
+    # Prometheus scrape target: per-stage detector timings, frame counters, viewers, status age
+    if not app.config.get('DETECTOR_METRICS_ENABLED'): return "Metrics disabled", 404
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/admin/get_user/<int:user_id>')
 def get_user_details(user_id):
@@ -652,11 +963,14 @@ def delete_user(user_id):
                 for slot in slots:
                     db.session.query(Booking).filter_by(slot_id=slot.id).delete()
                 db.session.query(Slot).filter_by(parking_lot_id=lot.id).delete()
+                drop_lot_rollups(lot.id)
                 db.session.delete(lot)
         elif user_to_delete.role == 'customer':
+            forget_bookings(db.session.query(Booking).filter_by(user_id=user_id)) # Their revenue leaves the lots' totals
             db.session.query(Booking).filter_by(user_id=user_id).delete()
         db.session.delete(user_to_delete)
         db.session.commit()
+        invalidate_availability() # Their bookings may be spread over any lot
         flash('User deleted successfully.', 'success')
     return redirect(url_for('admin_dashboard'))
 
@@ -731,6 +1045,7 @@ def scan_gate_api():
             # --- CHECK IN ---
             booking.check_in_time = now
             db.session.commit()
+            invalidate_lot_state(lot_id)
             return jsonify({
                 'status': 'success', 
                 'mode': 'entry', 
@@ -752,6 +1067,8 @@ def scan_gate_api():
                 overstay_msg = f"⚠️ Overstayed by {minutes} mins."
                 
             db.session.commit()
+            invalidate_lot_state(lot_id)
+            drop_booking(lot_id, booking.id) # Rest of the booked time is free again
             return jsonify({
                 'status': 'success', 
                 'mode': 'exit', 
@@ -782,4 +1099,10 @@ def download_log(lot_id):
 if __name__ == "__main__":
     with app.app_context():
         db.create_all()
+        # Revenue rollups of a database from before them (see migrate_rollups.py)
+        if not db.session.query(LotDailyStat).first() and db.session.query(Booking).first():
+            print(f"Built {rebuild_rollups()} revenue rollup rows")
+        # Batch analyses cut off when the server last stopped
+        if DETECTOR_AVAILABLE and fail_interrupted_timelines():
+            db.session.commit()
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,23 @@
+"""
+Async serving mode: the video feeds and live status streams run as tasks
+on one event loop instead of one thread per open connection, so thousands
+of viewers fit in a single process. All other routes are the Flask app,
+served unchanged.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000 --timeout-graceful-shutdown 5
+    python asgi.py
+
+Streams never end on their own, so without a graceful shutdown timeout a
+restart waits for every viewer to leave.
+
+Run a single process: lot streams, detector state and status events live
+in process memory and are shared by every connection of that process.
+"""
+from app import app
+from core.asgi import StreamingApp
+
+application = StreamingApp(app)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(application, host='0.0.0.0', port=5000, timeout_graceful_shutdown=5)
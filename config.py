@@ -31,4 +31,107 @@ class Config:
     # Twilio (SMS Service) - Optional if you don't need SMS immediately
     TWILIO_SID = "AC_YOUR_ACCOUNT_SID"               # Paste SID here
     TWILIO_AUTH_TOKEN = "YOUR_AUTH_TOKEN"            # Paste Auth Token here
-    TWILIO_PHONE_NUMBER = "+1234567890"              # Paste Twilio Phone Number here
\ No newline at end of file
+    TWILIO_PHONE_NUMBER = "+1234567890"              # Paste Twilio Phone Number here
+
+    # 6. Detector Settings
+    # Slot counting engine: 'roi' (one masked count per slot) or
+    # 'labelmap' (all slots counted in a single pass over the frame)
+    DETECTOR_COUNT_ENGINE = 'labelmap'
+
+    # Seconds a lot's shared capture keeps running after its last viewer left
+    DETECTOR_STREAM_GRACE_SECONDS = 10.0
+    # Frames a lot's video is decoded ahead of the analysis (oldest dropped when full)
+    DETECTOR_PREFETCH_FRAMES = 2
+    # Wait before reopening a video source that stopped delivering frames
+    DETECTOR_RECONNECT_SECONDS = 2.0
+
+    # /video_feed/<lot_id>?profile=... Each profile is encoded once per frame
+    # no matter how many viewers use it.
+    # width: output width in pixels (None = camera resolution), fps: None = every frame
+    STREAM_PROFILES = {
+        'full': {'width': None, 'quality': 95, 'fps': None},
+        'preview': {'width': 640, 'quality': 70, 'fps': 10},
+        'thumb': {'width': 320, 'quality': 60, 'fps': 2},
+    }
+
+    # /api/live_status/<lot_id>/stream (Server-Sent Events): seconds between
+    # keep-alive comments while no slot changes
+    LIVE_STATUS_KEEPALIVE_SECONDS = 15.0
+
+    # Background analysis of every lot, independent of video viewers
+    DETECTOR_HEADLESS_ENABLED = True
+    DETECTOR_ANALYSIS_FPS = 1.0          # Frames analyzed per second per lot
+    DETECTOR_LOT_REFRESH_SECONDS = 30.0  # How often new/removed lots are picked up
+    DETECTOR_STATE_REFRESH_SECONDS = 5.0 # Max age of a lot's slot/booking snapshot (saves and bookings refresh it at once)
+
+    # Multi-core detection (core/scheduler.py). 0 = analyze in a thread of the
+    # web process; N = spread lots over N worker processes, each decoding and
+    # analyzing the lots assigned to it
+    DETECTOR_WORKERS = 0
+    DETECTOR_MAX_FPS = 20.0               # Cap on frames analyzed per second, all lots together
+    DETECTOR_VIEWER_ANALYSIS_FPS = 5.0    # Analysis rate for lots someone is watching
+    DETECTOR_NEAR_CAPACITY = 0.9          # Occupied share from which a lot is analyzed first
+
+    # Motion-gated incremental analysis: only slots whose pixels changed since
+    # the last analyzed frame are recounted; everything is recounted every
+    # DETECTOR_FULL_REFRESH_FRAMES frames to guard against drift
+    DETECTOR_INCREMENTAL = True
+    DETECTOR_MOTION_THRESHOLD = 25        # Gray-level change that counts as motion
+    DETECTOR_MOTION_MIN_CHANGED = 0.02    # Share of a slot's area that must change
+    DETECTOR_FULL_REFRESH_FRAMES = 50
+
+    # Analysis resolution. Frames are downscaled by this factor before
+    # preprocessing (slot polygons are scaled to match); 1.0 = camera resolution
+    DETECTOR_ANALYSIS_SCALE = 1.0
+    # Occupied when this share of a slot's area is set after thresholding.
+    # None keeps the fixed 800-pixel threshold (scaled with DETECTOR_ANALYSIS_SCALE)
+    DETECTOR_OCCUPIED_RATIO = None
+
+    # Batch analysis of a lot's uploaded video into a stored occupancy
+    # timeline (core/batch.py), started whenever the lot's slots are saved
+    DETECTOR_BATCH_ON_SAVE = True
+    DETECTOR_BATCH_STRIDE = 1             # Analyze every Nth frame
+
+    # Precompiled slot geometry (polygons, masks, label map), written as
+    # lot_<id>.npz whenever a lot's slots are saved and loaded by the detector
+    # instead of rasterizing the polygons again. None = always compile
+    SLOT_GEOMETRY_FOLDER = os.path.join(BASE_DIR, 'instance', 'slot_geometry')
+
+    # Per-stage timings and frame counters per lot (core/metrics.py), served
+    # in the Prometheus text format on /metrics. False = nothing is recorded
+    DETECTOR_METRICS_ENABLED = True
+
+    # Slot statuses shared by every process (detector, web workers) through a
+    # memory-mapped table, so /api/live_status agrees across gunicorn workers.
+    # Only one process runs the headless detector and writes it (elected with
+    # a lock on <path>.writer); another takes over when it exits.
+    # None (or Windows) = each process runs its own detector and only sees
+    # the statuses it computed itself
+    STATUS_TABLE_PATH = os.path.join(BASE_DIR, 'instance', 'slot_status.bin')
+    STATUS_TABLE_LOTS = 256               # Lots the table has room for
+    STATUS_TABLE_SLOTS = 512              # Slots per lot
+
+    # 7. Booking Settings
+    # Slot availability (core/availability.py) is answered from an in-memory
+    # index of each lot's bookings, updated in place on this process' writes.
+    # Bookings made by other processes show up within SYNC seconds; their
+    # check-outs and deletions when the index is rebuilt, so it is only shown
+    # to customers; bookings are accepted or refused by the database check
+    AVAILABILITY_SYNC_SECONDS = 1.0
+    AVAILABILITY_REBUILD_SECONDS = 300.0
+
+    # Booking writes (core/booking.py): a hold keeps a slot for a customer
+    # while they pay, and expires on its own after this many seconds
+    BOOKING_HOLD_SECONDS = 300
+    # SQLite runs in WAL mode; a booking waits up to this long for another
+    # process' booking write to finish
+    BOOKING_LOCK_TIMEOUT_SECONDS = 10.0
+    # Most items one /api/book_bulk request may book
+    BULK_BOOKING_MAX_ITEMS = 100
+
+    # Provider dashboard: bookings and reviews shown per page (older pages are
+    # sought by keyset, not skipped over). Its income totals come from the
+    # per-lot daily rollups (core/rollups.py); migrate_rollups.py builds them
+    # for an existing database
+    PROVIDER_BOOKINGS_PAGE_SIZE = 25
+    PROVIDER_REVIEWS_PAGE_SIZE = 12
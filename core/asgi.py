@@ -0,0 +1,137 @@
+import asyncio
+import re
+from urllib.parse import parse_qs
+
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi
+
+from core.events import astream_events
+from core.stream import open_stream
+
+# Long-lived endpoints served on the event loop; everything else goes to Flask
+VIDEO_FEED_PATH = re.compile(r'^/video_feed/(\d+)$')
+STATUS_STREAM_PATH = re.compile(r'^/api/live_status/(\d+)/stream$')
+
+
+def _lot_exists(flask_app, lot_id):
+    from database.models import db, ParkingLot
+
+    with flask_app.app_context():
+        try:
+            return db.session.get(ParkingLot, lot_id) is not None
+        finally:
+            db.session.remove()
+
+
+class StreamingApp:
+    """
+    ASGI application for the async serving mode (see asgi.py).
+
+    /video_feed/<lot_id> and /api/live_status/<lot_id>/stream run as
+    coroutines on the event loop, reading the same shared producers
+    (core.stream) and event logs (core.events) as the Flask routes, so an
+    open connection costs a task instead of a thread. Every other request
+    is handed to the Flask app, each in its own worker thread.
+
+    `producer` and `lot_exists` default to the detector and the database;
+    the load test (scripts/load_test_streams.py) swaps in synthetic ones.
+    """
+
+    def __init__(self, flask_app, producer=None, lot_exists=None):
+        self.app = flask_app
+        self.wsgi = WsgiToAsgi(flask_app)
+        if producer is None:
+            from core.detector import _produce_frames as producer
+        self.producer = producer
+        self.lot_exists = lot_exists or (lambda lot_id: _lot_exists(flask_app, lot_id))
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            match = VIDEO_FEED_PATH.match(scope['path'])
+            if match:
+                return await self.video_feed(int(match.group(1)), scope, receive, send)
+            match = STATUS_STREAM_PATH.match(scope['path'])
+            if match:
+                return await self.status_stream(int(match.group(1)), scope, receive, send)
+
+        async with ThreadSensitiveContext():
+            await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # --- Streaming endpoints ---
+    async def video_feed(self, lot_id, scope, receive, send):
+        # Same as the Flask route: ?profile=full|preview|thumb
+        profiles = self.app.config.get('STREAM_PROFILES')
+        profile = parse_qs(scope['query_string'].decode()).get('profile', ['full'])[0]
+        if profile not in profiles:
+            profile = 'full'
+
+        stream = open_stream(lot_id, self.producer, profile,
+                             grace_seconds=self.app.config.get('DETECTOR_STREAM_GRACE_SECONDS', 10.0),
+                             profiles=profiles)
+
+        async def parts():
+            try:
+                async for frame in stream.aframes(profile):
+                    yield b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n'
+            finally:
+                stream.unsubscribe(profile)
+
+        await self.stream(receive, send, b'multipart/x-mixed-replace; boundary=frame', parts())
+
+    async def status_stream(self, lot_id, scope, receive, send):
+        if not await asyncio.get_running_loop().run_in_executor(None, self.lot_exists, lot_id):
+            await send({'type': 'http.response.start', 'status': 404,
+                        'headers': [(b'content-type', b'text/plain')]})
+            return await send({'type': 'http.response.body', 'body': b'Not found'})
+
+        headers = dict(scope['headers'])
+        query = parse_qs(scope['query_string'].decode())
+        try:
+            since = int(headers.get(b'last-event-id') or query.get('since', ['0'])[0])
+        except ValueError:
+            since = 0
+
+        async def events():
+            async for event in astream_events(lot_id, since,
+                                              self.app.config.get('LIVE_STATUS_KEEPALIVE_SECONDS', 15.0)):
+                yield event.encode()
+
+        await self.stream(receive, send, b'text/event-stream', events())
+
+    async def stream(self, receive, send, content_type, body):
+        """Sends `body` chunk by chunk until it ends or the client disconnects."""
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', content_type),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ]})
+
+        async def pump():
+            async for chunk in body:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        async def disconnected():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(disconnected())]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await body.aclose()
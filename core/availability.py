@@ -0,0 +1,198 @@
+import bisect
+import threading
+import time
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from sqlalchemy import func
+
+# Interval index of the not yet ended bookings per lot, read from the DB once
+# and then updated in place by note_booking() / drop_booking()
+# Format: { lot_id: LotAvailability }
+LOT_AVAILABILITY = {}
+_lock = threading.Lock()
+
+
+class SlotIntervals:
+    """
+    One slot's bookings sorted by start time. `reach[i]` is the latest end
+    among the first i + 1 of them, so whether anything overlaps [start, end)
+    is a single bisect, even where old bookings overlap each other.
+    """
+    __slots__ = ('starts', 'ends', 'ids', 'reach', 'start_of')
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.ids = []
+        self.reach = []
+        self.start_of = {}  # { booking_id: start }
+
+    def add(self, booking_id, start, end):
+        if booking_id in self.start_of:
+            return
+        i = bisect.bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        self.ids.insert(i, booking_id)
+        self.start_of[booking_id] = start
+        self._reach_from(i)
+
+    def remove(self, booking_id):
+        start = self.start_of.pop(booking_id, None)
+        if start is None:
+            return
+        i = bisect.bisect_left(self.starts, start)
+        while self.ids[i] != booking_id:
+            i += 1
+        del self.starts[i], self.ends[i], self.ids[i]
+        self._reach_from(i)
+
+    def _reach_from(self, i):
+        # Bookings are mostly added at the end, so this is usually one or two items
+        if i:
+            self.reach[i:] = list(accumulate(self.ends[i:], max, initial=self.reach[i - 1]))[1:]
+        else:
+            self.reach[:] = accumulate(self.ends, max)
+
+    def is_free(self, start, end):
+        i = bisect.bisect_left(self.starts, end)
+        return i == 0 or self.reach[i - 1] <= start
+
+    def next_free(self, after, length):
+        """Earliest time from `after` on at which the slot is free for `length`."""
+        t = after
+        while True:
+            i = bisect.bisect_left(self.starts, t + length)
+            if i == 0 or self.reach[i - 1] <= t:
+                return t
+            t = self.reach[i - 1]  # That booking overlaps any window starting before its end
+
+    def status_at(self, now, day_end):
+        i = bisect.bisect_right(self.starts, now)
+        if i and self.reach[i - 1] >= now:
+            return 'full'       # A booking is running
+        if i < len(self.starts) and self.starts[i] < day_end:
+            return 'reserved'   # One starts later today
+        return 'available'
+
+
+class LotAvailability:
+    """The bookings of every slot of a lot, as SlotIntervals (thread-safe)."""
+
+    def __init__(self, lot_id, slot_ids, last_booking_id):
+        self.lot_id = lot_id
+        self.slots = {slot_id: SlotIntervals() for slot_id in slot_ids}
+        self.slot_of = {}  # { booking_id: slot_id }
+        self.last_booking_id = last_booking_id  # Bookings after it are fetched by the next sync
+        self.built_at = self.synced_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self, booking_id, slot_id, start, end):
+        with self.lock:
+            intervals = self.slots.get(slot_id)
+            if intervals is None:
+                intervals = self.slots[slot_id] = SlotIntervals()
+            intervals.add(booking_id, start, end)
+            self.slot_of[booking_id] = slot_id
+
+    def remove(self, booking_id):
+        with self.lock:
+            slot_id = self.slot_of.pop(booking_id, None)
+            if slot_id is not None:
+                self.slots[slot_id].remove(booking_id)
+
+    def window(self, start, end):
+        """{ slot_id: True if free for all of [start, end) }"""
+        with self.lock:
+            return {slot_id: intervals.is_free(start, end) for slot_id, intervals in self.slots.items()}
+
+    def is_free(self, slot_id, start, end):
+        with self.lock:
+            intervals = self.slots.get(slot_id)
+            return intervals is None or intervals.is_free(start, end)
+
+    def next_free(self, slot_id, after, length):
+        with self.lock:
+            intervals = self.slots.get(slot_id)
+            return after if intervals is None else intervals.next_free(after, length)
+
+    def statuses(self, now):
+        """{ slot_id: 'full' | 'reserved' | 'available' } at `now`, as on the lot page."""
+        day_end = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        with self.lock:
+            return {slot_id: intervals.status_at(now, day_end) for slot_id, intervals in self.slots.items()}
+
+
+def _lot_bookings_query(lot_id, after_id=None, up_to_id=None):
+    """Query of the lot's active bookings not yet ended, only ids (after_id, up_to_id] if given."""
+    from database.models import db, Slot, Booking
+
+    query = db.session.query(Booking.id, Booking.slot_id, Booking.start_time, Booking.end_time).join(Slot).filter(
+        Slot.parking_lot_id == lot_id, Booking.is_active == True, Booking.end_time >= datetime.now())
+    if after_id is not None:
+        query = query.filter(Booking.id > after_id, Booking.id <= up_to_id)
+    return query
+
+def _lot_bookings(lot_id, after_id=None, up_to_id=None):
+    return _lot_bookings_query(lot_id, after_id, up_to_id).all()
+
+def _last_booking_id():
+    from database.models import db, Booking
+    return db.session.query(func.max(Booking.id)).scalar() or 0
+
+def build_availability(lot_id):
+    """Reads a lot's index from the DB (three queries, all scoped to the lot or the primary key)."""
+    from database.models import db, Slot
+
+    last_id = _last_booking_id()  # Read first: anything committed after it is picked up by a sync
+    slot_ids = [slot_id for slot_id, in db.session.query(Slot.id).filter_by(parking_lot_id=lot_id).all()]
+    availability = LotAvailability(lot_id, slot_ids, last_id)
+    for booking_id, slot_id, start, end in _lot_bookings(lot_id):
+        availability.add(booking_id, slot_id, start, end)
+    with _lock:
+        LOT_AVAILABILITY[lot_id] = availability
+    return availability
+
+def _sync(availability):
+    """Adds the lot's bookings written since the last sync (e.g. by other worker processes)."""
+    last_id = _last_booking_id()
+    if last_id > availability.last_booking_id:
+        for booking_id, slot_id, start, end in _lot_bookings(availability.lot_id, availability.last_booking_id, last_id):
+            availability.add(booking_id, slot_id, start, end)
+        availability.last_booking_id = max(availability.last_booking_id, last_id)
+    availability.synced_at = time.monotonic()
+
+def get_availability(lot_id, sync_seconds=1.0, rebuild_seconds=300.0):
+    """
+    A lot's LotAvailability. Bookings made by this process are in it at once;
+    new ones from other processes after at most `sync_seconds`, and their
+    check-outs and deletions after at most `rebuild_seconds`.
+    """
+    availability = LOT_AVAILABILITY.get(lot_id)
+    now = time.monotonic()
+    if availability is None or now - availability.built_at > rebuild_seconds:
+        return build_availability(lot_id)
+    if now - availability.synced_at > sync_seconds:
+        _sync(availability)
+    return availability
+
+def note_booking(lot_id, booking_id, slot_id, start, end):
+    """Call after a booking was committed."""
+    availability = LOT_AVAILABILITY.get(lot_id)
+    if availability is not None:
+        availability.add(booking_id, slot_id, start, end)
+
+def drop_booking(lot_id, booking_id):
+    """Call after a booking was checked out or cancelled."""
+    availability = LOT_AVAILABILITY.get(lot_id)
+    if availability is not None:
+        availability.remove(booking_id)
+
+def invalidate_availability(lot_id=None):
+    """Call after a lot's slots changed or bookings were deleted; None = every lot."""
+    with _lock:
+        if lot_id is None:
+            LOT_AVAILABILITY.clear()
+        else:
+            LOT_AVAILABILITY.pop(lot_id, None)
@@ -0,0 +1,211 @@
+import json
+import threading
+import time
+
+import cv2
+
+from core.detector import occupied_flags
+from core.events import EVENT_DEBOUNCE_FRAMES
+from core.slot_manager import LotGeometry
+from core.vision_utils import FramePipeline, IncrementalCounter
+
+# Lots with a batch analysis in progress, and those of them whose slots were
+# saved again since it started (analyzed again once it stops)
+_running = set()
+_rerun = set()
+_running_lock = threading.Lock()
+
+
+class AnalysisCancelled(Exception):
+    """The lot's slots were saved again while its video was being analyzed."""
+
+
+class TimelineBuilder:
+    """
+    Run-length encodes per-slot occupancy: only state changes are kept, as
+    [seconds, state] pairs. A new state must hold for `debounce_frames`
+    analyzed frames; it is then dated back to the frame where it started.
+    """
+
+    def __init__(self, slot_ids, debounce_frames=EVENT_DEBOUNCE_FRAMES):
+        self.debounce_frames = debounce_frames
+        self.runs = {slot_id: [] for slot_id in slot_ids}
+        self.pending = {}  # { slot_id: (state, first seen at, frames seen) }
+
+    def add(self, t, states):
+        for slot_id, state in states.items():
+            runs = self.runs[slot_id]
+            if not runs:
+                runs.append([round(t, 2), state])
+                continue
+            if runs[-1][1] == state:
+                self.pending.pop(slot_id, None)
+                continue
+            seen = self.pending.get(slot_id)
+            if seen and seen[0] == state:
+                seen = (state, seen[1], seen[2] + 1)
+            else:
+                seen = (state, t, 1)
+            if seen[2] >= self.debounce_frames:
+                runs.append([round(seen[1], 2), state])
+                self.pending.pop(slot_id, None)
+            else:
+                self.pending[slot_id] = seen
+
+
+def analyze_video(video_path, slots, config, cancelled=None):
+    """
+    Runs the whole video through the detector as fast as the CPU allows (no
+    drawing, no encoding, no pacing) and returns (runs, duration, frames).
+    Raises AnalysisCancelled as soon as `cancelled()` is true.
+    """
+    scale = config.get('DETECTOR_ANALYSIS_SCALE', 1.0)
+    stride = max(1, int(config.get('DETECTOR_BATCH_STRIDE', 1)))
+    engine = config.get('DETECTOR_COUNT_ENGINE', 'roi')
+    occupied_ratio = config.get('DETECTOR_OCCUPIED_RATIO')
+
+    # Own geometry + counter: a batch run must not disturb the live detector
+    geometry = LotGeometry(None, 0, slots, scale)
+    counter = IncrementalCounter(
+        motion_threshold=config.get('DETECTOR_MOTION_THRESHOLD', 25),
+        min_changed=config.get('DETECTOR_MOTION_MIN_CHANGED', 0.02),
+        full_refresh=config.get('DETECTOR_FULL_REFRESH_FRAMES', 50),
+    )
+    timeline = TimelineBuilder([slot.id for slot in geometry.slots])
+
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    index = frames = 0
+    img = pipeline = None  # Decoded into and preprocessed with the same buffers every frame
+    try:
+        while True:
+            if cancelled is not None and cancelled():
+                raise AnalysisCancelled()
+            # Frames between strides are only grabbed, never decoded into images
+            if index % stride:
+                if not cap.grab():
+                    break
+                index += 1
+                continue
+            success, img = cap.read(image=img)
+            if not success:
+                break
+
+            if pipeline is None or not pipeline.matches(geometry, img.shape, scale):
+                pipeline = FramePipeline(geometry, img.shape, scale)
+            counts = counter.count(pipeline.gray(img), geometry, engine, pipeline)
+            flags = occupied_flags(geometry, counts, occupied_ratio)
+            timeline.add(index / fps, {slot.id: 'full' if occupied else 'available'
+                                       for slot, occupied in zip(geometry.slots, flags)})
+            index += 1
+            frames += 1
+    finally:
+        cap.release()
+    return timeline.runs, index / fps, frames
+
+
+def fail_interrupted_timelines(lot_id=None):
+    """
+    Marks the timelines still 'running' as 'failed': runs cut off by a
+    restart or a crash, which would otherwise stay 'running' for good.
+    """
+    from database.models import db, OccupancyTimeline
+
+    query = db.session.query(OccupancyTimeline).filter_by(status='running')
+    if lot_id is not None:
+        query = query.filter_by(parking_lot_id=lot_id)
+    return query.update({OccupancyTimeline.status: 'failed'}, synchronize_session=False)
+
+
+def run_batch_analysis(app, lot_id, cancelled=None):
+    """Analyzes the lot's video and stores the result as an OccupancyTimeline."""
+    from database.models import db, ParkingLot, Slot, OccupancyTimeline
+
+    with app.app_context():
+        lot = db.session.get(ParkingLot, lot_id)
+        if not lot: return
+        slots = db.session.query(Slot).filter_by(parking_lot_id=lot_id).all()
+
+        # Only one run per lot at a time (start_batch_analysis), so an older running one was interrupted
+        fail_interrupted_timelines(lot_id)
+        timeline = OccupancyTimeline(parking_lot_id=lot_id, video_path=lot.video_path, status='running')
+        db.session.add(timeline)
+        db.session.commit()
+
+        started = time.monotonic()
+        try:
+            runs, duration, frames = analyze_video(lot.video_path, slots, app.config, cancelled)
+            timeline.runs = json.dumps(runs, separators=(',', ':'))
+            timeline.duration = duration
+            timeline.frames = frames
+            timeline.status = 'done'
+            print(f"📼 Batch analysis of lot {lot_id}: {frames} frames in {time.monotonic() - started:.1f}s")
+        except AnalysisCancelled:
+            timeline.status = 'cancelled'
+            print(f"📼 Batch analysis of lot {lot_id} restarted: its slots were saved again")
+        except Exception as e:
+            timeline.status = 'failed'
+            print(f"⚠️ Batch analysis of lot {lot_id} failed: {e}")
+        db.session.commit()
+
+
+def start_batch_analysis(app, lot_id):
+    """
+    Runs run_batch_analysis in the background. For a lot already being
+    analyzed, that run is cancelled and started again with the new slots;
+    returns False then.
+    """
+    with _running_lock:
+        if lot_id in _running:
+            _rerun.add(lot_id)
+            return False
+        _running.add(lot_id)
+
+    def run():
+        try:
+            while True:
+                run_batch_analysis(app, lot_id, cancelled=lambda: lot_id in _rerun)
+                with _running_lock:
+                    if lot_id not in _rerun:
+                        _running.discard(lot_id)
+                        return
+                    _rerun.discard(lot_id)
+        except BaseException:
+            with _running_lock:
+                _running.discard(lot_id)
+                _rerun.discard(lot_id)
+            raise
+
+    thread = threading.Thread(target=run, name=f"batch-analysis-{lot_id}")
+    thread.daemon = True
+    thread.start()
+    return True
+
+
+def timeline_utilization(slot_runs, duration, start=0.0, end=None):
+    """
+    Occupied seconds and share per slot within [start, end) of the video,
+    straight from the stored runs.
+    """
+    end = duration if end is None else min(end, duration)
+    window = max(end - start, 0.0)
+
+    slots = {}
+    for slot_id, runs in slot_runs.items():
+        occupied = 0.0
+        for i, (t, state) in enumerate(runs):
+            run_end = runs[i + 1][0] if i + 1 < len(runs) else duration
+            if state == 'full':
+                occupied += max(0.0, min(run_end, end) - max(t, start))
+        slots[slot_id] = {
+            'occupied_seconds': round(occupied, 2),
+            'utilization': round(occupied / window, 4) if window else 0.0,
+        }
+
+    total = sum(s['occupied_seconds'] for s in slots.values())
+    return {
+        'start': start,
+        'end': end,
+        'utilization': round(total / (window * len(slots)), 4) if window and slots else 0.0,
+        'slots': slots,
+    }
@@ -0,0 +1,234 @@
+import secrets
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, literal, select, union, union_all, and_, DateTime, Integer
+
+from core.rollups import record_bookings
+
+# Serializes the booking write sections of this process, so its threads queue
+# here instead of polling SQLite's busy handler for the database lock
+_write_lock = threading.Lock()
+
+# Most requested windows per conflict query: SQLite allows 500 UNION ALL
+# terms, and older builds 999 bound parameters (four per window)
+_UNION_TERMS = 200
+
+
+class SlotTaken(Exception):
+    """The slot is booked or held by someone else for (part of) the requested time."""
+
+
+def configure_sqlite(engine, lock_timeout=10.0):
+    """
+    WAL journal for the app's SQLite database: reads never wait for a booking
+    write section, and commits don't fsync the whole file. Waits up to
+    `lock_timeout` seconds for the write lock held by another process.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute(f'PRAGMA busy_timeout={int(lock_timeout * 1000)}')
+        cursor.close()
+
+
+@contextmanager
+def write_section(*slot_ids):
+    """
+    Runs a conflict check and the write that depends on it atomically: one
+    thread of this process at a time, and on SQLite one process at a time
+    (BEGIN IMMEDIATE takes the database write lock before the check). On
+    other databases the slots' rows are locked instead. Commits at the end,
+    rolls back on errors. Call before the request writes anything else.
+    """
+    from database.models import db, Slot
+
+    with _write_lock:
+        try:
+            if db.engine.dialect.name == 'sqlite':
+                db.session.connection().exec_driver_sql('BEGIN IMMEDIATE')
+            else:
+                db.session.query(Slot.id).filter(Slot.id.in_(slot_ids)).order_by(Slot.id).with_for_update().all()
+            yield
+            db.session.commit()
+        except BaseException:
+            db.session.rollback()
+            raise
+
+
+def _purge_expired_holds(slot_ids, now):
+    # Run by every booking write, so expired holds never pile up
+    from database.models import db, SlotHold
+
+    db.session.query(SlotHold).filter(SlotHold.slot_id.in_(slot_ids), SlotHold.expires_at <= now) \
+        .delete(synchronize_session=False)
+
+
+def _booked(slot_id, start, end):
+    """Query of the slot's active bookings overlapping [start, end)."""
+    from database.models import db, Booking
+
+    return db.session.query(Booking.id).filter(
+        Booking.slot_id == slot_id, Booking.is_active == True,
+        Booking.start_time < end, Booking.end_time > start
+    )
+
+
+def _held(slot_id, start, end, now, hold_token=None):
+    """Query of the slot's live holds overlapping [start, end), except the one of `hold_token`."""
+    from database.models import db, SlotHold
+
+    held = db.session.query(SlotHold.id).filter(
+        SlotHold.slot_id == slot_id, SlotHold.expires_at > now,
+        SlotHold.start_time < end, SlotHold.end_time > start
+    )
+    if hold_token:
+        held = held.filter(SlotHold.token != hold_token)
+    return held
+
+
+def _check_free(slot_id, start, end, now, hold_token=None):
+    """Raises SlotTaken if an active booking or someone else's live hold overlaps [start, end)."""
+    _purge_expired_holds([slot_id], now)
+
+    if _booked(slot_id, start, end).first():
+        raise SlotTaken(f"Slot {slot_id} is already booked")
+    if _held(slot_id, start, end, now, hold_token).first():
+        raise SlotTaken(f"Slot {slot_id} is held by another customer")
+
+
+def place_hold(slot_id, start, end, user_id=None, seconds=300.0):
+    """Keeps the slot free for this customer for `seconds`; returns the (committed) SlotHold."""
+    from database.models import db, SlotHold
+
+    now = datetime.now()
+    hold = SlotHold(slot_id=slot_id, user_id=user_id, token=secrets.token_hex(16),
+                    start_time=start, end_time=end, expires_at=now + timedelta(seconds=seconds))
+    with write_section(slot_id):
+        _check_free(slot_id, start, end, now)
+        db.session.add(hold)
+    return hold
+
+
+def release_hold(token, user_id=None):
+    """Gives a hold up before it expires (e.g. the customer closed the payment dialog)."""
+    from database.models import db, SlotHold
+
+    query = db.session.query(SlotHold).filter_by(token=token)
+    if user_id is not None:
+        query = query.filter_by(user_id=user_id)
+    removed = query.delete(synchronize_session=False)
+    db.session.commit()
+    return bool(removed)
+
+
+def reserve_booking(slot_id, start, end, hold_token=None, **fields):
+    """
+    Books the slot for [start, end) unless that overlaps another booking or
+    another customer's live hold (SlotTaken). The customer's own hold, given
+    by `hold_token`, is turned into the booking; an expired one is no longer
+    needed. `fields` are the other Booking columns. The lot's revenue rollups
+    are updated in the same transaction. Returns the committed Booking.
+    """
+    from database.models import db, Booking, SlotHold
+
+    now = datetime.now()
+    booking = Booking(slot_id=slot_id, start_time=start, end_time=end, **fields)
+    with write_section(slot_id):
+        _check_free(slot_id, start, end, now, hold_token)
+        if hold_token:
+            db.session.query(SlotHold).filter_by(token=hold_token).delete(synchronize_session=False)
+        db.session.add(booking)
+        record_bookings([booking])
+    return booking
+
+
+def _taken_windows_query(windows, now, hold_tokens=(), offset=0):
+    """
+    Statement selecting the indexes (numbered from `offset`) of the `windows`
+    [(slot_id, start, end)] overlapping an active booking or someone else's
+    live hold. At most _UNION_TERMS windows.
+    """
+    from database.models import Booking, SlotHold
+
+    requested = union_all(*[
+        select(literal(i, Integer).label('idx'), literal(slot_id, Integer).label('slot_id'),
+               literal(start, DateTime).label('start_time'), literal(end, DateTime).label('end_time'))
+        for i, (slot_id, start, end) in enumerate(windows, offset)
+    ]).cte('requested')
+
+    booked = select(requested.c.idx).join(Booking, and_(
+        Booking.slot_id == requested.c.slot_id, Booking.is_active == True,
+        Booking.start_time < requested.c.end_time, Booking.end_time > requested.c.start_time))
+    held = select(requested.c.idx).join(SlotHold, and_(
+        SlotHold.slot_id == requested.c.slot_id, SlotHold.expires_at > now,
+        SlotHold.start_time < requested.c.end_time, SlotHold.end_time > requested.c.start_time,
+        SlotHold.token.not_in(hold_tokens)))
+    return union(booked, held)
+
+
+def _taken_windows(windows, now, hold_tokens=()):
+    """
+    Indexes of the `windows` [(slot_id, start, end)] overlapping an active
+    booking or someone else's live hold, checked in one query per
+    _UNION_TERMS windows.
+    """
+    from database.models import db
+
+    taken = set()
+    for offset in range(0, len(windows), _UNION_TERMS):
+        query = _taken_windows_query(windows[offset:offset + _UNION_TERMS], now, hold_tokens, offset)
+        taken.update(idx for idx, in db.session.execute(query))
+    return taken
+
+
+def reserve_bookings(requests, hold_tokens=(), all_or_nothing=False):
+    """
+    Books many slots at once (fleet bookings). `requests` are dicts of Booking
+    columns, each with slot_id, start_time and end_time. A query per
+    _UNION_TERMS of them checks them against the existing bookings and holds, and every booking is inserted
+    in one transaction, with the lots' revenue rollups. The customer's own
+    holds are given by `hold_tokens`.
+
+    Returns per request (booking id, None) or (None, reason): 'taken' (booked
+    or held by someone else), 'overlap' (with an earlier request of the same
+    batch) or 'skipped' (`all_or_nothing` and another request failed).
+    """
+    from database.models import db, Booking, SlotHold
+
+    now = datetime.now()
+    windows = [(r['slot_id'], r['start_time'], r['end_time']) for r in requests]
+    slot_ids = sorted({slot_id for slot_id, _, _ in windows})
+    reasons = [None] * len(requests)
+
+    with write_section(*slot_ids):
+        _purge_expired_holds(slot_ids, now)
+        for i in _taken_windows(windows, now, list(hold_tokens)):
+            reasons[i] = 'taken'
+
+        # Within the batch, the first of two overlapping requests wins
+        accepted = {}  # { slot_id: [(start, end)] }
+        for i, (slot_id, start, end) in enumerate(windows):
+            if reasons[i]:
+                continue
+            if any(s < end and e > start for s, e in accepted.get(slot_id, ())):
+                reasons[i] = 'overlap'
+            else:
+                accepted.setdefault(slot_id, []).append((start, end))
+
+        if all_or_nothing and any(reasons):
+            return [(None, reason or 'skipped') for reason in reasons]
+
+        bookings = [None if reason else Booking(**r) for r, reason in zip(requests, reasons)]
+        if hold_tokens:
+            db.session.query(SlotHold).filter(SlotHold.token.in_(list(hold_tokens))).delete(synchronize_session=False)
+        db.session.add_all([b for b in bookings if b])
+        record_bookings([b for b in bookings if b])
+        results = [(b.id, None) if b else (None, reason) for b, reason in zip(bookings, reasons)]
+    return results
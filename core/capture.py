@@ -0,0 +1,175 @@
+import threading
+import time
+from collections import deque
+
+import cv2
+
+from core.metrics import inc, observe_stage
+
+
+class HeadlessSource:
+    """
+    Capture that stays aligned with wall-clock time however slowly it is
+    read. Only the newest frame due is decoded; the frames in between are
+    skipped with grab().
+    """
+
+    def __init__(self, video_path):
+        self.video_path = video_path
+        self.cap = cv2.VideoCapture(video_path)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 25.0
+        self._last_read = None
+
+    def read_latest(self, out=None):
+        """Newest due frame, decoded into `out` when its shape matches."""
+        now = time.monotonic()
+        due = 1 if self._last_read is None else max(1, int((now - self._last_read) * self.fps))
+        self._last_read = now
+
+        for _ in range(due - 1):
+            if not self.cap.grab():
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                break
+
+        success, img = self.cap.read(image=out)
+        if not success:
+            # End of clip: loop like the live feed does
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            success, img = self.cap.read(image=out)
+        return img if success else None
+
+    def release(self):
+        self.cap.release()
+
+
+class PrefetchSource:
+    """
+    Capture decoded ahead on its own thread into a small bounded queue, so
+    decoding the next frame overlaps with analyzing the current one.
+
+    The reader keeps pace with wall-clock time at `target_fps` (skipping the
+    frames in between with grab(), like HeadlessSource), loops the clip at
+    its end and reopens the source when it stops delivering frames; the
+    consumer never waits on any of that. When the queue is full the oldest
+    frame is dropped, and read_latest() always hands out the newest one.
+
+    Frame arrays are recycled: the one read_latest() returned is decoded
+    into again after the next read_latest() call.
+
+    With a `lot_id`, decode time and dropped frames go to core.metrics.
+    """
+
+    def __init__(self, video_path, queue_size=2, drop_oldest=True, reconnect_seconds=2.0, lot_id=None):
+        self.video_path = video_path
+        self.lot_id = lot_id
+        self.cap = cv2.VideoCapture(video_path)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 25.0
+        self.target_fps = self.fps  # Lowered by the consumer when it needs fewer frames
+        self.queue_size = queue_size
+        self.drop_oldest = drop_oldest
+        self.reconnect_seconds = reconnect_seconds
+
+        self.decoded = 0   # Frames handed to the queue
+        self.dropped = 0   # Frames replaced by a newer one before anyone read them
+        self._frames = deque()
+        self._free = []       # Arrays nobody holds, decoded into before allocating new ones
+        self._handed = None   # The array the consumer is working on
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="prefetch-source", daemon=True)
+        self._thread.start()
+
+    def _read(self, out=None):
+        success, img = self.cap.read(image=out)
+        if success:
+            return img
+
+        # End of clip: loop like the live feed does
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        success, img = self.cap.read(image=out)
+        if success:
+            return img
+
+        # Source gone (camera dropped, file replaced): reopen it
+        print(f"⚠️ Capture lost, reconnecting: {self.video_path}")
+        self.cap.release()
+        with self._cond:
+            self._cond.wait_for(lambda: self._stopped, self.reconnect_seconds)
+        self.cap = cv2.VideoCapture(self.video_path)
+        return None
+
+    def _run(self):
+        last_read = None
+        while not self._stopped:
+            interval = 1.0 / min(self.target_fps, self.fps)
+            if last_read is not None:
+                time.sleep(max(0.0, last_read + interval - time.monotonic()))
+
+            now = time.monotonic()
+            due = 1 if last_read is None else max(1, int((now - last_read) * self.fps))
+            last_read = now
+            started = time.perf_counter()
+            for _ in range(due - 1):
+                if not self.cap.grab():
+                    break
+
+            with self._cond:
+                out = self._free.pop() if self._free else None
+            img = self._read(out)
+            if img is None:
+                continue
+            if self.lot_id is not None:
+                observe_stage(self.lot_id, 'decode', time.perf_counter() - started)
+
+            with self._cond:
+                if len(self._frames) >= self.queue_size:
+                    if self.drop_oldest:
+                        self._recycle(self._frames.popleft())
+                        self._count_dropped(1)
+                    else:
+                        self._cond.wait_for(lambda: len(self._frames) < self.queue_size or self._stopped)
+                self._frames.append(img)
+                self.decoded += 1
+                self._cond.notify_all()
+
+    def read_latest(self, timeout=1.0):
+        """Newest decoded frame (older queued ones are dropped), or None after `timeout` seconds."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._frames or self._stopped, timeout) or not self._frames:
+                return None
+            img = self._frames.pop()
+            self._count_dropped(len(self._frames))
+            while self._frames:
+                self._recycle(self._frames.popleft())
+            if self._handed is not None:
+                self._recycle(self._handed)
+            self._handed = img
+            self._cond.notify_all()
+        return img
+
+    def _count_dropped(self, n):
+        self.dropped += n
+        if self.lot_id is not None:
+            inc('frames_dropped', self.lot_id, n)
+
+    def _recycle(self, img):
+        if len(self._free) <= self.queue_size:
+            self._free.append(img)
+
+    def release(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join(timeout=5.0)
+        self.cap.release()
+
+
+def video_frame_shape(video_path):
+    """(height, width) of a video's frames from its header, or None if it can't be opened."""
+    cap = cv2.VideoCapture(video_path)
+    try:
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    finally:
+        cap.release()
+    return (height, width) if width and height else None
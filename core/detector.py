@@ -1,105 +1,406 @@
 import cv2
 import numpy as np
-import json
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timedelta
+
+from core.capture import PrefetchSource
+from core.events import record_status
+from core.metrics import mark_status, observe_stage
+from core.slot_manager import get_lot_geometry, SlotRow, COUNT_ENGINES
+from core.status_table import publish_status, read_status
+from core.vision_utils import FramePipeline, IncrementalCounter
+from core.stream import open_stream
 
 # GLOBAL CACHE for Slot Status
 # Format: { lot_id: { slot_id: 'full' | 'available' } }
 LOT_STATUS_CACHE = {}
 
-def check_parking_space(img, img_processed, slots, active_bookings, lot_id):
-    overlay = img.copy()
-    
+# Motion-gated counters per lot, used when Config.DETECTOR_INCREMENTAL is on
+# Format: { lot_id: IncrementalCounter }
+LOT_INCREMENTAL_COUNTERS = {}
+
+# Preallocated preprocessing buffers per lot, rebuilt when the geometry or resolution changes
+# Format: { lot_id: FramePipeline }
+LOT_PIPELINES = {}
+
+# Slots and not yet ended bookings per lot, so frames are analyzed without a
+# DB query each. Reread every Config.DETECTOR_STATE_REFRESH_SECONDS, or on
+# the next frame after invalidate_lot_state()
+# Format: { lot_id: LotSnapshot }
+LOT_SNAPSHOTS = {}
+
+# Bumped by invalidate_lot_state(); a snapshot read while it changed is stale
+# Format: { lot_id: int }
+LOT_STATE_VERSIONS = {}
+_state_lock = threading.Lock()
+
+# Set when a DetectionScheduler (core.scheduler) analyzes every lot in worker
+# processes; video producers then only draw the cached statuses.
+ANALYSIS_OFFLOADED = False
+
+# Changed pixels inside a slot (at full resolution) above which it counts as occupied
+OCCUPIED_PIXELS = 800 # Threshold may need adjusting for polygons
+
+# Overlay color per status
+STATUS_COLORS = {
+    'full': (0, 0, 255),        # Red
+    'reserved': (0, 255, 255),  # Yellow
+    'available': (0, 255, 0),   # Green
+}
+
+def occupied_flags(geometry, counts, occupied_ratio=None):
+    """
+    Whether each slot of `geometry` is occupied, from its pixel count.
+    A slot is occupied above `occupied_ratio` of its area, or, by default,
+    above OCCUPIED_PIXELS at full resolution (scaled with the analysis scale).
+    """
+    legacy_threshold = OCCUPIED_PIXELS * geometry.scale ** 2
+    return [count > (occupied_ratio * slot.area if occupied_ratio else legacy_threshold)
+            for slot, count in zip(geometry.slots, counts)]
+
+def classify_counts(geometry, counts, active_bookings, lot_id, occupied_ratio=None):
+    """Turns per-slot pixel counts into statuses and updates the global cache."""
     current_status = {}
     
-    for slot in slots:
-        # 1. Parse the Points (stored as JSON string)
-        try:
-            points = np.array(json.loads(slot.points), np.int32)
-            points = points.reshape((-1, 1, 2))
-        except:
-            continue
-
-        # 2. Create a Mask for this specific polygon
-        mask = np.zeros(img_processed.shape, dtype=np.uint8)
-        cv2.fillPoly(mask, [points], 255)
-        
-        # 3. Extract pixels ONLY inside this polygon
-        img_masked = cv2.bitwise_and(img_processed, img_processed, mask=mask)
-        count = cv2.countNonZero(img_masked)
-
+    for slot, is_occupied in zip(geometry.slots, occupied_flags(geometry, counts, occupied_ratio)):
         # Logic
-        is_occupied = count > 800 # Threshold may need adjusting for polygons
         is_booked = slot.id in active_bookings
         
         status_key = 'available'
         if is_occupied:
-            color = (0, 0, 255)   # Red
-            status = "OCCUPIED"
             status_key = 'full'
         elif is_booked:
-            color = (0, 255, 255) # Yellow
-            status = "BOOKED"
             status_key = 'reserved'
-        else:
-            color = (0, 255, 0)   # Green
-            status = "FREE"
             
         current_status[slot.id] = status_key
 
-        # 4. Draw Polygon
-        cv2.polylines(img, [points], True, color, 2)
-        
-        # 5. Draw Label (Find center of polygon)
-        M = cv2.moments(points)
-        if M["m00"] != 0:
-            cX = int(M["m10"] / M["m00"])
-            cY = int(M["m01"] / M["m00"])
+    # Update Global Cache + shared status table + debounced transition log
+    LOT_STATUS_CACHE[lot_id] = current_status
+    log = record_status(lot_id, current_status)
+    publish_status(lot_id, current_status, log)
+    mark_status(lot_id)
+    return current_status
+
+def get_lot_status(lot_id):
+    """
+    A lot's current {slot_id: status}, or None before its first analyzed
+    frame. Read from the shared status table when there is one, so every
+    web worker sees what the detecting process wrote.
+    """
+    statuses = read_status(lot_id)
+    return statuses if statuses is not None else LOT_STATUS_CACHE.get(lot_id)
+
+def classify_slots(img_processed, slots, active_bookings, lot_id, engine='roi'):
+    """Works out every slot's status and updates the global cache. No drawing."""
+    geometry = get_lot_geometry(lot_id, slots)
+
+    # 1. Count pixels inside every polygon ('roi' = per slot, 'labelmap' = single pass)
+    counts = COUNT_ENGINES[engine](geometry, img_processed)
+
+    return geometry, classify_counts(geometry, counts, active_bookings, lot_id)
+
+# Slot label style
+LABEL_FONT = cv2.FONT_HERSHEY_SIMPLEX
+LABEL_SCALE = 0.5
+LABEL_THICKNESS = 2
+
+# Overlays drawing on less than this share of their window are composited
+# pixel by pixel instead of with whole-window operations
+OVERLAY_SPARSE_SHARE = 0.2
+
+# One BGR pixel as a single numpy item, for writing whole pixels at once
+PIXEL_DTYPE = np.dtype((np.void, 3))
+
+
+class SlotOverlay:
+    """
+    Slot outlines and labels of one lot, rendered once for a frame shape.
+
+    Outlines are kept as a mask plus a layer painted in each slot's status
+    color; only slots whose status changed are repainted. Labels are kept
+    as an alpha map (putText antialiases) and blended over the frame.
+    Drawing order is the same as the old per-slot drawing: a slot's outline
+    covers earlier labels, its label is drawn over earlier outlines.
+    """
+
+    def __init__(self, geometry, shape):
+        outline = np.zeros(shape[:2], dtype=np.int32)  # 0 = none, i + 1 = slot i
+        alpha = np.zeros(shape[:2], dtype=np.uint8)
+        height, width = outline.shape
+        for i, slot in enumerate(geometry.slots):
+            cv2.polylines(outline, [slot.points], True, i + 1, 2)
+            cv2.polylines(alpha, [slot.points], True, 0, 2)
+
+            # putText only draws on 8-bit images: render the label into a
+            # tile around its text box, then merge it into the alpha map
+            cX, cY = slot.centroid
+            (w, h), baseline = cv2.getTextSize(slot.label, LABEL_FONT, LABEL_SCALE, LABEL_THICKNESS)
+            pad = LABEL_THICKNESS + 2
+            x0, y0 = cX - 10 - pad, cY - h - pad
+            tile = np.zeros((h + baseline + 2 * pad, w + 2 * pad), dtype=np.uint8)
+            cv2.putText(tile, slot.label, (pad, h + pad), LABEL_FONT, LABEL_SCALE, 255, LABEL_THICKNESS)
+
+            tx0, ty0 = max(x0, 0), max(y0, 0)
+            tx1, ty1 = min(x0 + tile.shape[1], width), min(y0 + tile.shape[0], height)
+            if tx1 > tx0 and ty1 > ty0:
+                # White over white: coverages combine as 1 - (1 - a) * (1 - b)
+                region = alpha[ty0:ty1, tx0:tx1]
+                clear = (255 - region.astype(np.uint16)) * (255 - tile[ty0 - y0:ty1 - y0, tx0 - x0:tx1 - x0])
+                region[:] = 255 - (clear + 127) // 255
+
+        # Everything below only covers the window where something is drawn
+        ys, xs = np.nonzero((outline > 0) | (alpha > 0))
+        if ys.size:
+            self.window = (slice(ys.min(), ys.max() + 1), slice(xs.min(), xs.max() + 1))
         else:
-            cX, cY = points[0][0][0], points[0][0][1]
+            self.window = None
+            return
+        outline, alpha = outline[self.window], alpha[self.window]
 
-        cv2.putText(img, slot.slot_label, (cX - 10, cY), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255,255,255), 2)
+        # Outline pixels (flat, in the window) grouped by slot:
+        # slot i owns outline_pixels[outline_bounds[i]:outline_bounds[i + 1]]
+        owners = outline.reshape(-1)
+        order = np.argsort(owners, kind='stable')
+        self.outline_pixels = order[np.searchsorted(owners[order], 1):]
+        self.outline_bounds = np.searchsorted(owners[self.outline_pixels], np.arange(1, len(geometry.slots) + 2))
+        label_pixels = np.flatnonzero(alpha)
 
-    # Update Global Cache
-    LOT_STATUS_CACHE[lot_id] = current_status
-    return img
+        # Few drawn pixels: write just those. Otherwise whole-window cv2 ops are faster
+        self.sparse = ys.size < OVERLAY_SPARSE_SHARE * outline.size
+        if self.sparse:
+            def to_frame(pixels):
+                rows, cols = np.divmod(pixels, outline.shape[1])
+                return (rows + self.window[0].start) * width + cols + self.window[1].start
+
+            self.frame_outline = to_frame(self.outline_pixels)
+            self.frame_labels = to_frame(label_pixels)
+            self.label_weights = np.repeat(alpha.reshape(-1)[label_pixels][:, None], 3, axis=1)
+            self.outline_values = np.zeros(self.outline_pixels.size, dtype=PIXEL_DTYPE)
+        else:
+            self.outline_mask = (outline > 0).astype(np.uint8)
+            self.label_alpha = cv2.merge([alpha, alpha, alpha])
+            self.layer = np.zeros(alpha.shape + (3,), dtype=np.uint8)
+            self._scratch = np.empty_like(self.layer)
 
-def generate_frames(parking_lot_id):
+        self.slot_ids = [slot.id for slot in geometry.slots]
+        self._statuses = [None] * len(self.slot_ids)
+
+    def paint(self, current_status):
+        """Repaints the outlines of slots whose status changed since the last frame."""
+        for i, slot_id in enumerate(self.slot_ids):
+            status = current_status.get(slot_id, 'available')
+            if status != self._statuses[i]:
+                start, stop = self.outline_bounds[i], self.outline_bounds[i + 1]
+                if self.sparse:
+                    self.outline_values[start:stop] = np.array(STATUS_COLORS[status], np.uint8).view(PIXEL_DTYPE)[0]
+                else:
+                    self.layer.reshape(-1, 3)[self.outline_pixels[start:stop]] = STATUS_COLORS[status]
+                self._statuses[i] = status
+
+    def render(self, img, current_status):
+        if self.window is None:
+            return img
+        self.paint(current_status)
+
+        if self.sparse:
+            if not img.flags.c_contiguous:
+                img[:] = self.render(np.ascontiguousarray(img), current_status)
+                return img
+            pixels = img.reshape(-1).view(PIXEL_DTYPE)
+            pixels[self.frame_outline] = self.outline_values
+
+            # Labels are white: pixel += (255 - pixel) * alpha / 255
+            under = np.take(pixels, self.frame_labels).view(np.uint8).reshape(-1, 3)
+            blend = cv2.bitwise_not(under)
+            cv2.multiply(blend, self.label_weights, dst=blend, scale=1 / 255)
+            cv2.add(under, blend, dst=under)
+            pixels[self.frame_labels] = under.reshape(-1).view(PIXEL_DTYPE)
+            return img
+
+        roi = img[self.window]
+        cv2.copyTo(self.layer, self.outline_mask, roi)
+
+        # Labels are white: roi += (255 - roi) * alpha / 255
+        cv2.bitwise_not(roi, dst=self._scratch)
+        cv2.multiply(self._scratch, self.label_alpha, dst=self._scratch, scale=1 / 255)
+        cv2.add(roi, self._scratch, dst=roi)
+        return img
+
+
+def draw_slots(img, geometry, current_status):
+    shape = img.shape[:2]
+    overlay = geometry._overlays.get(shape)
+    if overlay is None:
+        overlay = geometry._overlays[shape] = SlotOverlay(geometry, shape)
+    return overlay.render(img, current_status)
+
+def check_parking_space(img, img_processed, slots, active_bookings, lot_id, engine='roi'):
+    geometry, current_status = classify_slots(img_processed, slots, active_bookings, lot_id, engine)
+    return draw_slots(img, geometry, current_status)
+
+class LotSnapshot:
+    """A lot's slot rows and its active bookings that have not ended yet, as plain tuples."""
+
+    def __init__(self, version, slots, bookings):
+        self.version = version
+        self.slots = slots          # [SlotRow]
+        self.bookings = bookings    # [(slot_id, start_time, end_time)]
+        self.loaded_at = time.monotonic()
+        self._active = None         # Slot ids with a booking running from _active_from until _active_until
+        self._active_from = self._active_until = None
+
+    def active_ids(self, now):
+        """Set of slot ids with a booking running at `now`; recomputed only when a booking starts or ends."""
+        if self._active is None or not (self._active_from <= now < self._active_until):
+            self._active = {slot_id for slot_id, start, end in self.bookings if start <= now <= end}
+            # The set holds until the next start after now or end at/after now
+            changes = [start for _, start, _ in self.bookings if start > now]
+            changes += [end + timedelta(microseconds=1) for _, _, end in self.bookings if end >= now]
+            self._active_from = now
+            self._active_until = min(changes, default=datetime.max)
+        return self._active
+
+def refresh_lot_state(lot_id, max_age=5.0):
+    """Reads a lot's snapshot from the DB (two queries, both scoped to the lot)."""
+    from database.models import db, Slot, Booking
+    
+    version = LOT_STATE_VERSIONS.get(lot_id, 0)
+    slots = [SlotRow(*row) for row in db.session.query(Slot.id, Slot.slot_label, Slot.points)
+             .filter_by(parking_lot_id=lot_id).all()]
+    
+    # Bookings starting before the next refresh are included, so they turn
+    # active on time without another query; later ones wait for a later refresh
+    now = datetime.now()
+    bookings = db.session.query(Booking.slot_id, Booking.start_time, Booking.end_time).join(Slot).filter(
+        Slot.parking_lot_id == lot_id, Booking.is_active == True, Booking.end_time >= now,
+        Booking.start_time <= now + timedelta(seconds=max_age)
+    ).all()
+    
+    snapshot = LotSnapshot(version, slots, [tuple(b) for b in bookings])
+    LOT_SNAPSHOTS[lot_id] = snapshot
+    return snapshot
+
+def load_lot_state(lot_id, max_age=5.0):
+    """Slots of a lot and the set of ids of slots with a booking running right now."""
+    snapshot = LOT_SNAPSHOTS.get(lot_id)
+    if (snapshot is None or snapshot.version != LOT_STATE_VERSIONS.get(lot_id, 0)
+            or time.monotonic() - snapshot.loaded_at > max_age):
+        snapshot = refresh_lot_state(lot_id, max_age)
+    return snapshot.slots, snapshot.active_ids(datetime.now())
+
+def invalidate_lot_state(lot_id):
+    """Call after a lot's slots or bookings were written."""
+    with _state_lock:
+        LOT_STATE_VERSIONS[lot_id] = LOT_STATE_VERSIONS.get(lot_id, 0) + 1
+        LOT_SNAPSHOTS.pop(lot_id, None)
+
+def get_incremental_counter(lot_id, config):
+    counter = LOT_INCREMENTAL_COUNTERS.get(lot_id)
+    if counter is None:
+        counter = IncrementalCounter(
+            motion_threshold=config.get('DETECTOR_MOTION_THRESHOLD', 25),
+            min_changed=config.get('DETECTOR_MOTION_MIN_CHANGED', 0.02),
+            full_refresh=config.get('DETECTOR_FULL_REFRESH_FRAMES', 50),
+        )
+        LOT_INCREMENTAL_COUNTERS[lot_id] = counter
+    return counter
+
+def get_frame_pipeline(lot_id, geometry, frame_shape, scale=1.0):
+    pipeline = LOT_PIPELINES.get(lot_id)
+    if pipeline is None or not pipeline.matches(geometry, frame_shape, scale):
+        pipeline = FramePipeline(geometry, frame_shape, scale)
+        LOT_PIPELINES[lot_id] = pipeline
+    return pipeline
+
+def analyze_lot(lot_id, img, config):
+    """
+    Preprocess + classify one frame of a lot. Needs an app context.
+    Returns the full-resolution geometry (for drawing) and the statuses.
+    """
+    engine = config.get('DETECTOR_COUNT_ENGINE', 'roi')
+    scale = config.get('DETECTOR_ANALYSIS_SCALE', 1.0)
+    t0 = time.perf_counter()
+    slots, active_ids = load_lot_state(lot_id, config.get('DETECTOR_STATE_REFRESH_SECONDS', 5.0))
+    t1 = time.perf_counter()
+    
+    # Only the slots' union bounding box is preprocessed, at the analysis scale
+    geometry = get_lot_geometry(lot_id, slots, scale)
+    pipeline = get_frame_pipeline(lot_id, geometry, img.shape, scale)
+    img_gray = pipeline.gray(img)
+    if config.get('DETECTOR_INCREMENTAL'):
+        # Motion-gated: only slots that changed since the last frame are
+        # recounted. Their preprocessing is timed as part of 'count'.
+        t2 = time.perf_counter()
+        counts = get_incremental_counter(lot_id, config).count(img_gray, geometry, engine, pipeline)
+    else:
+        img_processed = pipeline.preprocess(img_gray)
+        t2 = time.perf_counter()
+        counts = pipeline.count(img_processed, engine)
+    t3 = time.perf_counter()
+    observe_stage(lot_id, 'db', t1 - t0)
+    observe_stage(lot_id, 'preprocess', t2 - t1)
+    observe_stage(lot_id, 'count', t3 - t2)
+    
+    current_status = classify_counts(geometry, counts, active_ids, lot_id,
+                                     occupied_ratio=config.get('DETECTOR_OCCUPIED_RATIO'))
+    if scale != 1.0:
+        geometry = get_lot_geometry(lot_id, slots)
+    return geometry, current_status
+
+def cached_analysis(lot_id, max_age=5.0):
+    """Geometry + last known statuses, for when a detection scheduler does the analysis."""
+    started = time.perf_counter()
+    slots = load_lot_state(lot_id, max_age)[0]
+    observe_stage(lot_id, 'db', time.perf_counter() - started)
+    return get_lot_geometry(lot_id, slots), get_lot_status(lot_id) or {}
+
+def _produce_frames(stream):
+    """Capture + detection loop for one lot, shared by all of its viewers (see core.stream)."""
     from app import app
-    from database.models import db, ParkingLot, Slot, Booking
+    from database.models import db, ParkingLot
     
     with app.app_context():
-        lot = db.session.get(ParkingLot, parking_lot_id)
+        lot = db.session.get(ParkingLot, stream.lot_id)
         if not lot: return
         
-        cap = cv2.VideoCapture(lot.video_path)
+        # Decoded ahead on its own thread while this one analyzes and draws
+        source = PrefetchSource(lot.video_path,
+                                queue_size=app.config.get('DETECTOR_PREFETCH_FRAMES', 2),
+                                reconnect_seconds=app.config.get('DETECTOR_RECONNECT_SECONDS', 2.0),
+                                lot_id=stream.lot_id)
         
-        while True:
-            success, img = cap.read()
-            if not success:
-                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-                continue
-            
-            img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            img_blur = cv2.GaussianBlur(img_gray, (3, 3), 1)
-            img_thresh = cv2.adaptiveThreshold(img_blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                               cv2.THRESH_BINARY_INV, 25, 16)
-            img_median = cv2.medianBlur(img_thresh, 5)
-            kernel = np.ones((3, 3), np.uint8)
-            img_dilate = cv2.dilate(img_median, kernel, iterations=1)
-            
-            # Get Slots
-            slots = db.session.query(Slot).filter_by(parking_lot_id=parking_lot_id).all()
-            
-            # Get Bookings
-            now = datetime.now()
-            active_bookings = db.session.query(Booking).filter(
-                Booking.start_time <= now, Booking.end_time >= now, Booking.is_active == True
-            ).all()
-            active_ids = [b.slot_id for b in active_bookings]
-
-            img_final = check_parking_space(img, img_dilate, slots, active_ids, parking_lot_id)
-            
-            ret, buffer = cv2.imencode('.jpg', img_final)
-            frame = buffer.tobytes()
-            yield (b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
\ No newline at end of file
+        try:
+            while stream.keep_running():
+                # Decode only as fast as the most demanding watched profile needs
+                source.target_fps = 1.0 / stream.frame_interval(source.fps)
+                img = source.read_latest()
+                if img is None:
+                    continue
+                
+                if ANALYSIS_OFFLOADED:
+                    geometry, current_status = cached_analysis(stream.lot_id, app.config.get('DETECTOR_STATE_REFRESH_SECONDS', 5.0))
+                else:
+                    geometry, current_status = analyze_lot(stream.lot_id, img, app.config)
+                t0 = time.perf_counter()
+                img_final = draw_slots(img, geometry, current_status)
+                t1 = time.perf_counter()
+                
+                # Encoded once per watched profile, however many viewers share it
+                stream.publish(img_final)
+                observe_stage(stream.lot_id, 'draw', t1 - t0)
+                observe_stage(stream.lot_id, 'encode', time.perf_counter() - t1)
+        finally:
+            source.release()
+
+def generate_frames(parking_lot_id, profile='full'):
+    from app import app
+    
+    stream = open_stream(parking_lot_id, _produce_frames, profile,
+                         grace_seconds=app.config.get('DETECTOR_STREAM_GRACE_SECONDS', 10.0),
+                         profiles=app.config.get('STREAM_PROFILES'))
+    try:
+        for frame in stream.frames(profile):
+            yield (b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+    finally:
+        stream.unsubscribe(profile)
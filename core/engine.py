@@ -0,0 +1,76 @@
+import threading
+import time
+
+from core.capture import HeadlessSource
+from core.detector import analyze_lot
+from core.metrics import observe_stage
+from core.stream import LOT_STREAMS
+
+
+class OccupancyEngine:
+    """
+    Keeps LOT_STATUS_CACHE current for every lot, whether or not anyone is
+    watching its video. Lots with a running video stream are skipped since
+    their stream producer already analyzes every frame.
+    """
+
+    def __init__(self, app, analysis_fps=1.0, refresh_seconds=30.0):
+        self.app = app
+        self.interval = 1.0 / analysis_fps
+        self.refresh_seconds = refresh_seconds
+        self.sources = {}  # { lot_id: HeadlessSource }
+        self._next_refresh = 0.0
+
+    def refresh_lots(self):
+        from database.models import db, ParkingLot
+
+        lots = dict(db.session.query(ParkingLot.id, ParkingLot.video_path).all())
+        for lot_id in list(self.sources):
+            if lots.get(lot_id) != self.sources[lot_id].video_path:
+                self.sources.pop(lot_id).release()
+        for lot_id, video_path in lots.items():
+            if lot_id not in self.sources:
+                self.sources[lot_id] = HeadlessSource(video_path)
+
+    def tick(self):
+        from database.models import db
+
+        if time.monotonic() >= self._next_refresh:
+            self.refresh_lots()
+            self._next_refresh = time.monotonic() + self.refresh_seconds
+
+        for lot_id, source in self.sources.items():
+            if lot_id in LOT_STREAMS:
+                continue
+            started = time.perf_counter()
+            img = source.read_latest()
+            if img is None:
+                continue
+            observe_stage(lot_id, 'decode', time.perf_counter() - started)
+            try:
+                analyze_lot(lot_id, img, self.app.config)
+            except Exception as e:
+                print(f"⚠️ Detection Error (lot {lot_id}): {e}")
+
+        # Fresh session per round so slot/booking edits are seen
+        db.session.remove()
+
+    def run(self):
+        with self.app.app_context():
+            while True:
+                started = time.monotonic()
+                try:
+                    self.tick()
+                except Exception as e:
+                    print(f"Occupancy Engine Error: {e}")
+                time.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+
+def start_occupancy_engine(app):
+    engine = OccupancyEngine(app,
+                             analysis_fps=app.config.get('DETECTOR_ANALYSIS_FPS', 1.0),
+                             refresh_seconds=app.config.get('DETECTOR_LOT_REFRESH_SECONDS', 30.0))
+    thread = threading.Thread(target=engine.run, name="occupancy-engine")
+    thread.daemon = True
+    thread.start()
+    return engine
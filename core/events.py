@@ -0,0 +1,230 @@
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from core.status_table import is_reader, read_events
+from core.stream import AsyncWaiters
+
+# A status must be seen on this many consecutive analyzed frames before it
+# becomes a transition event (filters single-frame flicker)
+EVENT_DEBOUNCE_FRAMES = 3
+
+# Transition events kept per lot; older ones are dropped
+EVENT_LOG_SIZE = 1000
+
+# Seconds between keep-alive comments on an idle Server-Sent Events stream
+# (keeps proxies from closing it, and notices viewers that went away)
+SSE_KEEPALIVE_SECONDS = 15.0
+
+# How often a process that doesn't run the detector looks for changes in
+# the shared status table while a client waits
+SHARED_POLL_SECONDS = 0.25
+
+# GLOBAL EVENT LOGS
+# Format: { lot_id: LotEventLog }
+LOT_EVENTS = {}
+_events_lock = threading.Lock()
+
+
+class LotEventLog:
+    """
+    Debounced slot status transitions of one lot in a bounded ring.
+
+    Every event carries a per-lot sequence number that only ever grows, so a
+    client can ask for "everything after seq N". A client whose N has
+    already fallen out of the ring gets a full snapshot instead.
+    """
+
+    def __init__(self, debounce_frames=EVENT_DEBOUNCE_FRAMES, size=EVENT_LOG_SIZE):
+        self.debounce_frames = debounce_frames
+        self.events = deque(maxlen=size)
+        self.seq = 0
+        # Tells this log's sequence numbers apart from those of an earlier
+        # process, so a restart never matches a client's cached ETag
+        self.epoch = format(time.time_ns(), 'x')
+        self.stable = {}   # { slot_id: status } after debouncing
+        self.pending = {}  # { slot_id: (status, frames seen) }
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._async_waiters = AsyncWaiters()
+
+    def _emit(self, slot_id, old, new, at):
+        self.seq += 1
+        self.events.append({'seq': self.seq, 'slot_id': slot_id, 'from': old, 'to': new, 'at': at})
+
+    def update(self, current_status):
+        at = datetime.now().isoformat(timespec='seconds')
+        with self._lock:
+            seq = self.seq
+            # Slots that were added or removed are reported right away
+            for slot_id in [s for s in self.stable if s not in current_status]:
+                self._emit(slot_id, self.stable.pop(slot_id), None, at)
+                self.pending.pop(slot_id, None)
+
+            for slot_id, status in current_status.items():
+                old = self.stable.get(slot_id)
+                if old is None:
+                    self.stable[slot_id] = status
+                    self._emit(slot_id, None, status, at)
+                elif status == old:
+                    self.pending.pop(slot_id, None)
+                else:
+                    seen = self.pending.get(slot_id)
+                    frames = seen[1] + 1 if seen and seen[0] == status else 1
+                    if frames >= self.debounce_frames:
+                        self.stable[slot_id] = status
+                        self.pending.pop(slot_id, None)
+                        self._emit(slot_id, old, status, at)
+                    else:
+                        self.pending[slot_id] = (status, frames)
+
+            changed = self.seq != seq
+            if changed:
+                self._changed.notify_all()
+        if changed:
+            self._async_waiters.notify_all()
+
+    def _since(self, seq):
+        oldest = self.events[0]['seq'] if self.events else self.seq + 1
+        if seq <= 0 or seq > self.seq or seq < oldest - 1:
+            return {'seq': self.seq, 'reset': True, 'slots': dict(self.stable)}
+        return {'seq': self.seq, 'changes': [e for e in self.events if e['seq'] > seq]}
+
+    def since(self, seq):
+        """Changes after `seq`, or a full snapshot when they are no longer all in the ring."""
+        with self._lock:
+            return self._since(seq)
+
+    def wait(self, seq, timeout):
+        """Like since(), but first blocks until something happened after `seq`. None on timeout."""
+        with self._changed:
+            if not self._changed.wait_for(lambda: self.seq != seq, timeout):
+                return None
+            return self._since(seq)
+
+    async def wait_async(self, seq, timeout):
+        """wait() for a coroutine."""
+        waiter = self._async_waiters.register()
+        with self._lock:
+            if self.seq != seq:
+                self._async_waiters.discard(waiter)
+                return self._since(seq)
+        await self._async_waiters.wait(waiter, timeout)
+        with self._lock:
+            return self._since(seq) if self.seq != seq else None
+
+    def etag(self, seq):
+        """Validator for since(seq): its result only depends on `seq` and the log's own seq."""
+        return f"{self.epoch}-{seq}-{self.seq}"
+
+    def state(self):
+        """(epoch, seq, debounced statuses), as published to the shared status table."""
+        with self._lock:
+            return int(self.epoch, 16), self.seq, dict(self.stable)
+
+
+class SharedEventLog:
+    """
+    A lot's event log as seen from a process that doesn't run the detector:
+    the writer's sequence number and debounced statuses, read from the
+    shared status table, so sequence numbers agree across web workers. The
+    transitions themselves aren't shared: a client that is behind gets a
+    full snapshot. Waiting polls the table.
+    """
+
+    def __init__(self, lot_id):
+        self.lot_id = lot_id
+
+    def _state(self):
+        return read_events(self.lot_id) or (0, 0, {})
+
+    @property
+    def seq(self):
+        return self._state()[1]
+
+    def _since(self, seq, state):
+        _, current, stable = state
+        if 0 < seq == current:
+            return {'seq': current, 'changes': []}
+        return {'seq': current, 'reset': True, 'slots': stable}
+
+    def since(self, seq):
+        return self._since(seq, self._state())
+
+    def wait(self, seq, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            state = self._state()
+            if state[1] != seq:
+                return self._since(seq, state)
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(SHARED_POLL_SECONDS)
+
+    async def wait_async(self, seq, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            state = self._state()
+            if state[1] != seq:
+                return self._since(seq, state)
+            if time.monotonic() >= deadline:
+                return None
+            await asyncio.sleep(SHARED_POLL_SECONDS)
+
+    def etag(self, seq):
+        epoch, current, _ = self._state()
+        return f"{epoch:x}-{seq}-{current}"
+
+
+def get_event_log(lot_id):
+    if is_reader():
+        return SharedEventLog(lot_id)
+    log = LOT_EVENTS.get(lot_id)
+    if log is None:
+        with _events_lock:
+            log = LOT_EVENTS.setdefault(lot_id, LotEventLog())
+    return log
+
+def find_event_log(lot_id):
+    """The lot's event log, or None while nothing was recorded for it yet."""
+    if is_reader():
+        return SharedEventLog(lot_id) if read_events(lot_id) is not None else None
+    return LOT_EVENTS.get(lot_id)
+
+def record_status(lot_id, current_status):
+    log = get_event_log(lot_id)
+    log.update(current_status)
+    return log
+
+def stream_events(lot_id, since=0, keepalive=SSE_KEEPALIVE_SECONDS):
+    """
+    Server-Sent Events for one lot: the since() payloads, each pushed as soon
+    as the detector records a transition. The event id is the sequence
+    number, so a reconnecting EventSource resumes via Last-Event-ID.
+    """
+    log = get_event_log(lot_id)
+    yield "retry: 3000\n\n"
+    payload = log.since(since) if since <= 0 or since != log.seq else None
+    while True:
+        if payload is None:
+            yield ": keepalive\n\n"
+        else:
+            since = payload['seq']
+            yield f"id: {since}\ndata: {json.dumps(payload)}\n\n"
+        payload = log.wait(since, keepalive)
+
+async def astream_events(lot_id, since=0, keepalive=SSE_KEEPALIVE_SECONDS):
+    """stream_events() for the async server (core/asgi.py)."""
+    log = get_event_log(lot_id)
+    yield "retry: 3000\n\n"
+    payload = log.since(since) if since <= 0 or since != log.seq else None
+    while True:
+        if payload is None:
+            yield ": keepalive\n\n"
+        else:
+            since = payload['seq']
+            yield f"id: {since}\ndata: {json.dumps(payload)}\n\n"
+        payload = await log.wait_async(since, keepalive)
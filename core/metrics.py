@@ -0,0 +1,119 @@
+import bisect
+import threading
+import time
+
+# Off = every call below returns right away (Config.DETECTOR_METRICS_ENABLED)
+ENABLED = True
+
+# Detector stages timed per lot; 'db' is the slot/booking refresh
+STAGES = ('decode', 'preprocess', 'count', 'draw', 'encode', 'db')
+
+# Histogram upper bounds in seconds (Prometheus 'le' buckets)
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# { (lot_id, stage): StageHistogram }
+STAGE_SECONDS = {}
+
+# { (counter name, lot_id): int }, see COUNTER_HELP
+COUNTERS = {}
+COUNTER_HELP = {
+    'frames_processed': "Frames analyzed and classified",
+    'frames_dropped': "Decoded frames replaced by a newer one before analysis",
+}
+
+# { lot_id: wall-clock time of the last classified frame }
+LAST_STATUS_AT = {}
+
+_lock = threading.Lock()
+
+
+class StageHistogram:
+    __slots__ = ('buckets', 'sum', 'count')
+
+    def __init__(self):
+        self.buckets = [0] * (len(STAGE_BUCKETS) + 1)  # Last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.buckets[bisect.bisect_left(STAGE_BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+def set_metrics_enabled(enabled):
+    global ENABLED
+    ENABLED = bool(enabled)
+
+
+def observe_stage(lot_id, stage, seconds):
+    if not ENABLED:
+        return
+    with _lock:
+        histogram = STAGE_SECONDS.get((lot_id, stage))
+        if histogram is None:
+            histogram = STAGE_SECONDS[(lot_id, stage)] = StageHistogram()
+        histogram.observe(seconds)
+
+
+def inc(name, lot_id, amount=1):
+    if not ENABLED or not amount:
+        return
+    with _lock:
+        COUNTERS[(name, lot_id)] = COUNTERS.get((name, lot_id), 0) + amount
+
+
+def mark_status(lot_id):
+    """Call whenever a lot's statuses were recomputed."""
+    if not ENABLED:
+        return
+    inc('frames_processed', lot_id)
+    LAST_STATUS_AT[lot_id] = time.time()
+
+
+# --- EXPOSITION ---
+def _labels(**labels):
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}'
+
+def render_metrics():
+    """Everything above in the Prometheus text exposition format."""
+    from core.stream import LOT_STREAMS
+
+    with _lock:
+        histograms = {key: (list(h.buckets), h.sum, h.count) for key, h in STAGE_SECONDS.items()}
+        counters = dict(COUNTERS)
+    lines = []
+
+    name = 'smartpark_detector_stage_seconds'
+    lines += [f"# HELP {name} Time spent per detector stage and lot",
+              f"# TYPE {name} histogram"]
+    for (lot_id, stage), (buckets, total, count) in sorted(histograms.items(), key=lambda kv: (str(kv[0][0]), kv[0][1])):
+        cumulative = 0
+        for bound, n in zip(STAGE_BUCKETS + ('+Inf',), buckets):
+            cumulative += n
+            lines.append(f"{name}_bucket{_labels(lot=lot_id, stage=stage, le=bound)} {cumulative}")
+        lines.append(f"{name}_sum{_labels(lot=lot_id, stage=stage)} {total:.6f}")
+        lines.append(f"{name}_count{_labels(lot=lot_id, stage=stage)} {count}")
+
+    for counter, help_text in COUNTER_HELP.items():
+        name = f'smartpark_detector_{counter}_total'
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        for (key, lot_id), value in sorted(counters.items(), key=lambda kv: str(kv[0][1])):
+            if key == counter:
+                lines.append(f"{name}{_labels(lot=lot_id)} {value}")
+
+    name = 'smartpark_detector_active_viewers'
+    lines += [f"# HELP {name} Video viewers connected per lot and stream profile",
+              f"# TYPE {name} gauge"]
+    for lot_id, stream in sorted(list(LOT_STREAMS.items()), key=lambda kv: str(kv[0])):
+        for profile, viewers in sorted(dict(stream.viewers).items()):
+            lines.append(f"{name}{_labels(lot=lot_id, profile=profile)} {viewers}")
+
+    name = 'smartpark_detector_status_age_seconds'
+    lines += [f"# HELP {name} Seconds since the lot's slot statuses were last recomputed",
+              f"# TYPE {name} gauge"]
+    now = time.time()
+    for lot_id, at in sorted(list(LAST_STATUS_AT.items()), key=lambda kv: str(kv[0])):
+        lines.append(f"{name}{_labels(lot=lot_id)} {now - at:.3f}")
+
+    return '\n'.join(lines) + '\n'
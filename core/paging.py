@@ -0,0 +1,51 @@
+from datetime import datetime
+from heapq import merge
+from itertools import islice
+
+from sqlalchemy import select, union_all, tuple_
+
+# Most per-partition selects in one UNION ALL (SQLite allows 500 terms)
+_UNION_TERMS = 400
+
+
+def parse_cursor(cursor):
+    """(time, id) from a '<time>_<id>' page cursor; None for no or a malformed cursor (= first page)."""
+    try:
+        time_str, id_str = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(time_str), int(id_str)
+    except (AttributeError, ValueError):
+        return None
+
+
+def keyset_page(model, time_column, partition_column, partition_ids, cursor=None, size=25):
+    """
+    One page of the `model` rows whose `partition_column` is one of
+    `partition_ids` (e.g. a provider's slots), newest `time_column` first,
+    starting after `cursor` (the previous page's). Each partition is read
+    through its (partition, time) index and stops after `size` + 1 rows, so a
+    page costs the same however much history came before it.
+    Returns (rows, cursor of the next page or None).
+    """
+    from database.models import db
+
+    after = parse_cursor(cursor)
+    keys = []
+    ids = list(partition_ids)
+    for i in range(0, len(ids), _UNION_TERMS):
+        selects = []
+        for partition_id in ids[i:i + _UNION_TERMS]:
+            part = select(time_column.label('t'), model.id.label('id')).where(partition_column == partition_id)
+            if after:
+                part = part.where(tuple_(time_column, model.id) < after)
+            selects.append(part.order_by(time_column.desc(), model.id.desc()).limit(size + 1).subquery().select())
+        newest = union_all(*selects).subquery()
+        keys = list(islice(merge(keys, db.session.execute(
+            select(newest.c.t, newest.c.id).order_by(newest.c.t.desc(), newest.c.id.desc()).limit(size + 1)
+        ).all(), key=tuple, reverse=True), size + 1))
+
+    next_cursor = f"{keys[size - 1][0].isoformat()}_{keys[size - 1][1]}" if len(keys) > size else None
+    keys = keys[:size]
+    if not keys:
+        return [], None
+    rows = {row.id: row for row in db.session.query(model).filter(model.id.in_([key[1] for key in keys]))}
+    return [rows[key[1]] for key in keys if key[1] in rows], next_cursor
@@ -0,0 +1,112 @@
+from sqlalchemy import func
+
+# Day key of the lifetime totals row kept next to a lot's daily rows
+LIFETIME = 'all'
+
+
+def _day(start):
+    return start.date().isoformat()
+
+
+def _sum(rows, sign=1):
+    """Totals of rows of (lot_id, start, end, amount) per lot day and per lot (LIFETIME)."""
+    # Format: { (lot_id, day): [bookings, revenue, booked_hours] }
+    totals = {}
+    for lot_id, start, end, amount in rows:
+        hours = (end - start).total_seconds() / 3600
+        for key in ((lot_id, _day(start)), (lot_id, LIFETIME)):
+            total = totals.setdefault(key, [0, 0.0, 0.0])
+            total[0] += sign
+            total[1] += sign * (amount or 0.0)
+            total[2] += sign * hours
+    return totals
+
+
+def _apply(rows, sign):
+    """Adds (or with sign=-1 subtracts) rows of (lot_id, start, end, amount) to the stored rollups."""
+    from database.models import db, LotDailyStat
+
+    for (lot_id, day), (bookings, revenue, hours) in sorted(_sum(rows, sign).items()):
+        # Relative to what is stored, so writes from other processes add up
+        updated = db.session.query(LotDailyStat).filter_by(parking_lot_id=lot_id, day=day).update({
+            LotDailyStat.bookings: LotDailyStat.bookings + bookings,
+            LotDailyStat.revenue: LotDailyStat.revenue + revenue,
+            LotDailyStat.booked_hours: LotDailyStat.booked_hours + hours,
+        }, synchronize_session=False)
+        if not updated:
+            db.session.add(LotDailyStat(parking_lot_id=lot_id, day=day, bookings=bookings,
+                                        revenue=revenue, booked_hours=hours))
+    db.session.flush()
+
+
+def record_bookings(bookings):
+    """
+    Adds new Booking objects to their lots' rollups. Call in the transaction
+    that inserts them (core/booking.py does, inside its write section).
+    """
+    from database.models import db, Slot
+
+    if not bookings:
+        return
+    lot_of = dict(db.session.query(Slot.id, Slot.parking_lot_id)
+                  .filter(Slot.id.in_({b.slot_id for b in bookings})).all())
+    _apply([(lot_of[b.slot_id], b.start_time, b.end_time, b.amount) for b in bookings if b.slot_id in lot_of], 1)
+
+
+def forget_bookings(query):
+    """Takes the bookings of a Booking query out of the rollups; call right before deleting them."""
+    from database.models import Slot, Booking
+
+    _apply(query.join(Slot).with_entities(Slot.parking_lot_id, Booking.start_time, Booking.end_time, Booking.amount), -1)
+
+
+def drop_lot_rollups(lot_id):
+    """Call when the lot and its bookings are deleted."""
+    from database.models import db, LotDailyStat
+
+    db.session.query(LotDailyStat).filter_by(parking_lot_id=lot_id).delete(synchronize_session=False)
+
+
+def rebuild_rollups(lot_ids=None):
+    """
+    Recomputes the rollups of `lot_ids` (None = every lot) from the bookings
+    table: once for a database from before the rollups, or to repair them.
+    Reads every booking of those lots. Commits; returns the rows written.
+    """
+    from database.models import db, Slot, Booking, LotDailyStat
+
+    query = db.session.query(Slot.parking_lot_id, Booking.start_time, Booking.end_time, Booking.amount).join(Slot)
+    stale = db.session.query(LotDailyStat)
+    if lot_ids is not None:
+        query = query.filter(Slot.parking_lot_id.in_(lot_ids))
+        stale = stale.filter(LotDailyStat.parking_lot_id.in_(lot_ids))
+    totals = _sum(query.yield_per(1000))
+
+    stale.delete(synchronize_session=False)
+    db.session.add_all([LotDailyStat(parking_lot_id=lot_id, day=day, bookings=bookings, revenue=revenue, booked_hours=hours)
+                        for (lot_id, day), (bookings, revenue, hours) in totals.items()])
+    db.session.commit()
+    return len(totals)
+
+
+def lot_totals(lot_ids, day):
+    """
+    Lifetime and `day` totals of the lots, read from their rollup rows (two
+    per lot, however long their history):
+    { 'total_income', 'daily_income', 'daily_bookings', 'daily_hours' }
+    """
+    from database.models import db, LotDailyStat
+
+    totals = {'total_income': 0.0, 'daily_income': 0.0, 'daily_bookings': 0, 'daily_hours': 0.0}
+    if not lot_ids:
+        return totals
+    day_key = day.isoformat()
+    for key, bookings, revenue, hours in db.session.query(
+            LotDailyStat.day, func.sum(LotDailyStat.bookings), func.sum(LotDailyStat.revenue), func.sum(LotDailyStat.booked_hours)) \
+            .filter(LotDailyStat.parking_lot_id.in_(lot_ids), LotDailyStat.day.in_([LIFETIME, day_key])) \
+            .group_by(LotDailyStat.day):
+        if key == LIFETIME:
+            totals['total_income'] = revenue or 0.0
+        else:
+            totals.update(daily_income=revenue or 0.0, daily_bookings=bookings or 0, daily_hours=hours or 0.0)
+    return totals
@@ -0,0 +1,338 @@
+import atexit
+import heapq
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import core.detector as detector
+from core.detector import classify_counts, load_lot_state, get_frame_pipeline, LOT_STATUS_CACHE
+from core.capture import HeadlessSource
+from core.metrics import observe_stage
+from core.slot_manager import get_lot_geometry, set_geometry_folder
+from core.stream import LOT_STREAMS
+
+
+# --- WORKER PROCESS SIDE ---
+# { shared memory name: (SharedMemory, ndarray) }, attached lazily per worker.
+# Bounded so buffers the scheduler has since replaced are eventually let go.
+_attached = OrderedDict()
+_MAX_ATTACHED = 128
+
+def _attach(name, shape, dtype):
+    entry = _attached.get(name)
+    if entry is None or entry[1].shape != shape:
+        shm = shared_memory.SharedMemory(name=name)
+        entry = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+        _attached[name] = entry
+        while len(_attached) > _MAX_ATTACHED:
+            old_shm, old_array = _attached.popitem(last=False)[1]
+            del old_array
+            old_shm.close()
+    _attached.move_to_end(name)
+    return entry[1]
+
+# The captures of the lots assigned to this worker, and their last frame
+# (decoded into again). Format: { lot_id: (HeadlessSource, ndarray | None) }
+_sources = {}
+
+def count_slots_task(lot_id, video_path, result_name, result_size, slot_rows, engine, scale):
+    """
+    Runs in the lot's worker process: decode the lot's newest frame,
+    preprocess it and write the counts to the shared result. Returns the
+    count plus the decode/preprocess/count seconds, which the scheduler
+    records (metrics live in the web process), or None without a frame.
+    """
+    source, frame = _sources.get(lot_id, (None, None))
+    if source is None or source.video_path != video_path:
+        if source is not None:
+            source.release()
+        source, frame = HeadlessSource(video_path), None
+    t0 = time.perf_counter()
+    img = source.read_latest(frame)
+    t1 = time.perf_counter()
+    _sources[lot_id] = (source, img if img is not None else frame)
+    if img is None:
+        return None
+
+    # The slot rows come with every task, so a redraw is picked up here too
+    geometry = get_lot_geometry(lot_id, slot_rows, scale)
+    pipeline = get_frame_pipeline(lot_id, geometry, img.shape, scale)
+    img_processed = pipeline.preprocess(pipeline.gray(img))
+    t2 = time.perf_counter()
+    counts = pipeline.count(img_processed, engine)
+    t3 = time.perf_counter()
+
+    result = _attach(result_name, (result_size,), np.int32)
+    result[:len(counts)] = counts
+    return len(counts), t1 - t0, t2 - t1, t3 - t2
+
+def release_source(lot_id):
+    source, _ = _sources.pop(lot_id, (None, None))
+    if source is not None:
+        source.release()
+
+def worker_main(tasks, results, geometry_folder):
+    """
+    A detection worker process. Tasks are ('count', lot_id, args...) or
+    ('release', lot_id); None stops it. Every task of a lot comes to the
+    same worker, which keeps that lot's capture open between frames.
+    """
+    # Workers load the lots' precompiled geometry instead of rasterizing it
+    set_geometry_folder(geometry_folder)
+    for task in iter(tasks.get, None):
+        kind, lot_id, *args = task
+        if kind == 'release':
+            release_source(lot_id)
+            continue
+        try:
+            outcome = count_slots_task(lot_id, *args)
+        except Exception as e:
+            outcome = RuntimeError(str(e))  # Sent back to be printed; not every exception pickles
+        results.put((lot_id, outcome))
+    for lot_id in list(_sources):
+        release_source(lot_id)
+
+
+# --- SCHEDULER (WEB PROCESS) SIDE ---
+class SharedBuffer:
+    def __init__(self, shape, dtype):
+        self.shape = tuple(shape)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize))
+        self.array = np.ndarray(self.shape, dtype=dtype, buffer=self.shm.buf)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def release(self):
+        del self.array
+        self.shm.close()
+        self.shm.unlink()
+
+
+class LotJob:
+    def __init__(self, lot_id, video_path, worker):
+        self.lot_id = lot_id
+        self.video_path = video_path
+        self.worker = worker  # Index of the worker process that captures and analyzes this lot
+        self.result = None    # SharedBuffer the worker writes counts into
+        self.geometry = None
+        self.active_ids = set()
+        self.in_flight = False
+        self.next_due = 0.0
+
+    def release(self):
+        if self.result is not None:
+            self.result.release()
+
+
+class DetectionScheduler:
+    """
+    Spreads lot analysis over worker processes.
+
+    Each lot is assigned to one worker, which keeps the lot's capture open
+    and decodes, preprocesses and counts its frames; the web process only
+    picks lots and classifies the counts the workers write into shared
+    memory, so only small task tuples are pickled. Lots are dispatched by
+    priority (viewers first, then lots close to capacity) under a global
+    frames-per-second cap.
+    """
+
+    def __init__(self, app, workers=None, max_fps=20.0, analysis_fps=1.0, viewer_fps=5.0,
+                 near_capacity=0.9, refresh_seconds=30.0):
+        self.app = app
+        self.workers = workers or os.cpu_count() or 1
+        self.max_fps = max_fps
+        self.analysis_interval = 1.0 / analysis_fps
+        self.viewer_interval = 1.0 / viewer_fps
+        self.near_capacity = near_capacity
+        self.refresh_seconds = refresh_seconds
+        self.engine = app.config.get('DETECTOR_COUNT_ENGINE', 'roi')
+        self.scale = app.config.get('DETECTOR_ANALYSIS_SCALE', 1.0)
+        self.occupied_ratio = app.config.get('DETECTOR_OCCUPIED_RATIO')
+        self.state_refresh = app.config.get('DETECTOR_STATE_REFRESH_SECONDS', 5.0)
+
+        self.jobs = {}  # { lot_id: LotJob }
+        self.results = None
+        self.processes = []  # Worker processes, with their task queues in self.tasks
+        self.tasks = []
+        self._context = multiprocessing.get_context('spawn')
+        self._tokens = float(self.workers)
+        self._last_refill = time.monotonic()
+        self._next_refresh = 0.0
+        self._stopped = False
+
+    # --- Priorities ---
+    def priority(self, lot_id):
+        """Higher goes first: 2 for lots with viewers, +1 for lots close to capacity."""
+        score = 0
+        stream = LOT_STREAMS.get(lot_id)
+        if stream is not None and stream.subscribers > 0:
+            score += 2
+        status = LOT_STATUS_CACHE.get(lot_id)
+        if status and sum(1 for s in status.values() if s != 'available') >= self.near_capacity * len(status):
+            score += 1
+        return score
+
+    # --- Workers ---
+    def _start_worker(self, i):
+        process = self._context.Process(target=worker_main, name=f"detection-worker-{i}", daemon=True,
+                                        args=(self.tasks[i], self.results, self.app.config.get('SLOT_GEOMETRY_FOLDER')))
+        process.start()
+        self.processes[i] = process
+
+    def start_workers(self):
+        self.results = self._context.Queue()
+        self.tasks = [self._context.Queue() for _ in range(self.workers)]
+        self.processes = [None] * self.workers
+        for i in range(self.workers):
+            self._start_worker(i)
+
+    def check_workers(self):
+        """Restarts a worker that died; its lots' frames in flight are given up."""
+        for i, process in enumerate(self.processes):
+            if not process.is_alive():
+                print(f"⚠️ Detection worker {i} died (exit code {process.exitcode}), restarting")
+                self.tasks[i] = self._context.Queue()
+                self._start_worker(i)
+                for job in self.jobs.values():
+                    if job.worker == i:
+                        job.in_flight = False
+
+    # --- Lot bookkeeping ---
+    def refresh_lots(self):
+        from database.models import db, ParkingLot
+
+        lots = dict(db.session.query(ParkingLot.id, ParkingLot.video_path).all())
+        for lot_id in list(self.jobs):
+            job = self.jobs[lot_id]
+            if lots.get(lot_id) != job.video_path and not job.in_flight:
+                self.jobs.pop(lot_id).release()
+                self.tasks[job.worker].put(('release', lot_id))
+        load = [0] * self.workers
+        for job in self.jobs.values():
+            load[job.worker] += 1
+        for lot_id, video_path in lots.items():
+            if lot_id not in self.jobs:
+                worker = load.index(min(load))
+                load[worker] += 1
+                self.jobs[lot_id] = LotJob(lot_id, video_path, worker)
+        db.session.remove()
+
+    # --- Dispatch ---
+    def _refill(self, now):
+        self._tokens = min(float(self.workers), self._tokens + (now - self._last_refill) * self.max_fps)
+        self._last_refill = now
+
+    def dispatch(self, job):
+        from database.models import db
+
+        t0 = time.perf_counter()
+        slots, job.active_ids = load_lot_state(job.lot_id, self.state_refresh)
+        db.session.remove()
+        observe_stage(job.lot_id, 'db', time.perf_counter() - t0)
+        job.geometry = get_lot_geometry(job.lot_id, slots, self.scale)
+        if job.result is None or job.result.shape[0] < len(slots):
+            if job.result is not None:
+                job.result.release()
+            job.result = SharedBuffer((max(len(slots), 1),), np.int32)
+
+        job.in_flight = True
+        self.tasks[job.worker].put(('count', job.lot_id, job.video_path, job.result.name, job.result.shape[0],
+                                    slots, self.engine, self.scale))
+        return True
+
+    def collect(self, timeout):
+        try:
+            lot_id, outcome = self.results.get(timeout=timeout)
+        except queue.Empty:
+            return
+        while True:
+            job = self.jobs.get(lot_id)
+            if job is not None:
+                job.in_flight = False
+                if isinstance(outcome, Exception):
+                    print(f"⚠️ Detection Error (lot {lot_id}): {outcome}")
+                elif outcome is not None:
+                    size, decode_seconds, preprocess_seconds, count_seconds = outcome
+                    observe_stage(lot_id, 'decode', decode_seconds)
+                    observe_stage(lot_id, 'preprocess', preprocess_seconds)
+                    observe_stage(lot_id, 'count', count_seconds)
+                    counts = job.result.array[:size]
+                    classify_counts(job.geometry, counts, job.active_ids, lot_id, self.occupied_ratio)
+            try:
+                lot_id, outcome = self.results.get_nowait()
+            except queue.Empty:
+                return
+
+    def tick(self):
+        now = time.monotonic()
+        if now >= self._next_refresh:
+            self.check_workers()
+            self.refresh_lots()
+            self._next_refresh = now + self.refresh_seconds
+
+        self._refill(now)
+        ready = []
+        for job in self.jobs.values():
+            if not job.in_flight and job.next_due <= now:
+                heapq.heappush(ready, (-self.priority(job.lot_id), job.next_due, job.lot_id))
+
+        in_flight = sum(1 for job in self.jobs.values() if job.in_flight)
+        while ready and self._tokens >= 1.0 and in_flight < 2 * self.workers:
+            score, _, lot_id = heapq.heappop(ready)
+            job = self.jobs[lot_id]
+            interval = self.viewer_interval if score <= -2 else self.analysis_interval
+            job.next_due = now + interval
+            if self.dispatch(job):
+                self._tokens -= 1.0
+                in_flight += 1
+
+        self.collect(timeout=0.01)
+
+    def run(self):
+        self.start_workers()
+        detector.ANALYSIS_OFFLOADED = True
+        with self.app.app_context():
+            while not self._stopped:
+                try:
+                    self.tick()
+                except Exception as e:
+                    print(f"Detection Scheduler Error: {e}")
+                    time.sleep(1)
+
+    def shutdown(self):
+        """Stops the workers and unlinks every shared buffer."""
+        self._stopped = True
+        for tasks in self.tasks:
+            tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=2.0)
+            if process.is_alive():
+                process.terminate()
+        for job in self.jobs.values():
+            job.release()
+        self.jobs = {}
+
+
+def start_detection_scheduler(app):
+    scheduler = DetectionScheduler(
+        app,
+        workers=app.config.get('DETECTOR_WORKERS'),
+        max_fps=app.config.get('DETECTOR_MAX_FPS', 20.0),
+        analysis_fps=app.config.get('DETECTOR_ANALYSIS_FPS', 1.0),
+        viewer_fps=app.config.get('DETECTOR_VIEWER_ANALYSIS_FPS', 5.0),
+        near_capacity=app.config.get('DETECTOR_NEAR_CAPACITY', 0.9),
+        refresh_seconds=app.config.get('DETECTOR_LOT_REFRESH_SECONDS', 30.0),
+    )
+    atexit.register(scheduler.shutdown)
+    thread = threading.Thread(target=scheduler.run, name="detection-scheduler")
+    thread.daemon = True
+    thread.start()
+    return scheduler
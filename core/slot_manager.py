@@ -0,0 +1,355 @@
+import cv2
+import numpy as np
+import hashlib
+import json
+import os
+import threading
+from collections import namedtuple
+
+# GLOBAL CACHE for compiled slot geometry
+# Format: { (lot_id, analysis scale): LotGeometry }
+LOT_GEOMETRY_CACHE = {}
+
+# Slot set version per lot, bumped every time /api/save_slots rewrites a lot
+# Format: { lot_id: int }
+LOT_SLOT_VERSIONS = {}
+
+_cache_lock = threading.Lock()
+
+# Folder of precompiled geometry artifacts written by /api/save_slots
+# (set from Config.SLOT_GEOMETRY_FOLDER); None = always compile from the DB rows
+GEOMETRY_FOLDER = None
+
+# Bumped whenever the artifact layout changes; older files are ignored
+GEOMETRY_FORMAT = 1
+
+# Plain, picklable stand-in for a Slot row: all the geometry needs, and safe
+# to keep after the DB session that read it is gone
+SlotRow = namedtuple('SlotRow', 'id slot_label points')
+
+
+class SlotGeometry:
+    """Parsed polygon of one slot plus everything derived from it once."""
+
+    def __init__(self, slot_id, label, points):
+        self.id = slot_id
+        self.label = label
+        self.points = points  # int32, shape (N, 1, 2)
+
+        # Bounding box and the polygon mask cropped to it
+        x, y, w, h = cv2.boundingRect(points)
+        self.bbox = (x, y, w, h)
+        self.mask = np.zeros((h, w), dtype=np.uint8)
+        cv2.fillPoly(self.mask, [points - np.array([x, y], np.int32)], 255)
+        self.area = cv2.countNonZero(self.mask)
+
+        # Label position (center of polygon)
+        M = cv2.moments(points)
+        if M["m00"] != 0:
+            self.centroid = (int(M["m10"] / M["m00"]), int(M["m01"] / M["m00"]))
+        else:
+            self.centroid = (int(points[0][0][0]), int(points[0][0][1]))
+
+        # { frame shape: (window, mask) }, filled lazily by roi()
+        self._rois = {}
+
+    @classmethod
+    def restore(cls, slot_id, label, points, bbox, mask, area, centroid):
+        """Rebuilds a slot from precompiled arrays without rasterizing anything."""
+        slot = cls.__new__(cls)
+        slot.id = slot_id
+        slot.label = label
+        slot.points = points
+        slot.bbox = bbox
+        slot.mask = mask
+        slot.area = area
+        slot.centroid = centroid
+        slot._rois = {}
+        return slot
+
+    def roi(self, shape):
+        """
+        Frame slice and matching mask slice for a frame of `shape`.
+        Polygons crossing the frame edge are rasterized against the full frame
+        once (per shape) so edge clipping matches the old full-frame mask.
+        """
+        shape = shape[:2]
+        cached = self._rois.get(shape)
+        if cached is not None:
+            return cached
+
+        x, y, w, h = self.bbox
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + w, shape[1]), min(y + h, shape[0])
+        if x1 <= x0 or y1 <= y0:
+            cached = (None, None)
+        elif (x0, y0, x1, y1) == (x, y, x + w, y + h):
+            cached = ((slice(y0, y1), slice(x0, x1)), self.mask)
+        else:
+            full = np.zeros(shape, dtype=np.uint8)
+            cv2.fillPoly(full, [self.points], 255)
+            cached = ((slice(y0, y1), slice(x0, x1)), full[y0:y1, x0:x1].copy())
+        self._rois[shape] = cached
+        return cached
+
+    def count(self, img_processed):
+        """Non-zero pixels of `img_processed` inside this polygon."""
+        window, mask = self.roi(img_processed.shape)
+        if window is None:
+            return 0
+        roi = img_processed[window]
+        return cv2.countNonZero(cv2.bitwise_and(roi, roi, mask=mask))
+
+
+def geometry_stamp(slots):
+    """Content hash of a lot's slot rows; an artifact is only used when it matches."""
+    digest = hashlib.sha1()
+    for slot in slots:
+        digest.update(f"{slot.id}|{slot.slot_label}|{slot.points}\n".encode())
+    return digest.hexdigest()
+
+
+class LotGeometry:
+    def __init__(self, lot_id, version, slots, scale=1.0):
+        self.lot_id = lot_id
+        self.version = version
+        self.scale = scale  # Polygons are scaled by this to match a resized analysis frame
+        self.signature = tuple(s.id for s in slots)
+        self.stamp = geometry_stamp(slots)
+
+        self.slots = []
+        for slot in slots:
+            # Same tolerance as before: bad polygons are skipped, not fatal
+            try:
+                points = (np.array(json.loads(slot.points), np.float64) * scale).astype(np.int32)
+                points = points.reshape((-1, 1, 2))
+                self.slots.append(SlotGeometry(slot.id, slot.slot_label, points))
+            except Exception:
+                continue
+
+        # { frame shape: (labels, overlap_pixels, overlap_slots) }, see label_map()
+        self._label_maps = {}
+        # { frame shape: window }, see union_window()
+        self._union_windows = {}
+        # { frame shape: SlotOverlay }, see core.detector.draw_slots()
+        self._overlays = {}
+
+    def union_window(self, shape):
+        """Frame slice covering every slot (the only part worth preprocessing)."""
+        shape = shape[:2]
+        if shape not in self._union_windows:
+            windows = [slot.roi(shape)[0] for slot in self.slots]
+            windows = [w for w in windows if w is not None]
+            if not windows:
+                self._union_windows[shape] = None
+            else:
+                self._union_windows[shape] = (
+                    slice(min(w[0].start for w in windows), max(w[0].stop for w in windows)),
+                    slice(min(w[1].start for w in windows), max(w[1].stop for w in windows)),
+                )
+        return self._union_windows[shape]
+
+    def count_roi(self, img_processed):
+        """Per-slot engine: one masked count per slot ROI."""
+        return [slot.count(img_processed) for slot in self.slots]
+
+    def label_map(self, shape):
+        """
+        Integer image where each pixel holds (slot index + 1), 0 = no slot.
+
+        Overlapping polygons: a pixel covered by several slots counts toward
+        every one of them, exactly like the per-slot engine. Such pixels are
+        kept out of the label image and listed separately as
+        (flat pixel index, slot index + 1) pairs.
+        """
+        shape = shape[:2]
+        cached = self._label_maps.get(shape)
+        if cached is not None:
+            return cached
+
+        labels = np.zeros(shape, dtype=np.int32)
+        coverage = np.zeros(shape, dtype=np.uint16)
+        for i, slot in enumerate(self.slots):
+            window, mask = slot.roi(shape)
+            if window is None:
+                continue
+            inside = mask > 0
+            labels[window][inside] = i + 1
+            coverage[window][inside] += 1
+
+        overlap = coverage > 1
+        overlap_pixels, overlap_slots = [], []
+        if overlap.any():
+            flat_index = np.arange(labels.size, dtype=np.int64).reshape(shape)
+            for i, slot in enumerate(self.slots):
+                window, mask = slot.roi(shape)
+                if window is None:
+                    continue
+                shared = (mask > 0) & overlap[window]
+                if shared.any():
+                    pixels = flat_index[window][shared]
+                    overlap_pixels.append(pixels)
+                    overlap_slots.append(np.full(pixels.size, i + 1, dtype=np.int64))
+            labels[overlap] = 0
+
+        cached = (
+            labels,
+            np.concatenate(overlap_pixels) if overlap_pixels else np.empty(0, np.int64),
+            np.concatenate(overlap_slots) if overlap_slots else np.empty(0, np.int64),
+        )
+        self._label_maps[shape] = cached
+        return cached
+
+    def count_label_map(self, img_processed):
+        """Label-map engine: every slot counted from one pass over the frame."""
+        labels, overlap_pixels, overlap_slots = self.label_map(img_processed.shape)
+        n = len(self.slots) + 1
+
+        counts = np.bincount(labels[img_processed != 0], minlength=n)
+        if overlap_pixels.size:
+            hits = img_processed.reshape(-1)[overlap_pixels] != 0
+            counts += np.bincount(overlap_slots[hits], minlength=n)
+        return counts[1:].tolist()
+
+
+# Counting engines selectable via Config.DETECTOR_COUNT_ENGINE
+COUNT_ENGINES = {
+    'roi': LotGeometry.count_roi,
+    'labelmap': LotGeometry.count_label_map,
+}
+
+
+# --- PRECOMPILED ARTIFACTS ---
+def geometry_path(lot_id, folder=None):
+    folder = folder or GEOMETRY_FOLDER
+    return os.path.join(folder, f"lot_{lot_id}.npz") if folder else None
+
+
+def save_geometry(geometry, frame_shape=None, folder=None):
+    """
+    Writes a lot's compiled geometry (polygons, cropped masks, bboxes, areas,
+    centroids and, when the camera's frame shape is known, the label map at
+    that resolution) to lot_<id>.npz. Only scale 1.0 geometry is stored.
+    """
+    path = geometry_path(geometry.lot_id, folder)
+    if path is None or geometry.scale != 1.0:
+        return None
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    slots = geometry.slots
+    arrays = {
+        'format': np.int32(GEOMETRY_FORMAT),
+        'stamp': np.array(geometry.stamp),
+        'signature': np.array(geometry.signature, dtype=np.int64),
+        'ids': np.array([s.id for s in slots], dtype=np.int64),
+        'labels': np.array([s.label for s in slots], dtype=str),
+        'points': np.concatenate([s.points.reshape(-1, 2) for s in slots]) if slots else np.empty((0, 2), np.int32),
+        'point_counts': np.array([len(s.points) for s in slots], dtype=np.int64),
+        'bboxes': np.array([s.bbox for s in slots], dtype=np.int64).reshape(-1, 4),
+        'masks': np.concatenate([s.mask.reshape(-1) for s in slots]) if slots else np.empty(0, np.uint8),
+        'areas': np.array([s.area for s in slots], dtype=np.int64),
+        'centroids': np.array([s.centroid for s in slots], dtype=np.int64).reshape(-1, 2),
+    }
+    if frame_shape is not None:
+        labels, overlap_pixels, overlap_slots = geometry.label_map(frame_shape)
+        # Stored as uint16 when it fits: half the size, widened again on load
+        label_dtype = np.uint16 if len(slots) < 2 ** 16 else np.int32
+        arrays.update(label_shape=np.array(labels.shape, dtype=np.int64), label_map=labels.astype(label_dtype),
+                      overlap_pixels=overlap_pixels, overlap_slots=overlap_slots)
+
+    # Write next to the target and swap in, so readers never see half a file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_geometry(lot_id, slots, version=0, folder=None):
+    """Geometry from lot_<id>.npz, or None when missing, outdated or unreadable."""
+    path = geometry_path(lot_id, folder)
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['format']) != GEOMETRY_FORMAT or str(data['stamp']) != geometry_stamp(slots):
+                return None
+
+            geometry = LotGeometry.__new__(LotGeometry)
+            geometry.lot_id = lot_id
+            geometry.version = version
+            geometry.scale = 1.0
+            geometry.signature = tuple(int(i) for i in data['signature'])
+            geometry.stamp = str(data['stamp'])
+            geometry._label_maps = {}
+            geometry._union_windows = {}
+            geometry._overlays = {}
+
+            # NpzFile decompresses on every access, so read each array once
+            ids, labels, bboxes = data['ids'], data['labels'], data['bboxes']
+            areas, centroids, masks = data['areas'], data['centroids'], data['masks']
+            points = np.split(data['points'].astype(np.int32), np.cumsum(data['point_counts'])[:-1])
+
+            offset = 0
+            geometry.slots = []
+            for i, slot_id in enumerate(ids.tolist()):
+                x, y, w, h = bboxes[i].tolist()
+                mask = masks[offset:offset + w * h].reshape(h, w)
+                offset += w * h
+                geometry.slots.append(SlotGeometry.restore(
+                    slot_id, str(labels[i]), points[i].reshape(-1, 1, 2),
+                    (x, y, w, h), mask, int(areas[i]), tuple(centroids[i].tolist()),
+                ))
+
+            if 'label_map' in data:
+                shape = tuple(data['label_shape'].tolist())
+                geometry._label_maps[shape] = (data['label_map'].astype(np.int32),
+                                               data['overlap_pixels'], data['overlap_slots'])
+        return geometry
+    except Exception as e:
+        print(f"⚠️ Geometry artifact unreadable ({path}): {e}")
+        return None
+
+
+def remove_geometry(lot_id, folder=None):
+    path = geometry_path(lot_id, folder)
+    if path is not None and os.path.exists(path):
+        os.remove(path)
+
+
+def set_geometry_folder(folder):
+    """Also used as the scheduler's pool initializer, so worker processes find the artifacts."""
+    global GEOMETRY_FOLDER
+    GEOMETRY_FOLDER = folder
+
+
+def get_lot_geometry(lot_id, slots, scale=1.0):
+    """
+    Returns the compiled geometry for a lot (at an analysis scale), rebuilding
+    it when the slot set version changed or the slot rows differ from the
+    cached ones. The rows are compared by content, not by id: another worker
+    process may have saved new polygons under the same slot ids (SQLite hands
+    a redrawn lot's rowids out again). At scale 1.0 the precompiled artifact
+    is used when it matches the slot rows.
+    """
+    version = LOT_SLOT_VERSIONS.get(lot_id, 0)
+    stamp = geometry_stamp(slots)
+
+    geometry = LOT_GEOMETRY_CACHE.get((lot_id, scale))
+    if geometry is not None and geometry.version == version and geometry.stamp == stamp:
+        return geometry
+
+    with _cache_lock:
+        geometry = load_geometry(lot_id, slots, version) if scale == 1.0 else None
+        if geometry is None:
+            geometry = LotGeometry(lot_id, version, slots, scale)
+        LOT_GEOMETRY_CACHE[(lot_id, scale)] = geometry
+    return geometry
+
+
+def invalidate_lot(lot_id):
+    """Call after a lot's slots were rewritten."""
+    with _cache_lock:
+        LOT_SLOT_VERSIONS[lot_id] = LOT_SLOT_VERSIONS.get(lot_id, 0) + 1
+        for key in [k for k in LOT_GEOMETRY_CACHE if k[0] == lot_id]:
+            del LOT_GEOMETRY_CACHE[key]
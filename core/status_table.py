@@ -0,0 +1,278 @@
+import mmap
+import os
+import threading
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows: no shared table, statuses stay process-local
+
+# Slot states as stored in the table (the index is the stored code); 0 = unused
+STATUS_CODES = (None, 'available', 'full', 'reserved')
+_CODE_OF = {name: code for code, name in enumerate(STATUS_CODES) if name}
+
+# File header: magic, layout version, capacity. Files with another header are recreated
+TABLE_MAGIC = b'SPST'
+TABLE_FORMAT = 2
+HEADER_BYTES = 64
+HEADER_DTYPE = np.dtype([('magic', 'S4'), ('format', '<u4'), ('lots', '<u4'), ('slots', '<u4')])
+
+# Reads retried this often while a writer is mid-update before giving up
+READ_RETRIES = 1000
+
+# The shared table of this process (set from Config.STATUS_TABLE_PATH);
+# None = statuses only live in core.detector.LOT_STATUS_CACHE
+STATUS_TABLE = None
+
+# This process' part in the table, see elect_writer(): None = no election
+# (each process runs its own detector), else 'reader' or 'writer'
+ROLE = None
+
+
+def row_dtype(slots):
+    return np.dtype([
+        ('seq', '<u8'),              # Odd while a write is in progress
+        ('lot_id', '<i8'),           # 0 = free row
+        ('count', '<u4'),
+        ('pad', '<u4'),
+        ('slot_ids', '<i8', (slots,)),
+        ('states', 'u1', (slots,)),
+        # The writer's event log (core.events): epoch, sequence number and
+        # debounced states, so every process numbers the lot's changes alike
+        ('epoch', '<u8'),
+        ('event_seq', '<u8'),
+        ('stable', 'u1', (slots,)),
+    ], align=True)
+
+
+class StatusTable:
+    """
+    Slot statuses of every lot in a memory-mapped file, shared by all
+    processes that open it (detector workers, gunicorn web workers).
+
+    One fixed-size row per lot, guarded by a sequence counter (a seqlock):
+    a writer makes it odd, writes, and makes it even again; a reader copies
+    the row and retries if the counter moved or was odd meanwhile. Readers
+    therefore never lock, and the counter only moves when statuses change.
+    Writers of the same lot are serialized with a record lock on the row.
+    """
+
+    def __init__(self, path, lots=256, slots=512):
+        self.path = path
+        self.lots = lots
+        self.slots = slots
+        self.dtype = row_dtype(slots)
+        self._rows = {}   # { lot_id: row index }, checked against the table on use
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = HEADER_BYTES + lots * self.dtype.itemsize
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            header = os.pread(self.fd, HEADER_DTYPE.itemsize, 0)
+            expected = np.array((TABLE_MAGIC, TABLE_FORMAT, lots, slots), dtype=HEADER_DTYPE).tobytes()
+            if header != expected or os.fstat(self.fd).st_size != size:
+                # New file or another layout: start empty
+                os.ftruncate(self.fd, 0)
+                os.ftruncate(self.fd, size)
+                os.pwrite(self.fd, expected, 0)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+        self.mm = mmap.mmap(self.fd, size)
+        rows = np.ndarray((lots,), dtype=self.dtype, buffer=self.mm, offset=HEADER_BYTES)
+        self.seq = rows['seq']
+        self.lot_ids = rows['lot_id']
+        self.counts = rows['count']
+        self.slot_ids = rows['slot_ids']
+        self.states = rows['states']
+        self.epochs = rows['epoch']
+        self.event_seqs = rows['event_seq']
+        self.stable = rows['stable']
+
+    def _row(self, lot_id):
+        row = self._rows.get(lot_id)
+        if row is not None and self.lot_ids[row] == lot_id:
+            return row
+        found = np.flatnonzero(self.lot_ids == lot_id)
+        if not len(found):
+            self._rows.pop(lot_id, None)
+            return None
+        row = self._rows[lot_id] = int(found[0])
+        return row
+
+    def _claim_row(self, lot_id):
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            row = self._row(lot_id)  # Another process may have just claimed it
+            if row is None:
+                free = np.flatnonzero(self.lot_ids == 0)
+                if not len(free):
+                    return None
+                row = self._rows[lot_id] = int(free[0])
+                self.counts[row] = 0
+                self.lot_ids[row] = lot_id
+            return row
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def _locked(self, row):
+        start = HEADER_BYTES + row * self.dtype.itemsize
+        return _RowLock(self.fd, start, self.dtype.itemsize)
+
+    def write(self, lot_id, statuses, events=None):
+        """
+        Stores {slot_id: status} for a lot, and with `events` = (epoch, seq,
+        {slot_id: debounced status}) the state of its event log. False if it
+        doesn't fit the table.
+        """
+        n = len(statuses)
+        if lot_id <= 0 or n > self.slots:
+            return False
+        ids = np.fromiter(statuses.keys(), np.int64, n)
+        codes = np.fromiter((_CODE_OF[s] for s in statuses.values()), np.uint8, n)
+        epoch, event_seq, stable = events or (0, 0, {})
+        stable_codes = np.fromiter((_CODE_OF.get(stable.get(slot_id), 0) for slot_id in statuses), np.uint8, n)
+
+        with self._lock:
+            row = self._row(lot_id)
+            if row is None:
+                row = self._claim_row(lot_id)
+                if row is None:
+                    return False
+            with self._locked(row):
+                if (self.counts[row] == n and np.array_equal(self.slot_ids[row, :n], ids)
+                        and np.array_equal(self.states[row, :n], codes)
+                        and self.epochs[row] == epoch and self.event_seqs[row] == event_seq):
+                    return True  # Unchanged: readers keep their sequence number
+
+                writing = int(self.seq[row]) | 1  # Stays odd if a crashed writer left it odd
+                self.seq[row] = writing
+                self.slot_ids[row, :n] = ids
+                self.states[row, :n] = codes
+                self.stable[row, :n] = stable_codes
+                self.epochs[row] = epoch
+                self.event_seqs[row] = event_seq
+                self.counts[row] = n
+                self.seq[row] = writing + 1
+        return True
+
+    def _read_row(self, lot_id, columns):
+        """A consistent copy of `columns` (per-slot arrays cut to the lot's slots) of a lot's row."""
+        row = self._row(lot_id)
+        if row is None:
+            return None
+        for _ in range(READ_RETRIES):
+            before = self.seq[row]
+            if before & 1:
+                os.sched_yield()  # Let the writer finish
+                continue
+            n = int(self.counts[row])
+            values = [column[row, :n].tolist() if column.ndim == 2 else int(column[row]) for column in columns]
+            if self.seq[row] == before and self.lot_ids[row] == lot_id:
+                return values
+        return None
+
+    def read(self, lot_id):
+        """{slot_id: status} of a lot, or None if the table has nothing for it."""
+        values = self._read_row(lot_id, (self.slot_ids, self.states))
+        if values is None:
+            return None
+        ids, codes = values
+        return {slot_id: STATUS_CODES[code] for slot_id, code in zip(ids, codes)}
+
+    def read_events(self, lot_id):
+        """(epoch, seq, {slot_id: debounced status}) of a lot's event log, or None before the writer's first write."""
+        values = self._read_row(lot_id, (self.epochs, self.event_seqs, self.slot_ids, self.stable))
+        if values is None or not values[0]:
+            return None
+        epoch, seq, ids, codes = values
+        return epoch, seq, {slot_id: STATUS_CODES[code] for slot_id, code in zip(ids, codes) if code}
+
+    def clear(self, lot_id):
+        with self._lock:
+            row = self._row(lot_id)
+            if row is None:
+                return
+            with self._locked(row):
+                self.seq[row] = int(self.seq[row]) | 1
+                self.counts[row] = 0
+                self.lot_ids[row] = 0
+                self.seq[row] += 1
+            self._rows.pop(lot_id, None)
+
+
+class _RowLock:
+    """POSIX record lock on one row's bytes (excludes other processes, not threads)."""
+
+    def __init__(self, fd, start, length):
+        self.fd, self.start, self.length = fd, start, length
+
+    def __enter__(self):
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, self.length, self.start)
+
+    def __exit__(self, *exc):
+        fcntl.lockf(self.fd, fcntl.LOCK_UN, self.length, self.start)
+
+
+def set_status_table(path, lots=256, slots=512):
+    """Opens (or creates) the shared table; None keeps statuses process-local."""
+    global STATUS_TABLE
+    if path and fcntl is None:
+        print("⚠️ Shared status table needs POSIX file locks; statuses stay per process")
+        path = None
+    STATUS_TABLE = StatusTable(path, lots, slots) if path else None
+    return STATUS_TABLE
+
+
+def elect_writer(on_elected):
+    """
+    Runs `on_elected()` (starting the detector) in one process only: the one
+    holding a flock on <table>.writer. Every other process stays a reader of
+    the table and waits on the lock in a thread, so one of them takes over
+    when the writer exits. Without a table every process runs it at once.
+    """
+    global ROLE
+    if STATUS_TABLE is None:
+        on_elected()
+        return
+    ROLE = 'reader'
+
+    def wait_for_lock():
+        global ROLE
+        fd = os.open(STATUS_TABLE.path + '.writer', os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)  # Held (fd left open) until this process exits
+        ROLE = 'writer'
+        on_elected()
+
+    threading.Thread(target=wait_for_lock, name="status-writer-election", daemon=True).start()
+
+
+def is_reader():
+    """True in a process that only reads the statuses another process's detector writes."""
+    return ROLE == 'reader'
+
+
+def publish_status(lot_id, statuses, log=None):
+    """Writes a lot's statuses, and the state of its core.events log when given."""
+    if STATUS_TABLE is None:
+        return
+    events = log.state() if log is not None else None
+    if not STATUS_TABLE.write(lot_id, statuses, events):
+        print(f"⚠️ Status table full or lot too large (lot {lot_id}); see STATUS_TABLE_LOTS/SLOTS")
+
+
+def read_status(lot_id):
+    return STATUS_TABLE.read(lot_id) if STATUS_TABLE is not None else None
+
+
+def read_events(lot_id):
+    return STATUS_TABLE.read_events(lot_id) if STATUS_TABLE is not None else None
+
+
+def clear_status(lot_id):
+    if STATUS_TABLE is not None:
+        STATUS_TABLE.clear(lot_id)
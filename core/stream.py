@@ -0,0 +1,222 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+
+from core.vision_utils import encode_frame
+
+# Running producers, one per lot
+# Format: { lot_id: LotStream }
+LOT_STREAMS = {}
+_streams_lock = threading.Lock()
+
+# Default stream profiles (overridden by Config.STREAM_PROFILES)
+# width: output width in pixels (None = camera resolution), fps: None = every frame
+DEFAULT_PROFILES = {
+    'full': {'width': None, 'quality': 95, 'fps': None},
+    'preview': {'width': 640, 'quality': 70, 'fps': 10},
+    'thumb': {'width': 320, 'quality': 60, 'fps': 2},
+}
+
+
+def _resolve(futures):
+    for future in futures:
+        if not future.done():
+            future.set_result(None)
+
+
+class AsyncWaiters:
+    """
+    Coroutines waiting for a notify_all() that comes from a plain thread
+    (a producer, the detector). Used by the async server (core/asgi.py):
+    one call_soon_threadsafe per event loop wakes all of its waiters.
+    """
+
+    def __init__(self):
+        self._futures = {}  # { event loop: set of futures }
+        self._lock = threading.Lock()
+
+    def register(self):
+        """Future resolved by the next notify_all(). Register before checking the condition."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            self._futures.setdefault(loop, set()).add(future)
+        return future
+
+    def discard(self, future):
+        with self._lock:
+            futures = self._futures.get(future.get_loop())
+            if futures is not None:
+                futures.discard(future)
+
+    async def wait(self, future, timeout):
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.discard(future)
+
+    def notify_all(self):
+        with self._lock:
+            waiting, self._futures = self._futures, {}
+        for loop, futures in waiting.items():
+            try:
+                loop.call_soon_threadsafe(_resolve, futures)
+            except RuntimeError:
+                pass  # Loop already closed
+
+
+class LotStream:
+    """
+    Fan-out of one producer thread to any number of viewers.
+
+    The producer publishes each annotated frame once; it is encoded once per
+    stream profile that has viewers (at that profile's size, quality and
+    frame-rate cap). Viewers always pick up the newest frame of their
+    profile, so a slow client skips frames instead of holding back the
+    producer or the other viewers.
+    """
+
+    def __init__(self, lot_id, target, grace_seconds=10.0, profiles=None):
+        self.lot_id = lot_id
+        self.grace_seconds = grace_seconds
+        self.profiles = profiles or DEFAULT_PROFILES
+
+        # Per profile: newest encoded frame, its sequence number and viewer count
+        self.frames_by_profile = {}   # { profile: bytes }
+        self.seqs = {}                # { profile: int }
+        self.viewers = {}             # { profile: int }
+        self._encoded_at = {}         # { profile: monotonic time of last encode }
+        self._resized = {}            # { profile: downscaled frame buffer, reused }
+
+        self.closed = False
+        self.subscribers = 0
+        self._idle_since = time.monotonic()
+
+        self._cond = threading.Condition()
+        self._async_waiters = AsyncWaiters()
+        self._thread = threading.Thread(target=self._run, args=(target,),
+                                        name=f"lot-stream-{lot_id}", daemon=True)
+
+    def _run(self, target):
+        try:
+            target(self)
+        except Exception as e:
+            print(f"⚠️ Stream Error (lot {self.lot_id}): {e}")
+        finally:
+            self._close()
+
+    def _close(self):
+        with _streams_lock:
+            if LOT_STREAMS.get(self.lot_id) is self:
+                del LOT_STREAMS[self.lot_id]
+            with self._cond:
+                self.closed = True
+                self._cond.notify_all()
+        self._async_waiters.notify_all()
+
+    # --- Producer side ---
+    def frame_interval(self, source_fps):
+        """Seconds between frames the producer needs to serve its current viewers."""
+        with self._cond:
+            caps = [self.profiles[p]['fps'] or source_fps for p, n in self.viewers.items() if n > 0]
+        return 1.0 / min(max(caps, default=source_fps), source_fps)
+
+    def publish(self, img):
+        """Encodes `img` once for every watched profile that is due and wakes its viewers."""
+        now = time.monotonic()
+        with self._cond:
+            due = [p for p, n in self.viewers.items() if n > 0 and (
+                not self.profiles[p]['fps'] or now - self._encoded_at.get(p, 0.0) >= 1.0 / self.profiles[p]['fps'])]
+
+        encoded = {}
+        for p in due:
+            width = self.profiles[p]['width']
+            resized = self._resized.get(p)
+            if width and img.shape[1] > width:
+                shape = (round(img.shape[0] * width / img.shape[1]), width) + img.shape[2:]
+                if resized is None or resized.shape != shape:
+                    resized = self._resized[p] = np.empty(shape, dtype=img.dtype)
+            encoded[p] = encode_frame(img, width, self.profiles[p]['quality'], resized)
+
+        with self._cond:
+            for profile, frame in encoded.items():
+                self.frames_by_profile[profile] = frame
+                self.seqs[profile] = self.seqs.get(profile, 0) + 1
+                self._encoded_at[profile] = now
+            if encoded:
+                self._cond.notify_all()
+        if encoded:
+            self._async_waiters.notify_all()
+
+    def keep_running(self):
+        """False once the last viewer has been gone for longer than the grace period."""
+        with _streams_lock:
+            with self._cond:
+                idle = self.subscribers == 0 and time.monotonic() - self._idle_since > self.grace_seconds
+            if idle and LOT_STREAMS.get(self.lot_id) is self:
+                # Unregister under the lock so open_stream() can't hand us out any more
+                del LOT_STREAMS[self.lot_id]
+        return not idle
+
+    # --- Viewer side ---
+    def unsubscribe(self, profile):
+        with self._cond:
+            self.viewers[profile] -= 1
+            self.subscribers -= 1
+            if self.subscribers == 0:
+                self._idle_since = time.monotonic()
+
+    def frames(self, profile):
+        """Yields the newest frame of `profile` each time one arrives, until the stream closes."""
+        last_seq = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self.seqs.get(profile, 0) != last_seq or self.closed, timeout=1.0)
+                if self.closed:
+                    return
+                if self.seqs.get(profile, 0) == last_seq:
+                    continue
+                last_seq, frame = self.seqs[profile], self.frames_by_profile[profile]
+            yield frame
+
+    async def aframes(self, profile):
+        """frames() for a coroutine: waits on the event loop instead of holding a thread."""
+        last_seq = 0
+        while True:
+            waiter = self._async_waiters.register()
+            with self._cond:
+                closed, seq = self.closed, self.seqs.get(profile, 0)
+                frame = self.frames_by_profile.get(profile)
+            if closed:
+                self._async_waiters.discard(waiter)
+                return
+            if seq == last_seq:
+                await self._async_waiters.wait(waiter, timeout=1.0)
+                continue
+            self._async_waiters.discard(waiter)
+            last_seq = seq
+            yield frame
+
+
+def open_stream(lot_id, target, profile='full', grace_seconds=10.0, profiles=None):
+    """
+    Returns the lot's running stream (starting it with `target` if needed)
+    with one `profile` viewer registered. Callers must call
+    unsubscribe(profile) when done.
+    """
+    with _streams_lock:
+        stream = LOT_STREAMS.get(lot_id)
+        started = stream is None
+        if started:
+            stream = LotStream(lot_id, target, grace_seconds, profiles)
+            LOT_STREAMS[lot_id] = stream
+        with stream._cond:
+            stream.subscribers += 1
+            stream.viewers[profile] = stream.viewers.get(profile, 0) + 1
+    if started:
+        stream._thread.start()
+    return stream
@@ -0,0 +1,261 @@
+import cv2
+import numpy as np
+
+from core.slot_manager import COUNT_ENGINES
+
+# How far (in pixels) the preprocessing chain below looks around a pixel:
+# GaussianBlur 3x3 (1) + adaptiveThreshold 25x25 (12) + medianBlur 5 (2) + dilate 3x3 (1)
+PREPROCESS_RADIUS = 16
+MOTION_SPREAD_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (2 * PREPROCESS_RADIUS + 1, 2 * PREPROCESS_RADIUS + 1))
+DILATE_KERNEL = np.ones((3, 3), np.uint8)
+
+def preprocess_gray(img_gray):
+    img_blur = cv2.GaussianBlur(img_gray, (3, 3), 1)
+    img_thresh = cv2.adaptiveThreshold(img_blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                       cv2.THRESH_BINARY_INV, 25, 16)
+    img_median = cv2.medianBlur(img_thresh, 5)
+    return cv2.dilate(img_median, DILATE_KERNEL, iterations=1)
+
+def preprocess_frame(img):
+    return preprocess_gray(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+
+def encode_frame(img, width=None, quality=95, resized=None):
+    """
+    JPEG bytes of `img`, downscaled to `width` pixels wide if given (into
+    `resized` when it is an array of the right size).
+    """
+    if width and img.shape[1] > width:
+        height = round(img.shape[0] * width / img.shape[1])
+        img = cv2.resize(img, (width, height), dst=resized, interpolation=cv2.INTER_AREA)
+    ret, buffer = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes()
+
+def preprocess_window(img_gray, window):
+    """
+    preprocess_gray() for one slice of the frame only. The PREPROCESS_RADIUS
+    margin makes the result identical to that slice of a fully preprocessed
+    frame.
+    """
+    padded, inner = padded_window(window, img_gray.shape)
+    return preprocess_gray(img_gray[padded])[inner]
+
+def to_analysis_gray(img, scale=1.0):
+    """Grayscale frame at the analysis scale (see Config.DETECTOR_ANALYSIS_SCALE)."""
+    img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    if scale != 1.0:
+        img_gray = cv2.resize(img_gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return img_gray
+
+def preprocess_lot(img_gray, geometry):
+    """
+    Preprocesses only the union bounding box of the lot's slots. Pixels
+    outside it are 0, which no slot ever counts.
+    """
+    img_processed = np.zeros_like(img_gray)
+    window = geometry.union_window(img_gray.shape)
+    if window is not None:
+        img_processed[window] = preprocess_window(img_gray, window)
+    return img_processed
+
+def padded_window(window, shape):
+    """`window` grown by PREPROCESS_RADIUS (clipped to `shape`), and where `window` sits inside it."""
+    rows, cols = window
+    y0, x0 = max(rows.start - PREPROCESS_RADIUS, 0), max(cols.start - PREPROCESS_RADIUS, 0)
+    y1 = min(rows.stop + PREPROCESS_RADIUS, shape[0])
+    x1 = min(cols.stop + PREPROCESS_RADIUS, shape[1])
+    inner = (slice(rows.start - y0, rows.stop - y0), slice(cols.start - x0, cols.stop - x0))
+    return (slice(y0, y1), slice(x0, x1)), inner
+
+def count_slot_region(img_gray, slot):
+    """Preprocesses only the neighbourhood of one slot and counts inside it."""
+    window, mask = slot.roi(img_gray.shape)
+    if window is None:
+        return 0
+    inner = preprocess_window(img_gray, window)
+    return cv2.countNonZero(cv2.bitwise_and(inner, inner, mask=mask))
+
+
+class FramePipeline:
+    """
+    Grayscale conversion, preprocessing and counting for one lot at one
+    frame resolution, with every intermediate image allocated once and
+    reused through OpenCV's dst= outputs.
+
+    The arrays returned by gray() and preprocess() belong to the pipeline
+    and are overwritten by the next frame.
+    """
+
+    def __init__(self, geometry, frame_shape, scale=1.0):
+        self.geometry = geometry
+        self.frame_shape = tuple(frame_shape[:2])
+        self.scale = scale
+
+        self.gray_full = np.empty(self.frame_shape, dtype=np.uint8)
+        if scale != 1.0:
+            # Same output size as to_analysis_gray() gets from fx/fy
+            shape = cv2.resize(self.gray_full, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA).shape
+            self.gray_scaled = np.empty(shape, dtype=np.uint8)
+        else:
+            self.gray_scaled = self.gray_full
+        shape = self.gray_scaled.shape
+
+        # Pixels outside the slots' union window are never written: they stay 0
+        self.processed = np.zeros(shape, dtype=np.uint8)
+        self.window = geometry.union_window(shape)
+        if self.window is not None:
+            self.padded, self.inner = padded_window(self.window, shape)
+            padded_shape = self.gray_scaled[self.padded].shape
+            self.blur, self.thresh, self.median, self.dilated = (
+                np.empty(padded_shape, dtype=np.uint8) for _ in range(4))
+
+        # Label map as uint16 so cv2.calcHist can count every slot in one call.
+        # Pixels shared by several slots (listed slot by slot) are gathered
+        # into a reused buffer and summed per slot.
+        self.label_map = None
+        if len(geometry.slots) < 2 ** 16 - 1 and self.window is not None:
+            labels, self.overlap_pixels, overlap_slots = geometry.label_map(shape)
+            self.label_map = np.ascontiguousarray(labels[self.window], dtype=np.uint16)
+            self.overlap_labels, self.overlap_starts = np.unique(overlap_slots, return_index=True)
+            self.overlap_values = np.empty(self.overlap_pixels.size, dtype=np.uint8)
+            self.overlap_hits = np.empty(self.overlap_pixels.size, dtype=np.int64)
+
+    def matches(self, geometry, frame_shape, scale):
+        return geometry is self.geometry and tuple(frame_shape[:2]) == self.frame_shape and scale == self.scale
+
+    def gray(self, img):
+        """Grayscale frame at the analysis scale, like to_analysis_gray()."""
+        cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=self.gray_full)
+        if self.scale != 1.0:
+            cv2.resize(self.gray_full, None, dst=self.gray_scaled, fx=self.scale, fy=self.scale,
+                       interpolation=cv2.INTER_AREA)
+        return self.gray_scaled
+
+    def preprocess(self, img_gray):
+        """preprocess_lot() into the pipeline's buffers."""
+        if self.window is None:
+            return self.processed
+        src = img_gray[self.padded]
+        cv2.GaussianBlur(src, (3, 3), 1, dst=self.blur)
+        cv2.adaptiveThreshold(self.blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                              cv2.THRESH_BINARY_INV, 25, 16, dst=self.thresh)
+        cv2.medianBlur(self.thresh, 5, dst=self.median)
+        cv2.dilate(self.median, DILATE_KERNEL, dst=self.dilated, iterations=1)
+        np.copyto(self.processed[self.window], self.dilated[self.inner])
+        return self.processed
+
+    def count(self, img_processed, engine='roi'):
+        """Non-zero pixels per slot, same result as COUNT_ENGINES[engine]."""
+        if engine != 'labelmap' or self.label_map is None:
+            return COUNT_ENGINES[engine](self.geometry, img_processed)
+
+        n = len(self.geometry.slots) + 1
+        counts = cv2.calcHist([self.label_map], [0], img_processed[self.window], [n], [0, n])
+        counts = counts.reshape(-1).astype(np.int64)
+        if self.overlap_pixels.size:
+            # mode='clip' keeps np.take from buffering its output (indices are always valid)
+            np.take(img_processed.reshape(-1), self.overlap_pixels, out=self.overlap_values, mode='clip')
+            np.not_equal(self.overlap_values, 0, out=self.overlap_hits, casting='unsafe')
+            counts[self.overlap_labels] += np.add.reduceat(self.overlap_hits, self.overlap_starts)
+        return counts[1:].tolist()
+
+
+class IncrementalCounter:
+    """
+    Motion-gated slot counting for one lot.
+
+    Each frame is diffed against the last analyzed one; only slots whose
+    polygon saw enough changed pixels are preprocessed and recounted, the
+    rest keep their previous count. A full recount runs every
+    `full_refresh` frames, when the slot geometry or resolution changes, or
+    when too many slots moved at once for the incremental path to pay off.
+    """
+
+    def __init__(self, motion_threshold=25, min_changed=0.02, full_refresh=50, max_changed_share=0.5):
+        self.motion_threshold = motion_threshold    # Gray levels a pixel must move by
+        self.min_changed = min_changed              # Share of a slot's area that must move
+        self.full_refresh = full_refresh
+        self.max_changed_share = max_changed_share
+
+        self.reference = None  # Gray frame the current counts were taken from (owned copy)
+        self.counts = []
+        self._key = None
+        self._since_full = 0
+        self._motion = None    # Reused diff / motion buffers, (re)allocated with the reference
+        self._spread = None
+
+        # Totals for tuning
+        self.frames = 0
+        self.slots_evaluated = 0
+        self.slots_skipped = 0
+
+    @property
+    def skip_ratio(self):
+        total = self.slots_evaluated + self.slots_skipped
+        return self.slots_skipped / total if total else 0.0
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'slots_evaluated': self.slots_evaluated,
+            'slots_skipped': self.slots_skipped,
+            'skip_ratio': round(self.skip_ratio, 4),
+        }
+
+    def count(self, img_gray, geometry, engine='roi', pipeline=None):
+        """
+        Counts for `img_gray`. With a FramePipeline for this geometry the full
+        recount and the motion counts go through its preallocated buffers.
+        """
+        n = len(geometry.slots)
+        self.frames += 1
+
+        key = (geometry.version, geometry.stamp, img_gray.shape)
+        changed = None
+        if self.reference is not None and key == self._key and self._since_full < self.full_refresh:
+            # 1. Which slots moved since they were last evaluated?
+            cv2.absdiff(img_gray, self.reference, dst=self._motion)
+            cv2.threshold(self._motion, self.motion_threshold, 255, cv2.THRESH_BINARY, dst=self._motion)
+            if cv2.countNonZero(self._motion) == 0:
+                # Static scene: nothing to recount
+                changed = []
+            else:
+                # Preprocessing looks PREPROCESS_RADIUS pixels around, so motion next to a slot counts too
+                cv2.dilate(self._motion, MOTION_SPREAD_KERNEL, dst=self._spread)
+                if pipeline is not None:
+                    motion_counts = pipeline.count(self._spread, engine)
+                else:
+                    motion_counts = COUNT_ENGINES[engine](geometry, self._spread)
+                changed = [i for i, (slot, moved) in enumerate(zip(geometry.slots, motion_counts))
+                           if moved > self.min_changed * max(slot.area, 1)]
+            if len(changed) > self.max_changed_share * n:
+                changed = None
+
+        if changed is None:
+            # 2a. Full recount
+            if pipeline is not None:
+                self.counts = list(pipeline.count(pipeline.preprocess(img_gray), engine))
+            else:
+                self.counts = list(COUNT_ENGINES[engine](geometry, preprocess_lot(img_gray, geometry)))
+            if self.reference is None or self.reference.shape != img_gray.shape:
+                self.reference = np.empty_like(img_gray)
+                self._motion = np.empty_like(img_gray)
+                self._spread = np.empty_like(img_gray)
+            # A copy: img_gray may be a buffer the caller reuses for the next frame
+            np.copyto(self.reference, img_gray)
+            self._key = key
+            self._since_full = 0
+            self.slots_evaluated += n
+            return self.counts
+
+        # 2b. Recount only the slots that moved, and move their reference forward
+        for i in changed:
+            slot = geometry.slots[i]
+            self.counts[i] = count_slot_region(img_gray, slot)
+            window, mask = slot.roi(img_gray.shape)
+            if window is not None:
+                np.copyto(self.reference[window], img_gray[window], where=mask > 0)
+
+        self._since_full += 1
+        self.slots_evaluated += len(changed)
+        self.slots_skipped += n - len(changed)
+        return self.counts
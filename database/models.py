@@ -24,7 +24,7 @@ class User(db.Model):
     
 class ParkingLot(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    provider_id = db.Column(db.Integer, db.ForeignKey('cc_register.id'), nullable=False)
+    provider_id = db.Column(db.Integer, db.ForeignKey('cc_register.id'), nullable=False, index=True)
     name = db.Column(db.String(100), nullable=False)
     location = db.Column(db.String(100), nullable=False, default='Unknown')
     video_path = db.Column(db.String(200), nullable=False)
@@ -50,12 +50,22 @@ class ParkingLot(db.Model):
 
 class Slot(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    parking_lot_id = db.Column(db.Integer, db.ForeignKey('parking_lot.id'), nullable=False)
+    parking_lot_id = db.Column(db.Integer, db.ForeignKey('parking_lot.id'), nullable=False, index=True)
     slot_label = db.Column(db.String(10), nullable=False)
     # Stores coordinates as JSON string: "[[x1,y1], [x2,y2], ...]"
     points = db.Column(db.Text, nullable=False) 
 
 class Booking(db.Model):
+    # Indexes for the hot booking queries (checked by tests/test_query_plans.py):
+    # - a slot's active bookings by time: conflict check, detector refresh, lot joins
+    # - a customer's bookings, newest first
+    # - a slot's bookings, newest first: provider dashboard pages (core/paging.py)
+    __table_args__ = (
+        db.Index('ix_booking_slot_active_end', 'slot_id', 'is_active', 'end_time', 'start_time'),
+        db.Index('ix_booking_user_start', 'user_id', 'start_time'),
+        db.Index('ix_booking_slot_start', 'slot_id', 'start_time'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     slot_id = db.Column(db.Integer, db.ForeignKey('slot.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('cc_register.id'), nullable=True)
@@ -65,8 +75,8 @@ class Booking(db.Model):
     phone_number = db.Column(db.String(20), nullable=True)
     vehicle_number = db.Column(db.String(20), nullable=True)
     
-    start_time = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    end_time = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    start_time = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True) # Latest bookings
+    end_time = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True) # Expiry alerts
     
     # Smart Gate Tracking
     check_in_time = db.Column(db.DateTime, nullable=True)
@@ -80,7 +90,34 @@ class Booking(db.Model):
     
     slot = db.relationship('Slot', backref='bookings')
 
+class SlotHold(db.Model):
+    # A slot kept for a customer while they pay (see core/booking.py); ignored once expired
+    __table_args__ = (db.Index('ix_slot_hold_slot_expires', 'slot_id', 'expires_at'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    slot_id = db.Column(db.Integer, db.ForeignKey('slot.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('cc_register.id'), nullable=True)
+    token = db.Column(db.String(32), unique=True, nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class LotDailyStat(db.Model):
+    # A lot's bookings, revenue and booked hours per day of booking start, kept
+    # up to date by the booking writes (see core/rollups.py). The row with
+    # day 'all' holds the lot's lifetime totals
+    __tablename__ = 'lot_daily_stat'
+    parking_lot_id = db.Column(db.Integer, db.ForeignKey('parking_lot.id'), primary_key=True)
+    day = db.Column(db.String(10), primary_key=True) # 'YYYY-MM-DD' | 'all'
+    bookings = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+    booked_hours = db.Column(db.Float, nullable=False, default=0.0)
+
 class Review(db.Model):
+    # A lot's reviews, newest first
+    __table_args__ = (db.Index('ix_review_lot_created', 'parking_lot_id', 'created_at'),)
+
     id = db.Column(db.Integer, primary_key=True)
     parking_lot_id = db.Column(db.Integer, db.ForeignKey('parking_lot.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('cc_register.id'), nullable=False)
@@ -89,3 +126,25 @@ class Review(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     user = db.relationship('User', backref='reviews')
+
+class OccupancyTimeline(db.Model):
+    # Result of a batch analysis of a lot's video (see core/batch.py)
+    # Looked up as a lot's latest finished timeline
+    __table_args__ = (db.Index('ix_occupancy_timeline_lot_status_created', 'parking_lot_id', 'status', 'created_at'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    parking_lot_id = db.Column(db.Integer, db.ForeignKey('parking_lot.id'), nullable=False)
+    video_path = db.Column(db.String(200), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    status = db.Column(db.String(20), default='running') # running | done | failed | cancelled
+    duration = db.Column(db.Float, default=0.0) # Seconds of video analyzed
+    frames = db.Column(db.Integer, default=0)
+    # Run-length encoded state changes per slot, JSON:
+    # { "slot_id": [[seconds, "full" | "available"], ...] }
+    runs = db.Column(db.Text, nullable=True)
+
+    # Deleted with their lot (parking_lot_id can't be nulled out)
+    parking_lot = db.relationship('ParkingLot', backref=db.backref('timelines', cascade='all, delete-orphan'))
+
+    def slot_runs(self):
+        return {int(k): v for k, v in json.loads(self.runs or '{}').items()}
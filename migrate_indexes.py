@@ -0,0 +1,40 @@
+"""
+Adds the indexes declared in database/models.py to an existing database
+(db.create_all() only creates them with new tables). Safe to run again.
+
+    python migrate_indexes.py
+"""
+from flask import Flask
+from sqlalchemy import inspect
+from database.models import db
+from config import Config
+
+
+def create_indexes(engine):
+    """Creates every declared index the database doesn't have yet; returns their names."""
+    inspector = inspect(engine)
+    created = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing:
+                index.create(bind=engine)
+                created.append(index.name)
+    return created
+
+
+if __name__ == "__main__":
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    db.init_app(app)
+
+    with app.app_context():
+        try:
+            created = create_indexes(db.engine)
+            for name in created:
+                print(f"Created index {name}")
+            print(f"✅ Indexes up to date ({len(created)} created)")
+        except Exception as e:
+            print(f"⚠️ Index migration failed: {e}")
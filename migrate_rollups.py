@@ -0,0 +1,24 @@
+"""
+Creates the per-lot revenue rollup table (database/models.py LotDailyStat)
+in an existing database and fills it from the bookings. Later booking writes
+keep it up to date; run again only to repair it.
+
+    python migrate_rollups.py
+"""
+from flask import Flask
+from database.models import db, LotDailyStat
+from core.rollups import rebuild_rollups
+from config import Config
+
+
+if __name__ == "__main__":
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    db.init_app(app)
+
+    with app.app_context():
+        try:
+            LotDailyStat.__table__.create(bind=db.engine, checkfirst=True)
+            print(f"✅ Revenue rollups rebuilt ({rebuild_rollups()} rows)")
+        except Exception as e:
+            print(f"⚠️ Rollup migration failed: {e}")
@@ -0,0 +1,178 @@
+"""
+Offline detector benchmark: replays a clip through the detection pipeline
+with no Flask request and no database, and checks the per-slot statuses
+against recorded expected outputs.
+
+    python scripts/benchmark_detector.py                 # synthetic clip, 50/150/300 slots
+    python scripts/benchmark_detector.py --engine roi --scale 0.5
+    python scripts/benchmark_detector.py --record        # re-record the expected statuses
+    python scripts/benchmark_detector.py --video lot.mp4 --slots slots.json
+
+The synthetic clip is files/carParkImg.png with a few cars driving across,
+written as a lossless PNG sequence so the recorded statuses do not depend
+on a video codec.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import cv2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from check_count_engines import make_slots
+from core.detector import classify_counts, draw_slots
+from core.slot_manager import LotGeometry, COUNT_ENGINES
+from core.vision_utils import FramePipeline, encode_frame, IncrementalCounter
+
+IMAGE_PATH = os.path.join(ROOT, "files", "carParkImg.png")
+EXPECTED_PATH = os.path.join(ROOT, "scripts", "fixtures", "benchmark_expected.json")
+
+# Slot grids (cols, rows) benchmarked on the synthetic clip
+SLOT_GRIDS = {50: (10, 5), 150: (15, 10), 300: (20, 15)}
+STAGES = ('decode', 'preprocess', 'count', 'draw', 'encode')
+
+
+def write_synthetic_clip(folder, frames=40):
+    """Reference image with three cars driving across, as frame_000.png, frame_001.png, ..."""
+    base = cv2.imread(IMAGE_PATH)
+    height, width = base.shape[:2]
+    cars = [((40, 40, 200), 180, 9), ((200, 200, 200), 360, -7), ((20, 20, 20), 540, 12)]
+    for i in range(frames):
+        frame = base.copy()
+        for color, y, speed in cars:
+            x = (100 + i * speed) % (width - 120)
+            cv2.rectangle(frame, (x, y), (x + 110, y + 50), color, -1)
+        cv2.imwrite(os.path.join(folder, f"frame_{i:03d}.png"), frame)
+    return os.path.join(folder, "frame_%03d.png")
+
+
+def run(video_path, slots, engine, scale, incremental, encode_quality):
+    """Replays `video_path` once. Returns per-stage seconds, status strings per frame and peak memory."""
+    geometry = LotGeometry(0, 0, slots, scale)
+    draw_geometry = LotGeometry(0, 0, slots) if scale != 1.0 else geometry
+    counter = IncrementalCounter() if incremental else None
+
+    timings = {stage: 0.0 for stage in STAGES}
+    statuses = []
+    cap = cv2.VideoCapture(video_path)
+    img = pipeline = None
+
+    tracemalloc.start()
+    while True:
+        t0 = time.perf_counter()
+        success, img = cap.read(image=img)
+        t1 = time.perf_counter()
+        if not success:
+            break
+
+        if pipeline is None:
+            pipeline = FramePipeline(geometry, img.shape, scale)
+        img_gray = pipeline.gray(img)
+        if counter is not None:
+            # Motion gating preprocesses only what it recounts; it all lands in 'count'
+            t2 = time.perf_counter()
+            counts = counter.count(img_gray, geometry, engine, pipeline)
+        else:
+            img_processed = pipeline.preprocess(img_gray)
+            t2 = time.perf_counter()
+            counts = pipeline.count(img_processed, engine)
+        current_status = classify_counts(geometry, counts, [], lot_id=0)
+        t3 = time.perf_counter()
+
+        draw_slots(img, draw_geometry, current_status)
+        t4 = time.perf_counter()
+        encode_frame(img, quality=encode_quality)
+        t5 = time.perf_counter()
+
+        for stage, seconds in zip(STAGES, (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4)):
+            timings[stage] += seconds
+        statuses.append(''.join(current_status[s.id][0].upper() for s in geometry.slots))
+
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    cap.release()
+    return timings, statuses, peak
+
+
+def compare(expected, statuses):
+    """Number of (frame, slot) statuses that differ from the recording."""
+    if expected is None or len(expected) != len(statuses):
+        return None
+    return sum(a != b for exp, got in zip(expected, statuses) for a, b in zip(exp, got))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline detector benchmark")
+    parser.add_argument('--video', help="Video file or image sequence pattern (default: synthetic clip)")
+    parser.add_argument('--slots', help="JSON list of polygons for --video")
+    parser.add_argument('--engine', default='labelmap', choices=sorted(COUNT_ENGINES))
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--incremental', action='store_true')
+    parser.add_argument('--quality', type=int, default=95, help="JPEG quality for the encode stage")
+    parser.add_argument('--frames', type=int, default=40, help="Synthetic clip length")
+    parser.add_argument('--record', action='store_true', help="Write the statuses as the new expected outputs")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        if args.video:
+            with open(args.slots) as f:
+                polygons = json.load(f)
+            cases = {len(polygons): [SimpleNamespace(id=i + 1, slot_label=f"Slot-{i + 1}", points=json.dumps(p))
+                                     for i, p in enumerate(polygons)]}
+            video_path = args.video
+        else:
+            height, width = cv2.imread(IMAGE_PATH).shape[:2]
+            cases = {n: make_slots(width, height, cols, rows) for n, (cols, rows) in SLOT_GRIDS.items()}
+            video_path = write_synthetic_clip(folder, args.frames)
+
+        expected = {}
+        if os.path.exists(EXPECTED_PATH) and not args.video:
+            with open(EXPECTED_PATH) as f:
+                expected = json.load(f)
+
+        print(f"engine={args.engine} scale={args.scale} incremental={args.incremental}")
+        print(f"{'slots':>6} {'frames':>6} {'fps':>8} " + ' '.join(f"{s + ' ms':>13}" for s in STAGES)
+              + f" {'peak MB':>8}  parity")
+
+        recorded, failed = {}, False
+        for n, slots in cases.items():
+            timings, statuses, peak = run(video_path, slots, args.engine, args.scale,
+                                          args.incremental, args.quality)
+            frames = len(statuses)
+            recorded[str(n)] = statuses
+
+            mismatches = compare(expected.get(str(n)), statuses)
+            if mismatches is None:
+                parity = "no recording"
+            elif mismatches == 0:
+                parity = "✅ match"
+            else:
+                parity = f"❌ {mismatches} statuses differ"
+                failed = True
+
+            total = sum(timings.values())
+            print(f"{n:>6} {frames:>6} {frames / total:>8.1f} "
+                  + ' '.join(f"{timings[s] / frames * 1e3:>13.2f}" for s in STAGES)
+                  + f" {peak / 2 ** 20:>8.1f}  {parity}")
+
+        print(f"Process max RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+    if args.record:
+        os.makedirs(os.path.dirname(EXPECTED_PATH), exist_ok=True)
+        with open(EXPECTED_PATH, 'w') as f:
+            json.dump(recorded, f)
+        print(f"Recorded expected statuses to {EXPECTED_PATH}")
+        return 0
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+import os
+import sys
+import json
+from types import SimpleNamespace
+
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.vision_utils import preprocess_frame
+from core.slot_manager import LotGeometry, COUNT_ENGINES
+
+IMAGE_PATH = os.path.join("files", "carParkImg.png")
+
+def make_slots(width, height, cols=20, rows=15):
+    # Grid of slightly oversized quads so neighbours overlap and edge slots leave the frame
+    w, h = width // cols, height // rows
+    slots = []
+    for r in range(rows):
+        for c in range(cols):
+            x, y = c * w - 4, r * h - 4
+            points = [[x, y], [x + w + 8, y], [x + w + 4, y + h + 8], [x - 2, y + h + 6]]
+            slots.append(SimpleNamespace(id=len(slots) + 1, slot_label=f"Slot-{len(slots) + 1}",
+                                         points=json.dumps(points)))
+    return slots
+
+def main():
+    img = cv2.imread(IMAGE_PATH)
+    if img is None:
+        print(f"Image not found at {IMAGE_PATH}")
+        return 1
+
+    img_processed = preprocess_frame(img)
+    geometry = LotGeometry(0, 0, make_slots(img.shape[1], img.shape[0]))
+
+    reference = COUNT_ENGINES['roi'](geometry, img_processed)
+    failed = False
+    for name, engine in COUNT_ENGINES.items():
+        counts = engine(geometry, img_processed)
+        mismatches = [s.label for s, a, b in zip(geometry.slots, reference, counts) if a != b]
+        if mismatches:
+            failed = True
+            print(f"❌ {name}: {len(mismatches)} slots differ, e.g. {mismatches[:5]}")
+        else:
+            print(f"✅ {name}: {len(counts)} slots match the per-slot engine")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
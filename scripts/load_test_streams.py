@@ -0,0 +1,237 @@
+"""
+Load test for the async serving mode (asgi.py): holds thousands of mostly
+idle stream connections against one server process and reports how many
+of them stayed served, while timing a plain Flask route next to them.
+
+    python scripts/load_test_streams.py                  # synthetic server, 2000 status + 500 video streams
+    python scripts/load_test_streams.py --events 5000 --video 1000 --hold 60
+    python scripts/load_test_streams.py --url http://127.0.0.1:5000 --lots 1 --probe /api/live_status/1
+
+Without --url a server is started in a subprocess: core.asgi.StreamingApp
+around a bare Flask app, with a synthetic producer per lot (the reference
+image with a car driving across, one slot flipping every two seconds)
+standing in for the detector and the database. Video viewers use the
+'thumb' profile unless --profile says otherwise.
+"""
+import argparse
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+import time
+from urllib.parse import urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+IMAGE_PATH = os.path.join(ROOT, "files", "carParkImg.png")
+
+
+# --- SYNTHETIC SERVER (subprocess) ---
+def serve(port, lots):
+    import threading
+
+    import cv2
+    import uvicorn
+    from flask import Flask
+
+    from core.asgi import StreamingApp
+    from core.events import record_status
+    from core.stream import DEFAULT_PROFILES
+
+    base = cv2.imread(IMAGE_PATH)
+
+    def producer(stream):
+        i = 0
+        while stream.keep_running():
+            frame = base.copy()
+            x = (50 + i * 9) % (base.shape[1] - 120)
+            cv2.rectangle(frame, (x, 200), (x + 110, 250), (40, 40, 200), -1)
+            stream.publish(frame)
+            i += 1
+            time.sleep(stream.frame_interval(25.0))
+
+    def statuses():
+        # 4 analyzed frames per second; slot 1 flips every 2 s (past the event debounce)
+        i = 0
+        while True:
+            for lot_id in range(1, lots + 1):
+                record_status(lot_id, {1: 'full' if (i // 8) % 2 else 'available', 2: 'full'})
+            i += 1
+            time.sleep(0.25)
+
+    flask_app = Flask(__name__)
+    flask_app.config['STREAM_PROFILES'] = DEFAULT_PROFILES
+
+    @flask_app.route('/ping')
+    def ping():
+        return 'pong'
+
+    threading.Thread(target=statuses, daemon=True).start()
+    application = StreamingApp(flask_app, producer=producer, lot_exists=lambda lot_id: lot_id <= lots)
+    uvicorn.run(application, host='127.0.0.1', port=port, log_level='warning', backlog=4096,
+                timeout_graceful_shutdown=1)
+
+
+def server_usage(pid):
+    """(RSS in MB, thread count) of a local process, from /proc."""
+    fields = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            fields[key] = value.split()
+    return int(fields['VmRSS'][0]) / 1024, int(fields['Threads'][0])
+
+
+# --- CLIENTS ---
+class Stats:
+    def __init__(self):
+        self.opened = 0
+        self.held = 0
+        self.failed = 0
+        self.closed_early = 0
+        self.bytes = 0
+        self.first_byte = []
+
+
+async def request_head(host, port, path, timeout=10.0):
+    async def head():
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nAccept: */*\r\n\r\n".encode())
+        status = await reader.readline()
+        while (await reader.readline()) not in (b'\r\n', b''):
+            pass
+        return reader, writer, status
+    return await asyncio.wait_for(head(), timeout)
+
+
+async def hold(host, port, path, stats, hold_until):
+    writer = None
+    try:
+        started = time.monotonic()
+        reader, writer, status = await request_head(host, port, path)
+        if b' 200 ' not in status:
+            stats.failed += 1
+            return
+        stats.bytes += len(await asyncio.wait_for(reader.read(65536), 10.0))
+        stats.first_byte.append(time.monotonic() - started)
+        stats.opened += 1
+        while True:
+            remaining = hold_until - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                data = await asyncio.wait_for(reader.read(65536), remaining)
+            except asyncio.TimeoutError:
+                break
+            if not data:
+                stats.closed_early += 1
+                return
+            stats.bytes += len(data)
+        stats.held += 1
+    except (OSError, asyncio.TimeoutError):
+        stats.failed += 1
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def probe(host, port, path, until, latencies):
+    """A plain (non-streaming) request every second while the streams are open."""
+    while time.monotonic() < until:
+        started = time.monotonic()
+        try:
+            reader, writer, status = await request_head(host, port, path)
+            writer.close()
+            if b' 200 ' in status or b' 304 ' in status:
+                latencies.append(time.monotonic() - started)
+        except (OSError, asyncio.TimeoutError):
+            pass
+        await asyncio.sleep(1.0)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float('nan')
+
+
+async def run(args, host, port, server_pid):
+    paths = ([('events', f"/api/live_status/{1 + i % args.lots}/stream") for i in range(args.events)]
+             + [('video', f"/video_feed/{1 + i % args.lots}?profile={args.profile}") for i in range(args.video)])
+    stats = {'events': Stats(), 'video': Stats()}
+    ramp_seconds = len(paths) / args.ramp
+    hold_until = time.monotonic() + ramp_seconds + args.hold
+    latencies = []
+
+    tasks = [asyncio.ensure_future(probe(host, port, args.probe, hold_until, latencies))]
+    for i, (kind, path) in enumerate(paths):
+        tasks.append(asyncio.ensure_future(hold(host, port, path, stats[kind], hold_until)))
+        if i % 100 == 99:
+            await asyncio.sleep(100 / args.ramp)
+
+    usage = None
+    if server_pid:
+        await asyncio.sleep(max(0.0, hold_until - time.monotonic() - 1.0))
+        usage = server_usage(server_pid)
+    await asyncio.gather(*tasks)
+    return stats, latencies, usage
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hold many stream connections against the async server")
+    parser.add_argument('--url', help="Running server (default: start a synthetic one)")
+    parser.add_argument('--events', type=int, default=2000, help="Live status (SSE) connections")
+    parser.add_argument('--video', type=int, default=500, help="MJPEG video connections")
+    parser.add_argument('--profile', default='thumb', help="Stream profile of the video connections")
+    parser.add_argument('--lots', type=int, default=2, help="Connections are spread over lots 1..N")
+    parser.add_argument('--hold', type=float, default=20.0, help="Seconds every connection is held open")
+    parser.add_argument('--ramp', type=float, default=1000.0, help="New connections per second")
+    parser.add_argument('--probe', default='/ping', help="Non-streaming route timed during the test")
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args.serve, args.lots)
+
+    # Every connection is a file descriptor on both ends
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    server = None
+    if args.url:
+        url = urlparse(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        host, port = '127.0.0.1', 8765
+        server = subprocess.Popen([sys.executable, __file__, '--serve', str(port), '--lots', str(args.lots)])
+        time.sleep(3.0)
+
+    try:
+        stats, latencies, usage = asyncio.run(run(args, host, port, server.pid if server else None))
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(10.0)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    print(f"{'streams':>8} {'opened':>7} {'held':>7} {'failed':>7} {'closed':>7} {'ttfb p50':>9} {'ttfb p95':>9} {'MB recv':>8}")
+    for kind, s in stats.items():
+        print(f"{kind:>8} {s.opened:>7} {s.held:>7} {s.failed:>7} {s.closed_early:>7} "
+              f"{percentile(s.first_byte, 0.5) * 1e3:>7.0f}ms {percentile(s.first_byte, 0.95) * 1e3:>7.0f}ms "
+              f"{s.bytes / 2 ** 20:>8.1f}")
+    print(f"{args.probe} during the test: {len(latencies)} requests, "
+          f"p50 {percentile(latencies, 0.5) * 1e3:.0f}ms, max {max(latencies, default=float('nan')) * 1e3:.0f}ms")
+    if usage:
+        print(f"Server process: {usage[0]:.0f} MB RSS, {usage[1]} threads")
+
+    held = sum(s.held for s in stats.values())
+    wanted = args.events + args.video
+    print(f"{'✅' if held == wanted else '❌'} {held}/{wanted} connections held for {args.hold:.0f}s")
+    return 0 if held == wanted else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
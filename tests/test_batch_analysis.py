@@ -0,0 +1,98 @@
+"""
+Batch analysis of a lot's video (core/batch.py): slots saved again during a
+run cancel it and analyze the video again with the new slots, and runs left
+'running' by a restart are marked failed.
+
+    python -m pytest tests/test_batch_analysis.py
+"""
+import os
+import sys
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import core.batch as batch
+from core.batch import AnalysisCancelled, analyze_video, fail_interrupted_timelines, run_batch_analysis, start_batch_analysis
+from database.models import db, User, ParkingLot, Slot, OccupancyTimeline
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + str(tmp_path / 'batch.db')
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        provider = User(name='P', uname='p', mobile='9999999999', email='p@x.in', location='Pune',
+                        password='x', role='provider')
+        db.session.add(provider)
+        db.session.flush()
+        lot = ParkingLot(provider_id=provider.id, name='Lot', video_path='v.mp4', ref_image_path='r.png')
+        db.session.add(lot)
+        db.session.flush()
+        db.session.add(Slot(parking_lot_id=lot.id, slot_label='S1', points='[[0, 0], [9, 0], [9, 9]]'))
+        db.session.commit()
+    return app
+
+
+def statuses(app):
+    with app.app_context():
+        return [t.status for t in db.session.query(OccupancyTimeline).order_by(OccupancyTimeline.id)]
+
+
+def test_slots_saved_during_a_run_restart_it(app, monkeypatch):
+    analyzed, entered, release = [], threading.Event(), threading.Event()
+
+    def analyze(video_path, slots, config, cancelled=None):
+        analyzed.append([slot.points for slot in slots])
+        if len(analyzed) == 1:
+            entered.set()
+            release.wait(10)
+            if cancelled():
+                raise AnalysisCancelled()
+        return {}, 1.0, 1
+
+    monkeypatch.setattr(batch, 'analyze_video', analyze)
+    assert start_batch_analysis(app, 1)
+    assert entered.wait(10)
+
+    with app.app_context():
+        db.session.query(Slot).update({Slot.points: '[[5, 5], [20, 5], [20, 20]]'})
+        db.session.commit()
+    assert not start_batch_analysis(app, 1)  # Queued behind the running one
+    assert not start_batch_analysis(app, 1)
+    release.set()
+
+    deadline = time.monotonic() + 10
+    while 1 in batch._running and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert analyzed == [['[[0, 0], [9, 0], [9, 9]]'], ['[[5, 5], [20, 5], [20, 20]]']]
+    assert statuses(app) == ['cancelled', 'done']
+    assert not batch._running and not batch._rerun
+
+
+def test_interrupted_runs_are_marked_failed(app, monkeypatch):
+    monkeypatch.setattr(batch, 'analyze_video', lambda video_path, slots, config, cancelled=None: ({}, 1.0, 1))
+    with app.app_context():
+        db.session.add(OccupancyTimeline(parking_lot_id=1, video_path='v.mp4', status='running'))
+        db.session.commit()
+
+    run_batch_analysis(app, 1)
+    assert statuses(app) == ['failed', 'done']
+
+    with app.app_context():
+        db.session.add(OccupancyTimeline(parking_lot_id=1, video_path='v.mp4', status='running'))
+        db.session.commit()
+        assert fail_interrupted_timelines() == 1
+        db.session.commit()
+    assert statuses(app) == ['failed', 'done', 'failed']
+
+
+def test_analysis_stops_when_cancelled():
+    with pytest.raises(AnalysisCancelled):
+        analyze_video(os.path.join(ROOT, "files", "missing.mp4"), [], {}, cancelled=lambda: True)
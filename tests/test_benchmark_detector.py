@@ -0,0 +1,44 @@
+"""
+Offline detector benchmark (scripts/benchmark_detector.py) still runs, and
+the first frames of its synthetic clip give the recorded statuses
+(scripts/fixtures/benchmark_expected.json) with every counting path.
+
+    python -m pytest tests/test_benchmark_detector.py
+"""
+import json
+import os
+import sys
+
+import cv2
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+import benchmark_detector as benchmark
+
+FRAMES = 6
+
+
+@pytest.fixture(scope="module")
+def clip(tmp_path_factory):
+    return benchmark.write_synthetic_clip(str(tmp_path_factory.mktemp("clip")), FRAMES)
+
+
+@pytest.fixture(scope="module")
+def expected():
+    with open(benchmark.EXPECTED_PATH) as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize("engine, incremental", [('labelmap', False), ('roi', False), ('labelmap', True)])
+@pytest.mark.parametrize("n", [50, 300])
+def test_statuses_match_recording(clip, expected, engine, incremental, n):
+    height, width = cv2.imread(benchmark.IMAGE_PATH).shape[:2]
+    slots = benchmark.make_slots(width, height, *benchmark.SLOT_GRIDS[n])
+    timings, statuses, peak = benchmark.run(clip, slots, engine, 1.0, incremental, 95)
+
+    assert len(statuses) == FRAMES
+    assert benchmark.compare(expected[str(n)][:FRAMES], statuses) == 0
+    assert set(timings) == set(benchmark.STAGES)
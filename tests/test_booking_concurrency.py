@@ -0,0 +1,198 @@
+"""
+Atomic booking path (core/booking.py) under contention: hundreds of
+simultaneous bookings for a few slots, single or in batches, from threads
+and from separate processes, never overlap, and every rejected one really
+conflicted.
+
+    python -m pytest tests/test_booking_concurrency.py -s   # prints requests per second (not asserted: depends on the machine)
+"""
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database.models import db, User, ParkingLot, Slot, Booking
+from core.booking import configure_sqlite, place_hold, release_hold, reserve_booking, reserve_bookings, SlotTaken
+
+SLOTS = 4
+DAY = datetime(2026, 3, 2, 8, 0)
+
+
+def make_app(path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    db.init_app(app)
+    with app.app_context():
+        configure_sqlite(db.engine)
+    return app
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = make_app(str(tmp_path / 'booking.db'))
+    with app.app_context():
+        db.create_all()
+        provider = User(name='P', uname='p', mobile='9999999999', email='p@x.in', location='Pune',
+                        password='x', role='provider')
+        db.session.add(provider)
+        db.session.flush()
+        lot = ParkingLot(provider_id=provider.id, name='Lot', video_path='v.mp4', ref_image_path='r.png')
+        db.session.add(lot)
+        db.session.flush()
+        db.session.add_all([Slot(parking_lot_id=lot.id, slot_label=f"S{i}", points='[]') for i in range(SLOTS)])
+        db.session.commit()
+    return app
+
+
+def requests_for(seed, count):
+    """(slot_id, start, end): 1-3 hour windows on a half-hour grid of one day, so most collide."""
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(count):
+        start = DAY + timedelta(minutes=30 * rng.randrange(20))
+        requests.append((rng.randint(1, SLOTS), start, start + timedelta(hours=rng.randint(1, 3))))
+    return requests
+
+
+def book(app, requests, results, barrier=None):
+    with app.app_context():
+        if barrier is not None:
+            barrier.wait()
+        for slot_id, start, end in requests:
+            db.session.get(Slot, slot_id)  # A read before the write section, as in the route
+            try:
+                reserve_booking(slot_id, start, end, ticket_uuid=uuid.uuid4().hex[:12], amount=10.0)
+                results.append((slot_id, start, end, True))
+            except SlotTaken:
+                results.append((slot_id, start, end, False))
+        db.session.remove()
+
+
+def check_bookings(app, results):
+    """No two active bookings of a slot overlap, and each rejection overlapped a booking."""
+    with app.app_context():
+        booked = {}
+        for slot_id, start, end in db.session.query(Booking.slot_id, Booking.start_time, Booking.end_time) \
+                .filter(Booking.is_active == True).order_by(Booking.slot_id, Booking.start_time):
+            intervals = booked.setdefault(slot_id, [])
+            assert not intervals or intervals[-1][1] <= start, f"Overlap on slot {slot_id}: {intervals[-1]} / {start, end}"
+            intervals.append((start, end))
+
+    assert sum(ok for *_, ok in results) == sum(len(v) for v in booked.values())
+    for slot_id, start, end, ok in results:
+        if not ok:
+            assert any(s < end and e > start for s, e in booked.get(slot_id, [])), (slot_id, start, end)
+    return booked
+
+
+def test_concurrent_threads_never_double_book(app):
+    threads, per_thread = 50, 8
+    results = []
+    barrier = threading.Barrier(threads)
+    workers = [threading.Thread(target=book, args=(app, requests_for(i, per_thread), results, barrier))
+               for i in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    assert len(results) == threads * per_thread
+    booked = check_bookings(app, results)
+    rate = len(results) / elapsed
+    print(f"\n{len(results)} booking requests from {threads} threads: {sum(map(len, booked.values()))} booked, "
+          f"{rate:.0f} requests/s")
+
+
+def book_batches(app, batches, results, barrier):
+    with app.app_context():
+        barrier.wait()
+        for batch in batches:
+            requests = [dict(slot_id=slot_id, start_time=start, end_time=end, ticket_uuid=uuid.uuid4().hex[:12])
+                        for slot_id, start, end in batch]
+            for (slot_id, start, end), (booking_id, reason) in zip(batch, reserve_bookings(requests)):
+                if reason != 'overlap':  # Rejected for the batch itself, not for the database
+                    results.append((slot_id, start, end, booking_id is not None))
+        db.session.remove()
+
+
+def test_concurrent_bulk_batches_never_double_book(app):
+    threads, batches, batch_size = 20, 4, 10
+    results = []
+    barrier = threading.Barrier(threads)
+    workers = [threading.Thread(target=book_batches, args=(
+        app, [requests_for(1000 * i + b, batch_size) for b in range(batches)], results, barrier)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    check_bookings(app, results)
+
+
+def test_batch_larger_than_one_conflict_query(app):
+    # 600 hour-long windows, more than SQLite allows in one UNION ALL
+    windows = [(1 + i % SLOTS, DAY + timedelta(hours=i // SLOTS), DAY + timedelta(hours=i // SLOTS + 1)) for i in range(600)]
+    with app.app_context():
+        reserve_booking(*windows[-1], ticket_uuid='last')
+        results = reserve_bookings([dict(slot_id=slot_id, start_time=start, end_time=end) for slot_id, start, end in windows])
+    assert [reason for _, reason in results] == [None] * 599 + ['taken']
+
+
+def book_in_process(path, seed, count, queue):
+    results = []
+    book(make_app(path), requests_for(seed, count), results)
+    queue.put(results)
+
+
+def test_concurrent_processes_never_double_book(app, tmp_path):
+    # Separate processes don't share the in-process lock: SQLite's write lock alone keeps them apart
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    processes = [context.Process(target=book_in_process, args=(str(tmp_path / 'booking.db'), 100 + i, 60, queue))
+                 for i in range(4)]
+    for process in processes:
+        process.start()
+    results = [item for _ in processes for item in queue.get(timeout=120)]
+    for process in processes:
+        process.join()
+
+    assert len(results) == 4 * 60
+    check_bookings(app, results)
+
+
+def test_hold_blocks_others_until_it_expires(app):
+    start, end = DAY, DAY + timedelta(hours=2)
+    with app.app_context():
+        place_hold(1, start, end, seconds=0.5)
+        with pytest.raises(SlotTaken):
+            reserve_booking(1, start + timedelta(hours=1), end, ticket_uuid='B')
+        with pytest.raises(SlotTaken):
+            place_hold(1, start, end)
+
+        time.sleep(0.6)
+        booking = reserve_booking(1, start, end, ticket_uuid='C')
+        assert booking.id
+
+
+def test_own_hold_becomes_the_booking(app):
+    start, end = DAY, DAY + timedelta(hours=2)
+    with app.app_context():
+        token = place_hold(2, start, end, seconds=60).token
+        booking = reserve_booking(2, start, end, hold_token=token, ticket_uuid='D')
+        assert booking.id
+        assert not release_hold(token)  # Used up by the booking
+
+        other = place_hold(3, start, end, seconds=60)
+        assert release_hold(other.token)
+        assert reserve_booking(3, start, end, ticket_uuid='E').id
@@ -0,0 +1,137 @@
+"""
+FramePipeline and both counting engines: the same counts as the per-slot
+ROI path (overlapping slots included) and as the allocating path, and no
+memory growth (or per-frame full-size allocations) once it has warmed up.
+
+    python -m pytest tests/test_frame_pipeline.py
+"""
+import json
+import os
+import sys
+import tracemalloc
+from types import SimpleNamespace
+
+import cv2
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from core.slot_manager import LotGeometry, COUNT_ENGINES, get_lot_geometry
+from core.vision_utils import FramePipeline, IncrementalCounter, preprocess_lot, to_analysis_gray
+
+IMAGE_PATH = os.path.join(ROOT, "files", "carParkImg.png")
+FRAMES = 200
+
+
+def make_slots(width, height, cols=10, rows=6):
+    """Grid of slightly overlapping polygons, plus one crossing the frame edge."""
+    w, h = width // cols, height // rows
+    polygons = [[[c * w, r * h], [(c + 1) * w + 4, r * h], [(c + 1) * w + 4, (r + 1) * h], [c * w, (r + 1) * h]]
+                for r in range(rows) for c in range(cols)]
+    polygons.append([[width - 40, height - 40], [width + 30, height - 40], [width + 30, height + 30]])
+    return [SimpleNamespace(id=i + 1, slot_label=f"Slot-{i + 1}", points=json.dumps(p))
+            for i, p in enumerate(polygons)]
+
+
+def make_frames(base, count=8):
+    """A car driving across the reference image."""
+    frames = []
+    for i in range(count):
+        frame = base.copy()
+        x = 50 + i * 60
+        cv2.rectangle(frame, (x, 200), (x + 110, 250), (40, 40, 200), -1)
+        frames.append(frame)
+    return frames
+
+
+@pytest.fixture(scope="module")
+def base_image():
+    return cv2.imread(IMAGE_PATH)
+
+
+@pytest.mark.parametrize("engine", sorted(COUNT_ENGINES))
+@pytest.mark.parametrize("scale", [1.0, 0.5])
+def test_pipeline_matches_reference_path(base_image, engine, scale):
+    slots = make_slots(base_image.shape[1], base_image.shape[0])
+    geometry = LotGeometry(1, 0, slots, scale)
+    pipeline = FramePipeline(geometry, base_image.shape, scale)
+
+    for frame in make_frames(base_image, 3):
+        expected = COUNT_ENGINES[engine](geometry, preprocess_lot(to_analysis_gray(frame, scale), geometry))
+        assert pipeline.count(pipeline.preprocess(pipeline.gray(frame)), engine) == list(expected)
+
+
+@pytest.mark.parametrize("scale", [1.0, 0.5])
+def test_engines_match_per_slot_counts(base_image, scale):
+    # The grid's neighbours share a 4 px strip; add a slot inside another and one across three
+    height, width = base_image.shape[:2]
+    slots = make_slots(width, height)
+    x0, x1, y1 = width // 10 - 20, width // 5 + 20, height // 6 + 20
+    for points in ([[30, 30], [60, 30], [60, 60], [30, 60]], [[x0, 10], [x1, 10], [x1, y1], [x0, y1]]):
+        slots.append(SimpleNamespace(id=len(slots) + 1, slot_label=f"Slot-{len(slots) + 1}", points=json.dumps(points)))
+    geometry = LotGeometry(1, 0, slots, scale)
+    pipeline = FramePipeline(geometry, base_image.shape, scale)
+    assert geometry.label_map(pipeline.processed.shape)[1].size > 0
+
+    for frame in make_frames(base_image, 3):
+        img_processed = preprocess_lot(to_analysis_gray(frame, scale), geometry)
+        roi = geometry.count_roi(img_processed)
+        assert any(roi)
+        assert geometry.count_label_map(img_processed) == roi
+        assert pipeline.count(pipeline.preprocess(pipeline.gray(frame)), 'labelmap') == roi
+
+
+def test_redrawn_slots_with_the_same_ids_are_recompiled():
+    # Another worker saved new polygons and SQLite reused the slot ids: this process' version never changed
+    slots = make_slots(640, 480)
+    before = get_lot_geometry(99, slots)
+    redrawn = [SimpleNamespace(id=s.id, slot_label=s.slot_label, points=json.dumps([[x + 7, y] for x, y in json.loads(s.points)]))
+               for s in slots]
+    after = get_lot_geometry(99, redrawn)
+    assert after is not before
+    assert after.slots[0].bbox[0] == before.slots[0].bbox[0] + 7
+    assert get_lot_geometry(99, redrawn) is after
+
+
+def test_incremental_counter_with_pipeline(base_image):
+    slots = make_slots(base_image.shape[1], base_image.shape[0])
+    geometry = LotGeometry(1, 0, slots)
+    pipeline = FramePipeline(geometry, base_image.shape)
+    with_pipeline, without = IncrementalCounter(), IncrementalCounter()
+
+    for frame in make_frames(base_image):
+        # The pipeline's gray buffer is overwritten every frame; the counter must keep its own reference
+        counts = with_pipeline.count(pipeline.gray(frame), geometry, 'labelmap', pipeline)
+        assert counts == without.count(to_analysis_gray(frame), geometry, 'labelmap')
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_no_memory_growth(base_image, incremental):
+    slots = make_slots(base_image.shape[1], base_image.shape[0])
+    geometry = LotGeometry(1, 0, slots)
+    pipeline = FramePipeline(geometry, base_image.shape)
+    counter = IncrementalCounter(full_refresh=10)
+    frames = make_frames(base_image)
+
+    def analyze(frame):
+        img_gray = pipeline.gray(frame)
+        if incremental:
+            return counter.count(img_gray, geometry, 'labelmap', pipeline)
+        return pipeline.count(pipeline.preprocess(img_gray), 'labelmap')
+
+    for frame in frames:  # Warm up: buffers and caches are allocated here
+        analyze(frame)
+
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        for i in range(FRAMES):
+            analyze(frames[i % len(frames)])
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    frame_bytes = base_image.shape[0] * base_image.shape[1]
+    assert current - start < 64 * 1024, "memory grew over the frames"
+    assert peak - start < frame_bytes // 4, "a frame-sized array was allocated per frame"
@@ -0,0 +1,53 @@
+"""
+Deleting a lot, as delete_lot / delete_user in app.py do, also deletes the
+rows that belong to it, e.g. the occupancy timelines of its batch analyses.
+
+    python -m pytest tests/test_lot_deletion.py
+"""
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database.models import db, User, ParkingLot, Slot, Booking, OccupancyTimeline
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        provider = User(name='P', uname='p', mobile='9999999999', email='p@x.in', location='Pune',
+                        password='x', role='provider')
+        db.session.add(provider)
+        db.session.flush()
+        for name in ('Lot A', 'Lot B'):
+            lot = ParkingLot(provider_id=provider.id, name=name, video_path='v.mp4', ref_image_path='r.png')
+            db.session.add(lot)
+            db.session.flush()
+            db.session.add(Slot(parking_lot_id=lot.id, slot_label='S1', points='[]'))
+            # What save_slots' batch analysis leaves behind
+            db.session.add_all([OccupancyTimeline(parking_lot_id=lot.id, video_path='v.mp4', status=status)
+                                for status in ('done', 'failed')])
+        db.session.commit()
+        yield app
+        db.session.remove()
+
+
+def test_deleting_a_lot_deletes_its_timelines(app):
+    with app.app_context():
+        lot = db.session.get(ParkingLot, 1)
+        db.session.query(Booking).filter(Booking.slot_id.in_([s.id for s in lot.slots])).delete()
+        db.session.query(Slot).filter_by(parking_lot_id=lot.id).delete()
+        db.session.delete(lot)
+        db.session.commit()
+
+        assert db.session.get(ParkingLot, 1) is None
+        assert db.session.query(OccupancyTimeline).filter_by(parking_lot_id=1).count() == 0
+        assert db.session.query(OccupancyTimeline).filter_by(parking_lot_id=2).count() == 2
@@ -0,0 +1,41 @@
+"""
+LotSnapshot (core/detector.py): the set of slots with a running booking is
+only recomputed when a booking starts or ends, and is always the same as
+checking every booking at that moment.
+
+    python -m pytest tests/test_lot_state.py
+"""
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from core.detector import LotSnapshot
+
+NOW = datetime(2026, 3, 2, 12, 0)
+
+
+def test_active_ids_follow_bookings():
+    rng = random.Random(3)
+    bookings = []
+    for _ in range(200):
+        start = NOW + timedelta(seconds=rng.randrange(-30, 30))
+        bookings.append((rng.randint(1, 20), start, start + timedelta(seconds=rng.randrange(0, 20))))
+    snapshot = LotSnapshot(0, [], bookings)
+
+    for tick in range(0, 60 * 4):
+        now = NOW + timedelta(seconds=tick / 4 - 10)
+        expected = {slot_id for slot_id, start, end in bookings if start <= now <= end}
+        assert snapshot.active_ids(now) == expected, now
+
+
+def test_active_ids_cached_between_changes():
+    snapshot = LotSnapshot(0, [], [(1, NOW, NOW + timedelta(minutes=5)), (2, NOW + timedelta(minutes=10), NOW + timedelta(minutes=20))])
+    first = snapshot.active_ids(NOW + timedelta(minutes=1))
+    assert first == {1}
+    assert snapshot.active_ids(NOW + timedelta(minutes=4)) is first
+    assert snapshot.active_ids(NOW + timedelta(minutes=7)) == set()
+    assert snapshot.active_ids(NOW + timedelta(minutes=10)) == {2}
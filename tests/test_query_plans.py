@@ -0,0 +1,219 @@
+"""
+Query plans of the hot booking queries: each one must be answered through
+an index. The core/ queries are built by their own functions; those written
+inline in app.py are built the same way here. Fails on a full table scan,
+e.g. after an index in database/models.py was dropped or a query was
+rewritten so it can no longer use one.
+
+    python -m pytest tests/test_query_plans.py
+"""
+import os
+import re
+import sys
+from datetime import date, datetime, timedelta
+
+import pytest
+from flask import Flask
+from sqlalchemy import event, text
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database.models import db, User, ParkingLot, Slot, Booking, Review, OccupancyTimeline
+from migrate_indexes import create_indexes
+
+NOW = datetime(2026, 3, 2, 12, 0)
+
+# SCAN without an index = every row of the table is read
+FULL_SCAN = re.compile(r'^SCAN (\w+)(?!\w| USING)')
+# SCAN through an index, in index order; only fine when the query stops after a few rows
+INDEX_WALK = re.compile(r'^SCAN (\w+) USING (?:COVERING )?INDEX')
+
+
+def table_scans(plan, pattern):
+    """Plan steps scanning a table (not a CTE or a constant row) with `pattern`."""
+    return [step for step in plan if (match := pattern.match(step)) and match.group(1) in db.metadata.tables]
+
+
+@pytest.fixture(scope='module')
+def app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        seed()
+        yield app
+        db.session.remove()
+
+
+def seed(providers=3, lots_per_provider=2, slots_per_lot=20, bookings_per_slot=5):
+    def user(i, role):
+        return User(name=f"{role} {i}", uname=f"{role}{i}", mobile='9999999999', email=f"{role}{i}@x.in",
+                    location='Pune', password='x', role=role, is_verified=True)
+
+    customers = [user(i, 'customer') for i in range(10)]
+    db.session.add_all(customers)
+    for p in range(providers):
+        provider = user(p, 'provider')
+        db.session.add(provider)
+        db.session.flush()
+        for l in range(lots_per_provider):
+            lot = ParkingLot(provider_id=provider.id, name=f"Lot {p}-{l}", video_path='v.mp4', ref_image_path='r.png')
+            db.session.add(lot)
+            db.session.flush()
+            db.session.add(OccupancyTimeline(parking_lot_id=lot.id, video_path='v.mp4', status='done'))
+            for s in range(slots_per_lot):
+                slot = Slot(parking_lot_id=lot.id, slot_label=f"S{s}", points='[[0,0],[1,0],[1,1]]')
+                db.session.add(slot)
+                db.session.flush()
+                for b in range(bookings_per_slot):
+                    start = NOW + timedelta(hours=3 * (b - 2))
+                    db.session.add(Booking(slot_id=slot.id, user_id=customers[(s + b) % 10].id,
+                                           start_time=start, end_time=start + timedelta(hours=2), amount=10.0))
+            for c in customers[:3]:
+                db.session.add(Review(parking_lot_id=lot.id, user_id=c.id, rating=4))
+    db.session.commit()
+
+
+def capture(run):
+    """The SQL statements (and parameters) `run()` sends to the database."""
+    statements = []
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before)
+    try:
+        run()
+    finally:
+        event.remove(engine, 'before_cursor_execute', before)
+        db.session.rollback()  # Deletes are only run for their plans
+    return statements
+
+
+def query_plan(statement, parameters):
+    with db.engine.connect() as conn:
+        return [row[-1] for row in conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)]
+
+
+def conflict_check():  # core.booking._check_free (reserve_booking, place_hold): both of its queries
+    from core.booking import _booked, _held
+    start, end = NOW, NOW + timedelta(hours=2)
+    _booked(7, start, end).first()
+    _held(7, start, end, NOW).first()
+    _held(7, start, end, NOW, hold_token='abc').first()
+
+def booking_write_check():  # core.booking, inside the booking write section, called as is
+    from core.booking import _check_free, SlotTaken
+    try:
+        _check_free(7, NOW + timedelta(hours=2), NOW + timedelta(hours=3), NOW, hold_token='abc')  # Free: reaches the hold query
+    except SlotTaken:
+        pass
+
+def bulk_booking_check():  # core.booking.reserve_bookings: the items of a batch in one query
+    from core.booking import _taken_windows_query
+    db.session.execute(_taken_windows_query([(7, NOW, NOW + timedelta(hours=1)), (8, NOW, NOW + timedelta(hours=2)),
+                                             (9, NOW + timedelta(hours=2), NOW + timedelta(hours=3))], NOW, ['abc'])).all()
+
+def detector_refresh():  # core.detector.refresh_lot_state, called as is
+    from core.detector import refresh_lot_state
+    refresh_lot_state(1)
+
+def availability_index():  # core.availability: a lot's index built, and its bookings since a sync
+    from core.availability import build_availability, _lot_bookings_query
+    build_availability(1)
+    _lot_bookings_query(1, 90, 100).all()
+
+def view_lot():
+    db.session.query(Slot).filter_by(parking_lot_id=1).all()
+    db.session.query(Review).filter_by(parking_lot_id=1).order_by(Review.created_at.desc()).all()
+
+def customer_bookings():  # customer_dashboard
+    db.session.query(Booking).filter(Booking.user_id == 3).order_by(Booking.start_time.desc()).all()
+
+def provider_dashboard():  # Income from the rollups; bookings and reviews one keyset page at a time
+    from core.rollups import lot_totals
+    from core.paging import keyset_page
+    db.session.query(ParkingLot).filter_by(provider_id=1).all()
+    lot_totals([1, 2], date.today())
+    slot_ids = [slot_id for slot_id, in db.session.query(Slot.id).filter(Slot.parking_lot_id.in_([1, 2]))]
+    keyset_page(Booking, Booking.start_time, Booking.slot_id, slot_ids, f"{NOW.isoformat()}_100")
+    keyset_page(Review, Review.created_at, Review.parking_lot_id, [1, 2], size=2)
+
+def rollup_writes():  # core.rollups, run by every booking write and by delete_user
+    from core.rollups import record_bookings, forget_bookings, drop_lot_rollups
+    record_bookings([Booking(slot_id=7, start_time=NOW, end_time=NOW + timedelta(hours=1), amount=5.0)])
+    forget_bookings(db.session.query(Booking).filter_by(user_id=3))
+    drop_lot_rollups(1)
+
+def lot_utilization():
+    db.session.query(OccupancyTimeline).filter_by(parking_lot_id=1, status='done') \
+        .order_by(OccupancyTimeline.created_at.desc()).first()
+
+def expiry_alerts():  # check_expiry_alerts
+    target = NOW + timedelta(minutes=15)
+    db.session.query(Booking).filter(
+        Booking.payment_status == 'Paid',
+        Booking.end_time >= target - timedelta(seconds=30),
+        Booking.end_time <= target + timedelta(seconds=30)
+    ).all()
+
+def gate_scan():  # scan_gate_api
+    db.session.query(Booking).filter_by(ticket_uuid='0b6f3c1e-0000-4000-8000-000000000000').first()
+
+def download_log():
+    db.session.query(Booking).join(Slot).filter(Slot.parking_lot_id == 1).order_by(Booking.start_time.desc()).all()
+
+def delete_rows():  # delete_lot / delete_user
+    db.session.query(Booking).filter_by(slot_id=7).delete()
+    db.session.query(Slot).filter_by(parking_lot_id=1).delete()
+    db.session.query(Booking).filter_by(user_id=3).delete()
+
+
+HOT_QUERIES = [conflict_check, booking_write_check, bulk_booking_check, detector_refresh, availability_index, view_lot, customer_bookings, provider_dashboard,
+               rollup_writes, lot_utilization, expiry_alerts, gate_scan, download_log, delete_rows]
+
+# Ordered walks of a whole index, fine because of their LIMIT
+LIMITED_QUERIES = {
+    'admin_recent_bookings': lambda: db.session.query(Booking).order_by(Booking.start_time.desc()).limit(50).all(),
+}
+
+
+@pytest.mark.parametrize('run', HOT_QUERIES, ids=lambda run: run.__name__)
+def test_hot_query_uses_indexes(app, run):
+    statements = capture(run)
+    assert statements
+    for statement, parameters in statements:
+        plan = query_plan(statement, parameters)
+        scans = table_scans(plan, FULL_SCAN) + table_scans(plan, INDEX_WALK)
+        assert not scans, f"{run.__name__} scans a whole table:\n{statement}\nplan: {plan}"
+
+
+@pytest.mark.parametrize('name', sorted(LIMITED_QUERIES))
+def test_limited_query_walks_an_index(app, name):
+    for statement, parameters in capture(LIMITED_QUERIES[name]):
+        plan = query_plan(statement, parameters)
+        assert not table_scans(plan, FULL_SCAN), f"{name}:\n{statement}\nplan: {plan}"
+        assert not any('TEMP B-TREE' in step for step in plan), f"{name} sorts every row:\n{plan}"
+
+
+def test_migration_adds_missing_indexes():
+    # A database from before the indexes. Its own app (and connection): SQLite
+    # keeps answering a cached EXPLAIN with the plan from before a schema change
+    old = Flask(__name__)
+    old.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(old)
+    with old.app_context():
+        db.create_all()
+        declared = sorted(index.name for table in db.metadata.sorted_tables for index in table.indexes)
+        with db.engine.begin() as conn:
+            for name in declared:
+                conn.execute(text(f'DROP INDEX {name}'))
+
+        assert sorted(create_indexes(db.engine)) == declared
+        assert create_indexes(db.engine) == []
+        for statement, parameters in capture(conflict_check):
+            assert not table_scans(query_plan(statement, parameters), FULL_SCAN)
+        db.session.remove()
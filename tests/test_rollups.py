@@ -0,0 +1,145 @@
+"""
+Provider dashboard data: the per-lot revenue rollups (core/rollups.py) kept
+up to date by the booking writes always equal a rebuild from the bookings,
+and keyset pages (core/paging.py) walk a provider's history exactly once,
+newest first.
+
+    python -m pytest tests/test_rollups.py
+"""
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database.models import db, User, ParkingLot, Slot, Booking, Review, LotDailyStat
+from core.booking import reserve_booking, reserve_bookings, SlotTaken
+from core.paging import keyset_page
+from core.rollups import LIFETIME, lot_totals, forget_bookings, drop_lot_rollups, rebuild_rollups
+
+DAY = datetime(2026, 3, 2, 8, 0)
+LOTS, SLOTS = 3, 5
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        customers = [User(name=f"C{i}", uname=f"c{i}", mobile='9999999999', email=f"c{i}@x.in", location='Pune',
+                          password='x', role='customer') for i in range(4)]
+        provider = User(name='P', uname='p', mobile='9999999999', email='p@x.in', location='Pune',
+                        password='x', role='provider')
+        db.session.add_all(customers + [provider])
+        db.session.flush()
+        for l in range(LOTS):
+            lot = ParkingLot(provider_id=provider.id, name=f"Lot {l}", video_path='v.mp4', ref_image_path='r.png')
+            db.session.add(lot)
+            db.session.flush()
+            db.session.add_all([Slot(parking_lot_id=lot.id, slot_label=f"S{i}", points='[]') for i in range(SLOTS)])
+        db.session.commit()
+        yield app
+        db.session.remove()
+
+
+def book_history(count=300, seed=1):
+    """Single and bulk bookings over two weeks, some of them rejected as taken."""
+    rng = random.Random(seed)
+
+    def window():
+        start = DAY + timedelta(days=rng.randrange(14), minutes=30 * rng.randrange(24))
+        return start, start + timedelta(hours=rng.randint(1, 4))
+
+    slot_ids = [slot_id for slot_id, in db.session.query(Slot.id)]
+    for i in range(count):
+        if i % 10 == 0:
+            requests = [dict(zip(('start_time', 'end_time'), window()), slot_id=rng.choice(slot_ids), user_id=rng.randint(1, 4),
+                             amount=float(rng.randint(10, 90))) for _ in range(5)]
+            reserve_bookings(requests)
+        else:
+            start, end = window()
+            try:
+                reserve_booking(rng.choice(slot_ids), start, end, user_id=rng.randint(1, 4), amount=float(rng.randint(10, 90)))
+            except SlotTaken:
+                pass
+
+
+def stored_rollups():
+    return {(r.parking_lot_id, r.day): (r.bookings, round(r.revenue, 6), round(r.booked_hours, 6))
+            for r in db.session.query(LotDailyStat) if r.bookings}
+
+
+def test_rollups_follow_bookings(app):
+    with app.app_context():
+        book_history()
+        assert db.session.query(Booking).count() > 100
+
+        # A customer deleted (admin) and a lot deleted (provider), as in app.py
+        forget_bookings(db.session.query(Booking).filter_by(user_id=2))
+        db.session.query(Booking).filter_by(user_id=2).delete()
+        slot_ids = [slot_id for slot_id, in db.session.query(Slot.id).filter_by(parking_lot_id=3)]
+        db.session.query(Booking).filter(Booking.slot_id.in_(slot_ids)).delete()
+        drop_lot_rollups(3)
+        db.session.commit()
+
+        incremental = stored_rollups()
+        rebuild_rollups()
+        assert stored_rollups() == incremental
+
+        day = DAY.date() + timedelta(days=3)
+        bookings = db.session.query(Booking).join(Slot).filter(Slot.parking_lot_id.in_([1, 2])).all()
+        on_day = [b for b in bookings if b.start_time.date() == day]
+        totals = lot_totals([1, 2], day)
+        assert totals['total_income'] == pytest.approx(sum(b.amount for b in bookings))
+        assert totals['daily_income'] == pytest.approx(sum(b.amount for b in on_day))
+        assert totals['daily_bookings'] == len(on_day)
+        assert totals['daily_hours'] == pytest.approx(sum((b.end_time - b.start_time).total_seconds() / 3600 for b in on_day))
+        assert incremental[(1, LIFETIME)][0] == sum(b.slot.parking_lot_id == 1 for b in bookings)
+
+
+def test_totals_of_lots_without_rollups(app):
+    with app.app_context():
+        assert lot_totals([1, 2], DAY.date()) == {'total_income': 0.0, 'daily_income': 0.0, 'daily_bookings': 0, 'daily_hours': 0.0}
+        assert lot_totals([], DAY.date())['total_income'] == 0.0
+
+
+def test_keyset_pages_walk_history_once(app):
+    with app.app_context():
+        book_history(200)
+        # Same start time on several slots: the booking id breaks the tie
+        reserve_bookings([dict(slot_id=s, start_time=DAY - timedelta(days=1), end_time=DAY, amount=1.0) for s in range(1, 6)])
+        slot_ids = [slot_id for slot_id, in db.session.query(Slot.id).filter(Slot.parking_lot_id.in_([1, 2]))]
+        expected = [b.id for b in db.session.query(Booking).filter(Booking.slot_id.in_(slot_ids))
+                    .order_by(Booking.start_time.desc(), Booking.id.desc())]
+
+        seen, cursor, pages = [], None, 0
+        while True:
+            page, cursor = keyset_page(Booking, Booking.start_time, Booking.slot_id, slot_ids, cursor, size=7)
+            assert len(page) == 7 or cursor is None
+            seen += [b.id for b in page]
+            pages += 1
+            if cursor is None:
+                break
+        assert seen == expected
+        assert pages == -(-len(expected) // 7)
+
+
+def test_keyset_page_of_reviews(app):
+    with app.app_context():
+        for i in range(9):
+            db.session.add(Review(parking_lot_id=1 + i % 2, user_id=1, rating=5, created_at=DAY + timedelta(hours=i // 2)))
+        db.session.commit()
+
+        first, cursor = keyset_page(Review, Review.created_at, Review.parking_lot_id, [1, 2], size=5)
+        rest, end = keyset_page(Review, Review.created_at, Review.parking_lot_id, [1, 2], cursor, size=5)
+        assert [r.id for r in first + rest] == [9, 8, 7, 6, 5, 4, 3, 2, 1]
+        assert end is None
+        assert keyset_page(Review, Review.created_at, Review.parking_lot_id, [1, 2], 'not-a-cursor', size=5)[0] == first
+        assert keyset_page(Review, Review.created_at, Review.parking_lot_id, [], size=5) == ([], None)
@@ -0,0 +1,68 @@
+"""
+Detection scheduler workers (core/scheduler.py) under `python app.py`:
+spawn re-runs app.py in every worker as __mp_main__, which must not start
+the app's services there again (expiry alerts, status table, writer
+election, another scheduler).
+
+    python -m pytest tests/test_scheduler.py
+"""
+import multiprocessing
+import os
+import sys
+import threading
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+for module in ('qrcode', 'twilio', 'razorpay', 'flask_sqlalchemy', 'cv2'):
+    pytest.importorskip(module)
+
+import core.scheduler as scheduler
+from core.scheduler import DetectionScheduler
+
+APP_PATH = os.path.join(ROOT, "app.py")
+
+
+def probe_worker(tasks, results, geometry_folder):
+    """Stands in for worker_main: reports what the re-run app.py left running in this worker."""
+    import core.detector as detector
+    import core.status_table as status_table
+
+    main = sys.modules.get('__mp_main__')
+    results.put({
+        'main': getattr(main, '__file__', None),
+        'threads': [t.name for t in threading.enumerate() if t is not threading.main_thread()],
+        'children': len(multiprocessing.active_children()),
+        'status_table': status_table.STATUS_TABLE is not None,
+        'role': status_table.ROLE,
+        'offloaded': detector.ANALYSIS_OFFLOADED,
+    })
+    tasks.get(timeout=30)
+
+
+class FakeApp:
+    config = {'SLOT_GEOMETRY_FOLDER': None}
+
+
+def test_workers_run_no_app_startup(monkeypatch):
+    # As if started with `python app.py`
+    monkeypatch.setitem(sys.modules, '__main__', types.ModuleType('__main__'))
+    sys.modules['__main__'].__file__ = APP_PATH
+    monkeypatch.setattr(scheduler, 'worker_main', probe_worker)
+
+    detection = DetectionScheduler(FakeApp(), workers=2)
+    detection.start_workers()
+    try:
+        reports = [detection.results.get(timeout=60) for _ in range(2)]
+    finally:
+        detection.shutdown()
+
+    for report in reports:
+        assert report['main'] == APP_PATH  # app.py really was re-run in the worker
+        assert report['threads'] == []
+        assert report['children'] == 0
+        assert not report['status_table'] and report['role'] is None
+        assert not report['offloaded']
@@ -0,0 +1,97 @@
+"""
+Shared status table (core/status_table.py) across processes: exactly one
+process is elected to run the detector, another takes over when it exits,
+and the readers see the writer's event sequence numbers and statuses.
+
+    python -m pytest tests/test_status_table.py
+"""
+import multiprocessing
+import os
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import core.status_table as status_table
+from core.events import LotEventLog, SharedEventLog
+
+pytestmark = pytest.mark.skipif(status_table.fcntl is None, reason="needs POSIX file locks")
+
+
+def candidate(path, elected):
+    status_table.set_status_table(path, lots=8, slots=16)
+    status_table.elect_writer(lambda: elected.put(os.getpid()))
+    time.sleep(60)  # Terminated by the test (a process killed while waiting on an Event would wedge it)
+
+
+def test_one_writer_at_a_time(tmp_path):
+    context = multiprocessing.get_context('spawn')
+    elected = context.Queue()
+    processes = [context.Process(target=candidate, args=(str(tmp_path / 'status.bin'), elected)) for _ in range(3)]
+    for process in processes:
+        process.start()
+    try:
+        writer = elected.get(timeout=30)
+        time.sleep(1.0)
+        assert elected.empty()  # Nobody else got elected
+
+        next(p for p in processes if p.pid == writer).terminate()
+        successor = elected.get(timeout=30)
+        assert successor != writer and successor in {p.pid for p in processes}
+        time.sleep(1.0)
+        assert elected.empty()
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join(timeout=10)
+
+
+def write_events(path, statuses_per_frame, done):
+    table = status_table.set_status_table(path, lots=8, slots=16)
+    log = LotEventLog(debounce_frames=1)
+    for statuses in statuses_per_frame:
+        log.update(statuses)
+        status_table.publish_status(7, statuses, log)
+    done.put((log.epoch, log.seq))
+    table.mm.close()
+
+
+@pytest.fixture
+def reader(tmp_path, monkeypatch):
+    path = str(tmp_path / 'status.bin')
+    monkeypatch.setattr(status_table, 'STATUS_TABLE', status_table.StatusTable(path, lots=8, slots=16))
+    monkeypatch.setattr(status_table, 'ROLE', 'reader')
+    return path
+
+
+def test_readers_share_the_writers_sequence(reader):
+    context = multiprocessing.get_context('spawn')
+    done = context.Queue()
+    frames = [{1: 'available', 2: 'full'}, {1: 'full', 2: 'full'}, {1: 'full', 2: 'available', 3: 'reserved'}]
+    writer = context.Process(target=write_events, args=(reader, frames, done))
+    writer.start()
+    epoch, seq = done.get(timeout=30)
+    writer.join(timeout=10)
+
+    log = SharedEventLog(7)
+    assert log.seq == seq
+    assert log.since(seq) == {'seq': seq, 'changes': []}
+    assert log.since(1) == {'seq': seq, 'reset': True, 'slots': frames[-1]}
+    assert log.etag(2) == f"{epoch}-2-{seq}"
+    assert log.wait(seq, timeout=0.3) is None
+    assert status_table.read_status(7) == frames[-1]
+
+
+def test_waiting_reader_sees_a_change(reader):
+    log = LotEventLog(debounce_frames=1)
+    log.update({1: 'available'})
+    status_table.publish_status(7, {1: 'available'}, log)
+    shared = SharedEventLog(7)
+    seq = shared.seq
+
+    log.update({1: 'full'})
+    status_table.publish_status(7, {1: 'full'}, log)
+    assert shared.wait(seq, timeout=2.0) == {'seq': seq + 1, 'reset': True, 'slots': {1: 'full'}}